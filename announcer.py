@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def _numbers(key):
+    """待ち行列のキー（番号または番号のタプル）に含まれる番号"""
+    return key if isinstance(key, tuple) else (key,)
+
+
+class Announcer:
+    """呼び出し音声を1本のワーカースレッドで順番に再生する
+
+    playには play(番号, cancelled) を渡す。再生が終わるまで戻らず、
+    cancelled（threading.Event）がセットされたら途中で止めること。
+    まとめて呼び出した番号は1回の呼び出しとして、番号のタプルを渡す。
+    待ち行列は上限付きで、同じ番号が既に待っていれば追加しない。
+    """
+
+    def __init__(self, play, maxsize=16):
+        self.play = play
+        self.maxsize = maxsize
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()  # 番号（まとめた呼び出しは番号のタプル） -> 受付時刻
+        self.current = None
+        self.current_cancelled = set()  # 再生中の呼び出しのうち取り消された番号
+        self.queued_at = None  # 再生中の呼び出しを受け付けた時刻（perf_counter）
+        self.cancelled = threading.Event()
+        self.running = True
+
+        self.announced = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.cancelled_count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+        self.thread = threading.Thread(target=self._run, name="announcer", daemon=True)
+        self.thread.start()
+
+    def announce(self, number):
+        """番号（複数なら番号のリスト）の呼び出しを予約。予約できなければFalseを返す
+
+        複数の番号は1回の呼び出しにまとめる。既に待っている番号は除く。
+        """
+        numbers = [number] if isinstance(number, int) else list(dict.fromkeys(number))
+        with self.cond:
+            waiting = {n for key in self.pending for n in _numbers(key)}
+            numbers = [n for n in numbers if n not in waiting]
+            if not numbers:
+                self.coalesced += 1
+                return False
+            if len(self.pending) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self.pending[numbers[0] if len(numbers) == 1 else tuple(numbers)] = time.perf_counter()
+            self.cond.notify()
+            return True
+
+    def cancel(self, number):
+        """取り消された番号の呼び出しをやめる（再生中なら、まとめた番号がすべて取り消されたら止める）"""
+        with self.cond:
+            for key in self.pending:
+                if number in _numbers(key):
+                    remaining = tuple(n for n in _numbers(key) if n != number)
+                    if len(remaining) == 1:
+                        remaining = remaining[0]
+                    self.pending = OrderedDict(
+                        (remaining if k == key else k, queued_at) for k, queued_at in self.pending.items()
+                        if k != key or remaining)
+                    self.cancelled_count += 1
+                    return
+            if self.current is not None and number in _numbers(self.current):
+                self.cancelled_count += 1
+                self.current_cancelled.add(number)
+                if self.current_cancelled.issuperset(_numbers(self.current)):
+                    self.cancelled.set()
+
+    def queue_depth(self):
+        """再生待ちの件数"""
+        with self.cond:
+            return len(self.pending)
+
+    def stats(self):
+        """待ち行列と再生開始までの遅延の状況"""
+        with self.cond:
+            return {
+                "queue_depth": len(self.pending),
+                "announced": self.announced,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled_count,
+                "last_latency": self.last_latency,
+                "max_latency": self.max_latency,
+                "avg_latency": self.total_latency / self.announced if self.announced else 0.0,
+            }
+
+    def stop(self, timeout=None):
+        """待ち行列を破棄してワーカーを止める"""
+        with self.cond:
+            self.running = False
+            self.pending.clear()
+            self.cancelled.set()
+            self.cond.notify()
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                number, queued_at = self.pending.popitem(last=False)
+                self.current = number
+                self.current_cancelled = set()
+                self.queued_at = queued_at
+                self.cancelled.clear()
+                latency = time.perf_counter() - queued_at
+                self.announced += 1
+                self.last_latency = latency
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            try:
+                self.play(number, self.cancelled)
+            except Exception as e:
+                print(f"音声の再生に失敗しました: {number} ({e})")
+            finally:
+                with self.cond:
+                    self.current = None
@@ -0,0 +1,191 @@
+"""3つのクリップ（「番号」+ 番号 + 「できあがり」）を1つの音声につなげる
+
+ミキサーの形式（サンプリング周波数・チャンネル数、16bit符号付き）に合わせて
+変換・リサンプリングしてから連結するので、再生時は1回のplayで途切れなく流れる。
+リサンプリングはaudioop（Python 3.12まで）があればC実装で行い、なければ線形補間で行う（遅いだけ）。
+
+事前に作っておく場合:
+    python audio_render.py --rate 44100 --channels 2
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import threading
+import warnings
+import wave
+from array import array
+from contextlib import contextmanager
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop
+except ImportError:  # Python 3.13以降
+    audioop = None
+
+SAMPLE_WIDTH = 2  # 出力は16bit符号付きPCMのみ
+
+
+def announcement_dir(sound_dir, rate, channels):
+    """ミキサーの形式ごとの出力先フォルダ"""
+    return os.path.join(sound_dir, "announce", f"{rate}hz_{channels}ch")
+
+
+def announcement_path(sound_dir, rate, channels, number):
+    """番号ごとの連結済み音声のパス"""
+    return os.path.join(announcement_dir(sound_dir, rate, channels), f"call_{number}.wav")
+
+
+def read_wav(path):
+    """WAVを読み込み、(サンプリング周波数, チャンネル数, 16bitのサンプル列) を返す"""
+    with wave.open(path, "rb") as wav:
+        rate = wav.getframerate()
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        data = wav.readframes(wav.getnframes())
+    return rate, channels, _to_int16(data, width)
+
+
+def _to_int16(data, width):
+    """PCMのバイト列を16bit符号付きのサンプル列に変換"""
+    if width == 1:
+        # 8bitのWAVは符号なし
+        return array("h", ((value - 128) << 8 for value in data))
+    if width == 2:
+        samples = array("h", data)
+        if sys.byteorder == "big":
+            samples.byteswap()
+        return samples
+    if width == 4:
+        samples = array("i", data)
+        if sys.byteorder == "big":
+            samples.byteswap()
+        return array("h", (value >> 16 for value in samples))
+    raise ValueError(f"未対応のサンプル幅です: {width * 8}bit")
+
+
+def convert(samples, src_rate, src_channels, dst_rate, dst_channels):
+    """チャンネル数とサンプリング周波数を変換（線形補間）"""
+    if src_channels == dst_channels and src_rate == dst_rate:
+        return samples
+
+    # チャンネルごとに分ける（リサンプリングは増やす前のチャンネルだけ行う）
+    tracks = [samples[c::src_channels] for c in range(src_channels)]
+    if dst_channels == 1 and src_channels > 1:
+        tracks = [array("h", (sum(values) // src_channels for values in zip(*tracks)))]
+    elif dst_channels != src_channels and src_channels != 1:
+        raise ValueError(f"未対応のチャンネル変換です: {src_channels}ch -> {dst_channels}ch")
+
+    if src_rate != dst_rate:
+        tracks = [_resample(track, src_rate, dst_rate) for track in tracks]
+    if dst_channels > 1 and src_channels == 1:
+        tracks = tracks * dst_channels
+
+    if len(tracks) == 1:
+        return tracks[0]
+    out = array("h", bytes(SAMPLE_WIDTH * len(tracks[0]) * len(tracks)))
+    for c, track in enumerate(tracks):
+        out[c::len(tracks)] = track
+    return out
+
+
+def _resample(track, src_rate, dst_rate):
+    """1チャンネル分のサンプル列を線形補間でリサンプリング"""
+    if not track:
+        return array("h")
+    if audioop is not None:
+        return array("h", audioop.ratecv(track.tobytes(), SAMPLE_WIDTH, 1, src_rate, dst_rate, None)[0])
+    length = len(track)
+    count = length * dst_rate // src_rate
+    step = src_rate / dst_rate
+    last = length - 1
+    out = array("h", bytes(SAMPLE_WIDTH * count))
+    for i in range(count):
+        pos = i * step
+        j = int(pos)
+        a = track[j]
+        b = track[j + 1] if j < last else a
+        out[i] = int(a + (b - a) * (pos - j))
+    return out
+
+
+def render_announcement(paths, rate, channels, converted=None):
+    """クリップを指定の形式に揃えて1つのPCMバイト列に連結
+
+    convertedに辞書を渡すと変換済みのクリップを使い回す（共通の前置き・後置き用）。
+    """
+    out = array("h")
+    for path in paths:
+        samples = converted.get(path) if converted is not None else None
+        if samples is None:
+            src_rate, src_channels, samples = read_wav(path)
+            samples = convert(samples, src_rate, src_channels, rate, channels)
+            if converted is not None:
+                converted[path] = samples
+        out.extend(samples)
+    if sys.byteorder == "big":
+        out.byteswap()
+    return out.tobytes()
+
+
+@contextmanager
+def atomic_write(path):
+    """一時ファイルに書き込み、最後まで書けたらpathへ置き換える（書き込み途中のファイルは残さない）"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_wav(path, rate, channels, frames):
+    """16bitのPCMバイト列をWAVとして保存"""
+    with atomic_write(path) as f, wave.open(f, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+
+
+def clip_numbers(sound_dir):
+    """番号の音声が用意されている番号の一覧"""
+    numbers = []
+    for path in glob.glob(os.path.join(sound_dir, "metan_*.wav")):
+        match = re.fullmatch(r"metan_(\d+)\.wav", os.path.basename(path))
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+def build_all(sound_dir, rate, channels):
+    """全ての番号の連結済み音声を作成"""
+    prefix = os.path.join(sound_dir, "metan_num.wav")
+    suffix = os.path.join(sound_dir, "metan_providing.wav")
+    shared = {}
+    built = []
+    for number in clip_numbers(sound_dir):
+        clip = os.path.join(sound_dir, f"metan_{number}.wav")
+        path = announcement_path(sound_dir, rate, channels, number)
+        frames = render_announcement([prefix, clip, suffix], rate, channels, converted=shared)
+        write_wav(path, rate, channels, frames)
+        shared.pop(clip, None)
+        built.append(path)
+    return built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="呼び出し音声を番号ごとに1つのWAVへ連結する")
+    parser.add_argument("--sound-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sound"))
+    parser.add_argument("--rate", type=int, default=44100, help="ミキサーのサンプリング周波数")
+    parser.add_argument("--channels", type=int, default=2, help="ミキサーのチャンネル数")
+    args = parser.parse_args()
+
+    for path in build_all(args.sound_dir, args.rate, args.channels):
+        print(path)
@@ -0,0 +1,280 @@
+"""混雑時を想定したベンチマーク（画面・音声なしで動かす）
+
+Tk・customtkinter・pygameをモックに差し替え、トッピング選択ダイアログも自動で答えるようにして、
+NumberDisplayAppの操作メソッドを合成した負荷（毎分の注文数・トッピングの比率・取り消し率）で呼び出す。
+操作ごとの処理時間（再描画を含む）のp50/p95/p99とSQLの実行回数をJSONで出力するので、
+バージョン間で結果を比べられる。時間は仮想時間で進めるので、待ち時間は発生しない。
+
+    python bench.py --profile rush
+    python bench.py --profile lunch --seed 2 --output before.json
+"""
+import argparse
+import contextlib
+import heapq
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from unittest.mock import MagicMock
+
+# 負荷の設定（時間は秒、分は仮想時間）
+PROFILES = {
+    "smoke": {"orders_per_minute": 6, "minutes": 3, "cook_seconds": 60, "pickup_seconds": 20, "undo_rate": 0.2},
+    "steady": {"orders_per_minute": 2, "minutes": 60, "cook_seconds": 240, "pickup_seconds": 60, "undo_rate": 0.02},
+    "lunch": {"orders_per_minute": 6, "minutes": 30, "cook_seconds": 180, "pickup_seconds": 60, "undo_rate": 0.05},
+    "rush": {"orders_per_minute": 12, "minutes": 15, "cook_seconds": 100, "pickup_seconds": 30, "undo_rate": 0.1},
+}
+
+# トッピングの比率（1注文あたり1〜3個を選ぶ。config.jsonのトッピング名に合わせる）
+TOPPING_WEIGHTS = {
+    "はちみつ": 30,
+    "チョコソース": 25,
+    "ケチャップ＆マスタード": 15,
+    "ケチャップのみ": 8,
+    "マスタードのみ": 4,
+    "プレーン": 15,
+    "後でトッピング": 3,
+}
+
+
+class HeadlessMaster(MagicMock):
+    """メインウィンドウの代わり。afterの予約は実行せず、再描画はベンチ側でflushする"""
+
+    def after(self, ms, func=None, *args):
+        return f"after#{id(func)}"
+
+    def after_idle(self, func, *args):
+        return f"idle#{id(func)}"
+
+    def after_cancel(self, after_id):
+        pass
+
+
+class Var:
+    """tk.BooleanVarの代わり"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+def install_stubs():
+    """GUIと音声のモジュールをモックに差し替える（mainをimportする前に呼ぶ）"""
+    for name in ("tkinter", "tkinter.ttk", "customtkinter", "pygame"):
+        sys.modules[name] = MagicMock()
+    sys.modules["tkinter"].ttk = sys.modules["tkinter.ttk"]
+
+
+def create_headless_app(open_dialog, config=None):
+    """画面・音声なしでNumberDisplayAppを作る（作業ディレクトリのorders.dbを使う）
+
+    トッピング選択のダイアログはopen_dialog(root)の戻り値で、音声は鳴らさず待ち行列への追加までを行う。
+    configを渡すとconfig.jsonの代わりに使う。
+    """
+    install_stubs()
+    for name in ("DISPLAY_SERVER_PORT", "SESSION_LOG"):
+        os.environ.pop(name, None)
+    import main
+    import play_sound
+    from announcer import Announcer
+
+    play_sound.announcer.stop(timeout=1)
+    play_sound.announcer = Announcer(lambda number, cancelled: None, maxsize=play_sound.ANNOUNCE_QUEUE_SIZE)
+    play_sound.start = lambda: None
+    main.open_dialog = open_dialog
+    if config is not None:
+        main.load_config = lambda: dict(config)
+
+    app = main.NumberDisplayApp(HeadlessMaster())
+    app.is_auto = Var(False)
+    app.is_multi = Var(False)
+    return app
+
+
+def flush_refresh(app):
+    """予約された再描画をすぐに行う"""
+    for scheduler in (app.panel_refresh, app.display_refresh, app.prep_refresh):
+        if scheduler.pending:
+            scheduler.flush()
+
+
+def percentile(sorted_values, p):
+    """nearest-rank法でのp%点"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[rank - 1]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Bench:
+    """1つの負荷設定でアプリを動かし、操作ごとの計測結果を集める"""
+
+    def __init__(self, profile, seed=0):
+        self.profile = profile
+        self.random = random.Random(seed)
+        self.latencies = defaultdict(list)  # 操作名 -> [ミリ秒, ...]
+        self.db_ops = defaultdict(int)  # 操作名 -> SQLの実行回数の合計
+        self.commits = defaultdict(int)
+        self.sql_count = 0
+        self.commit_count = 0
+        self.rejected = 0
+
+    def random_order(self, root=None):
+        """open_dialogの代わりに、比率に沿ったトッピングを選ぶ"""
+        toppings = self.random.choices(list(TOPPING_WEIGHTS), weights=list(TOPPING_WEIGHTS.values()),
+                                       k=self.random.randint(1, 3))
+        order = {}
+        for topping in toppings:
+            order[topping] = order.get(topping, 0) + 1
+        return list(order.items())
+
+    def _trace(self, sql):
+        self.sql_count += 1
+        if sql.lstrip().upper().startswith("COMMIT"):
+            self.commit_count += 1
+
+    def create_app(self):
+        # 音声は鳴らさず、呼び出しの受付（待ち行列への追加）までを測る
+        app = create_headless_app(self.random_order)
+        app.is_auto = Var(True)
+        app.db_manager.conn.set_trace_callback(self._trace)
+        self.app = app
+        self.writer = app.core.writer
+        return app
+
+    def measure(self, name, action):
+        """操作を1回実行し、予約された再描画まで含めた時間を記録する
+
+        DBへの書き込みは裏のスレッドで行うので時間には含めず、SQLの回数を数えるためにコミットを待つ。
+        """
+        sql_before, commits_before = self.sql_count, self.commit_count
+        start = time.perf_counter()
+        action()
+        flush_refresh(self.app)
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        self.writer.flush()
+        self.db_ops[name] += self.sql_count - sql_before
+        self.commits[name] += self.commit_count - commits_before
+
+    def run(self, app):
+        """仮想時間で注文の到着・調理・受け渡しを進める"""
+        profile = self.profile
+        events = []  # (時刻, 連番, 操作名)
+        seq = 0
+        t = 0.0
+        end = profile["minutes"] * 60
+        while True:
+            t += self.random.expovariate(profile["orders_per_minute"] / 60)
+            if t >= end:
+                break
+            events.append((t, seq, "cooking_number"))
+            seq += 1
+        heapq.heapify(events)
+
+        while events:
+            t, _, name = heapq.heappop(events)
+            if name == "cooking_number" and app.order_store.next_number() is None:
+                self.rejected += 1  # 番号がすべて使用中
+                self.measure(name, app.cooking_number)
+                continue
+
+            self.measure(name, getattr(app, name))
+            if self.random.random() < profile["undo_rate"]:
+                # 押し間違いを取り消して、もう一度やり直す
+                self.measure("undo_action", app.undo_action)
+                self.measure("redo_action", app.redo_action)
+
+            if name == "cooking_number":
+                delay, follow = profile["cook_seconds"], "provide_number"
+            elif name == "provide_number":
+                delay, follow = profile["pickup_seconds"], "complete_provide"
+            else:
+                continue
+            heapq.heappush(events, (t + self.random.uniform(0.5, 1.5) * delay, seq, follow))
+            seq += 1
+
+    def results(self):
+        actions = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            actions[name] = {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50), 3),
+                "p95_ms": round(percentile(values, 95), 3),
+                "p99_ms": round(percentile(values, 99), 3),
+                "max_ms": round(values[-1], 3),
+                "db_ops_per_action": round(self.db_ops[name] / len(values), 2),
+                "commits_per_action": round(self.commits[name] / len(values), 2),
+            }
+        result = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "profile": self.profile,
+            "rejected_orders": self.rejected,
+            "actions": actions,
+        }
+        from metrics import registry as metrics
+        if metrics.enabled:
+            # METRICS=1 で実行すると、DB呼び出しや再描画ごとの内訳も出力する
+            result["metrics"] = metrics.to_dict()
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="混雑時の負荷で操作の処理時間を測る")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="lunch")
+    parser.add_argument("--orders-per-minute", type=float)
+    parser.add_argument("--minutes", type=float)
+    parser.add_argument("--undo-rate", type=float)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    profile = dict(PROFILES[args.profile], name=args.profile)
+    for key in ("orders_per_minute", "minutes", "undo_rate"):
+        if getattr(args, key) is not None:
+            profile[key] = getattr(args, key)
+
+    bench = Bench(profile, args.seed)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as workdir:
+        # orders.dbは作業用のディレクトリに作る
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            # アプリのprintは結果のJSONと混ざらないよう標準エラーへ
+            with contextlib.redirect_stdout(sys.stderr):
+                app = bench.create_app()
+                bench.run(app)
+            app.core.close()
+        finally:
+            os.chdir(cwd)
+
+    text = json.dumps(bench.results(), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""設定ファイル（config.json）の読み込み"""
+import json
+import os
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+# config.jsonがない・項目が足りないときに使う値
+DEFAULTS = {
+    "max_number": 30,
+    "toppings": ["はちみつ", "チョコソース", "ケチャップ＆マスタード", "ケチャップのみ", "マスタードのみ",
+                 "プレーン", "後でトッピング"],
+}
+
+
+def load_config(path=CONFIG_PATH):
+    """設定を読み込む。読めなかった場合は既定値を使う"""
+    config = dict(DEFAULTS)
+    try:
+        with open(path, encoding="utf-8") as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"設定ファイルを読み込めませんでした（既定値を使います）: {e}")
+    return config
@@ -0,0 +1,147 @@
+"""注文・整理番号の操作（画面や音声に依存しない）
+
+NumberDisplayAppの各ボタンの処理から、Tk・pygameに触れない部分を取り出したもの。
+テストやスクリプトからはこれだけをimportすれば、音声デバイスを開かずに操作できる。
+"""
+import os
+from database import DatabaseManager, HistoryManager, import_legacy_history
+from db_writer import DatabaseWriter
+from order_store import OrderStore, OrderError
+from wait_estimator import WaitEstimator, SEED_SAMPLES
+from prep_board import PrepCounts
+
+STATUS_LABELS = {
+    "none": "未注文",
+    "cooking": "調理中",
+    "providing": "呼出中",
+    "served": "提供済み",
+}
+
+
+class OrderCore:
+    """注文の受付・呼び出し・提供・取り消しをまとめたもの"""
+
+    def __init__(self, db_name='orders.db', max_number=30, legacy_history='history.db', background_writes=False):
+        """background_writes=Trueなら、DBへの書き込みは裏のスレッドでまとめてコミットする"""
+        self.max_number = max_number
+
+        # データベースの初期化
+        self.db_manager = DatabaseManager(db_name, check_same_thread=not background_writes)
+
+        # 整理番号の履歴管理（注文と同じDBに保存する）
+        self.history_manager = HistoryManager(self.db_manager)
+        if legacy_history and os.path.exists(legacy_history):
+            # 旧バージョンの履歴ファイルを一度だけ取り込む
+            import_legacy_history(self.db_manager, legacy_history)
+
+        # DBへの書き込み（start()しなければ操作の中でそのままコミットする）
+        self.writer = DatabaseWriter(self.db_manager)
+        if background_writes:
+            self.writer.start()
+
+        # 注文状態のメモリ上のモデル（読み出しはここから行う）
+        self.store = OrderStore(self.db_manager, self.history_manager, max_number, writer=self.writer)
+
+        # 待ち時間の見積もり（起動時に直近の分を読み、以降は呼び出しのたびに更新する）
+        self.wait_estimator = WaitEstimator(self.store)
+        with self.writer.reading() as db:
+            self.wait_estimator.seed(db.get_recent_cook_times(SEED_SAMPLES))
+
+        # キッチン向けのトッピングごとの枚数（イベントごとに増減する）
+        self.prep_counts = PrepCounts(self.store)
+
+    # ---- 読み出し ----
+    def next_auto_number(self):
+        """オートモードで次に使う番号。空きがなければOrderError"""
+        number = self.store.next_number()
+        if number is None:
+            raise OrderError("無効な番号または既に呼び出し中です。")
+        return number
+
+    def needs_order(self, number):
+        """調理中にするときに注文内容の入力が必要か（未使用・提供済みの番号）"""
+        return self.store.status_of(number) not in ('cooking', 'providing')
+
+    # ---- 操作 ----
+    def add_auto(self, number, order):
+        """オートモードで注文を追加する。番号が1番に戻ったらTrueを返す"""
+        if not order:
+            raise OrderError("トッピングを選択してください")
+        # 注文と番号の払い出しをまとめて書き込む
+        with self.store.transaction():
+            self.store.add_order(number, order, 'cooking')
+            return self.store.commit_allocation(number)
+
+    def transfer_first(self, current_status, next_status):
+        """current_statusで最も古い番号をnext_statusへ移し、その番号を返す（なければNone）"""
+        number = self.store.first_number(current_status)
+        if number is not None:
+            self.store.update_status(number, next_status)
+        return number
+
+    def start_cooking(self, number, order=None):
+        """番号を調理中にする。呼出中なら調理中に戻し、未使用ならorderを注文として追加する"""
+        status = self.store.status_of(number)
+        if not number or status == 'cooking':
+            raise OrderError("既に調理中です。")
+        if status == 'providing':
+            self.store.update_status(number, 'cooking')
+            return
+        if not order:
+            raise OrderError("トッピングを選択してください")
+        self.store.add_order(number, order, 'cooking')
+
+    def call(self, number):
+        """調理中の番号を呼出中にする"""
+        self.call_many([number])
+
+    def call_many(self, numbers):
+        """調理中の番号をまとめて呼出中にする（1回の操作として取り消せる）"""
+        self._transfer_many(numbers, 'cooking', 'providing', "呼出中に存在しない番号です。")
+
+    def complete(self, number):
+        """呼出中の番号を提供済みにする"""
+        self.complete_many([number])
+
+    def complete_many(self, numbers):
+        """呼出中の番号をまとめて提供済みにする（1回の操作として取り消せる）"""
+        self._transfer_many(numbers, 'providing', 'served', "呼出中リストに存在しない番号です。")
+
+    def undo(self):
+        """最後の操作を取り消し、そのTransitionのタプルを返す"""
+        action = self.store.undo()
+        if action is None:
+            raise OrderError("やり直し可能な操作がありません。")
+        return action
+
+    def redo(self):
+        """取り消した操作をもう一度行い、そのTransitionのタプルを返す"""
+        action = self.store.redo()
+        if action is None:
+            raise OrderError("やり直せる操作がありません。")
+        return action
+
+    def archive(self, older_than):
+        """提供済みになってからolder_than秒たった注文をアーカイブし、古いログを捨てる（件数を返すFuture）"""
+        archived = self.store.archive_served(older_than)
+        self.store.prune_log()
+        return archived
+
+    def check_writes(self):
+        """裏での書き込みに失敗していたら状態をDBの内容に戻し、その例外を返す（なければNone）"""
+        return self.store.check_writes()
+
+    def _transfer_many(self, numbers, current_status, next_status, message):
+        """すべてcurrent_statusの番号なら、まとめてnext_statusへ移す（1つでも違えば何もしない）"""
+        numbers = list(dict.fromkeys(numbers))
+        invalid = [number for number in numbers if self.store.status_of(number) != current_status]
+        if not numbers or invalid:
+            if len(numbers) > 1 and invalid:
+                message = f"{message}（{'、'.join(map(str, invalid))}）"
+            raise OrderError(message)
+        self.store.update_statuses(numbers, next_status)
+
+    def close(self):
+        """書き込み待ちの分をすべてコミットしてから閉じる"""
+        self.writer.close()
+        self.db_manager.conn.close()
@@ -0,0 +1,515 @@
+import os
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+
+def connect(db_name, check_same_thread=True):
+    """WALモードと書き込み向けのPRAGMAを設定して接続する"""
+    conn = sqlite3.connect(db_name, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # WALではNORMALでもコミット済みのデータは壊れない（電源断で直近のコミットが消える可能性のみ）
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -8000")  # 約8MB
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def now_epoch():
+    """現在時刻をUNIX時間（秒）で取得"""
+    return int(time.time())
+
+
+def _create_orders(conn):
+    """v1: トッピングごとに1行の旧スキーマ"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS orders (
+                        id INTEGER PRIMARY KEY,
+                        number INTEGER NOT NULL,
+                        topping TEXT NOT NULL,
+                        order_count INTEGER NOT NULL,
+                        status TEXT NOT NULL,
+                        accepted_at TIMESTAMP DEFAULT (datetime(CURRENT_TIMESTAMP, '+9 hours')),
+                        updated_at TIMESTAMP DEFAULT (datetime(CURRENT_TIMESTAMP, '+9 hours'))
+                    )''')
+
+
+def _split_tickets(conn):
+    """v2: 整理番号ごとのticketsと、トッピングごとのorder_itemsに分割する
+
+    旧ordersの行は、同じ番号・同じステータスで連続して受け付けた行を1枚の注文にまとめる。
+    旧スキーマの時刻はJSTの文字列なので、UNIX時間に変換して移す。
+    """
+    conn.execute('''CREATE TABLE tickets (
+                        id INTEGER PRIMARY KEY,
+                        number INTEGER NOT NULL,
+                        status TEXT NOT NULL,
+                        accepted_at INTEGER NOT NULL,
+                        called_at INTEGER,
+                        served_at INTEGER,
+                        updated_at INTEGER NOT NULL
+                    )''')
+    conn.execute('''CREATE TABLE order_items (
+                        id INTEGER PRIMARY KEY,
+                        ticket_id INTEGER NOT NULL REFERENCES tickets(id),
+                        topping TEXT NOT NULL,
+                        order_count INTEGER NOT NULL
+                    )''')
+    conn.execute("CREATE INDEX idx_tickets_status ON tickets (status, id)")
+    conn.execute("CREATE INDEX idx_tickets_number ON tickets (number, status)")
+    conn.execute("CREATE INDEX idx_tickets_updated_at ON tickets (updated_at)")
+    conn.execute("CREATE INDEX idx_order_items_ticket ON order_items (ticket_id)")
+
+    rows = conn.execute('''SELECT number, topping, order_count, status,
+                                  CAST(strftime('%s', accepted_at, '-9 hours') AS INTEGER),
+                                  CAST(strftime('%s', updated_at, '-9 hours') AS INTEGER)
+                           FROM orders ORDER BY id ASC''')
+    last_key = None
+    ticket_id = None
+    for number, topping, order_count, status, accepted_at, updated_at in rows.fetchall():
+        accepted_at = accepted_at if accepted_at is not None else now_epoch()
+        updated_at = updated_at if updated_at is not None else accepted_at
+        if (last_key is None or last_key[:2] != (number, status)
+                or abs(accepted_at - last_key[2]) > 2):
+            called_at = updated_at if status in ('providing', 'served') else None
+            served_at = updated_at if status == 'served' else None
+            cursor = conn.execute(
+                "INSERT INTO tickets (number, status, accepted_at, called_at, served_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (number, status, accepted_at, called_at, served_at, updated_at))
+            ticket_id = cursor.lastrowid
+        last_key = (number, status, accepted_at)
+        conn.execute("INSERT INTO order_items (ticket_id, topping, order_count) VALUES (?, ?, ?)",
+                     (ticket_id, topping, order_count))
+
+    conn.execute("DROP TABLE orders")
+
+
+def _create_history(conn):
+    """v3: 別ファイルだった整理番号の履歴を同じデータベースに置く"""
+    conn.execute('''CREATE TABLE history (
+                        id INTEGER PRIMARY KEY,
+                        number INTEGER NOT NULL,
+                        used_at INTEGER NOT NULL
+                    )''')
+
+
+def _create_allocator(conn):
+    """v4: 整理番号の払い出し位置（カーソル）を保存する。続きの番号は履歴から引き継ぐ"""
+    conn.execute('''CREATE TABLE allocator (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        cursor INTEGER NOT NULL
+                    )''')
+    conn.execute('''INSERT INTO allocator (id, cursor)
+                    SELECT 1, COALESCE((SELECT number FROM history ORDER BY id DESC LIMIT 1) + 1, 1)''')
+
+
+TICKET_COLUMNS = '''number INTEGER NOT NULL,
+                        status TEXT NOT NULL,
+                        accepted_at INTEGER NOT NULL,
+                        called_at INTEGER,
+                        served_at INTEGER,
+                        updated_at INTEGER NOT NULL'''
+ORDER_ITEM_COLUMNS = '''ticket_id INTEGER NOT NULL,
+                        topping TEXT NOT NULL,
+                        order_count INTEGER NOT NULL'''
+
+
+def _create_archive(conn):
+    """v5: 提供済みの注文を移すアーカイブテーブルを作る
+
+    アーカイブした注文のIDが再利用されないよう、tickets/order_itemsをAUTOINCREMENTで作り直す。
+    集計用に、現役とアーカイブをまとめたビュー（all_tickets/all_order_items）も用意する。
+    """
+    conn.execute(f"CREATE TABLE tickets_v5 (id INTEGER PRIMARY KEY AUTOINCREMENT, {TICKET_COLUMNS})")
+    conn.execute("INSERT INTO tickets_v5 SELECT id, number, status, accepted_at, called_at, served_at, updated_at FROM tickets")
+    conn.execute("DROP TABLE tickets")
+    conn.execute("ALTER TABLE tickets_v5 RENAME TO tickets")
+    conn.execute("CREATE INDEX idx_tickets_status ON tickets (status, id)")
+    conn.execute("CREATE INDEX idx_tickets_number ON tickets (number, status)")
+    conn.execute("CREATE INDEX idx_tickets_updated_at ON tickets (updated_at)")
+
+    conn.execute(f"CREATE TABLE order_items_v5 (id INTEGER PRIMARY KEY AUTOINCREMENT, {ORDER_ITEM_COLUMNS})")
+    conn.execute("INSERT INTO order_items_v5 SELECT id, ticket_id, topping, order_count FROM order_items")
+    conn.execute("DROP TABLE order_items")
+    conn.execute("ALTER TABLE order_items_v5 RENAME TO order_items")
+    conn.execute("CREATE INDEX idx_order_items_ticket ON order_items (ticket_id)")
+
+    conn.execute(f"CREATE TABLE tickets_archive (id INTEGER PRIMARY KEY, {TICKET_COLUMNS})")
+    conn.execute(f"CREATE TABLE order_items_archive (id INTEGER PRIMARY KEY, {ORDER_ITEM_COLUMNS})")
+    conn.execute("CREATE INDEX idx_tickets_archive_served_at ON tickets_archive (served_at)")
+    conn.execute("CREATE INDEX idx_order_items_archive_ticket ON order_items_archive (ticket_id)")
+
+    conn.execute("CREATE VIEW all_tickets AS SELECT * FROM tickets UNION ALL SELECT * FROM tickets_archive")
+    conn.execute("CREATE VIEW all_order_items AS SELECT * FROM order_items UNION ALL SELECT * FROM order_items_archive")
+
+
+def _create_transitions(conn):
+    """v6: ステータスの変化を1件ずつ記録するログ（やり直し・取り消しのやり直し用）
+
+    stateは 'done'（有効）/ 'undone'（取り消し済み）/ 'dropped'（新しい操作で再実行できなくなった）。
+    注文の追加（old_status='none'）は再実行のためにitemsへ注文内容をJSONで残す。
+    """
+    conn.execute('''CREATE TABLE transitions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ticket_id INTEGER NOT NULL,
+                        number INTEGER NOT NULL,
+                        old_status TEXT NOT NULL,
+                        new_status TEXT NOT NULL,
+                        items TEXT,
+                        state TEXT NOT NULL DEFAULT 'done',
+                        created_at INTEGER NOT NULL
+                    )''')
+    conn.execute("CREATE INDEX idx_transitions_state ON transitions (state, id)")
+    conn.execute("CREATE INDEX idx_transitions_ticket ON transitions (ticket_id)")
+
+
+def _add_transition_actions(conn):
+    """v7: まとめて行った操作（一括の呼び出しなど）を1回で取り消せるよう、ログに操作ごとのIDを追加"""
+    conn.execute("ALTER TABLE transitions ADD COLUMN action_id INTEGER")
+    conn.execute("UPDATE transitions SET action_id = id")
+
+
+def _add_transition_cursor(conn):
+    """v8: オートモードで払い出した注文の追加のログに、払い出し前のカーソルを残す（取り消しで戻す位置）"""
+    conn.execute("ALTER TABLE transitions ADD COLUMN cursor INTEGER")
+
+
+# (バージョン, 移行処理) の一覧。新しい変更は末尾に追加する
+MIGRATIONS = [
+    (1, _create_orders),
+    (2, _split_tickets),
+    (3, _create_history),
+    (4, _create_allocator),
+    (5, _create_archive),
+    (6, _create_transitions),
+    (7, _add_transition_actions),
+    (8, _add_transition_cursor),
+]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """PRAGMA user_versionを見て、未適用の移行処理を順番に適用する"""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, migration in migrations:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
+
+class DatabaseManager:
+    """注文のデータベース（接続とトランザクションの管理を含む）"""
+
+    def __init__(self, db_name='orders.db', check_same_thread=True):
+        """check_same_thread=Falseにすると、書き込み用のスレッド（DatabaseWriter）からも使える"""
+        self.conn = connect(db_name, check_same_thread)
+        self.transaction_depth = 0
+        self.create_table()
+
+    def create_table(self):
+        """データベーステーブルを作成・最新のスキーマへ移行する。時刻はUNIX時間で保存する"""
+        migrate(self.conn)
+
+    @contextmanager
+    def transaction(self):
+        """1回の操作での書き込みをまとめて1回のコミットにする（入れ子にしてもよい）"""
+        self.transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.conn.rollback()
+            raise
+        self.transaction_depth -= 1
+        if self.transaction_depth == 0:
+            try:
+                self.conn.commit()
+            except BaseException:
+                # コミットできなかった分を残すと、次の書き込みが同じトランザクションに入ってしまう
+                self.conn.rollback()
+                raise
+
+    def commit(self):
+        """トランザクションの外ならコミット"""
+        if self.transaction_depth == 0:
+            self.conn.commit()
+
+    def add_ticket(self, number, order, status, ticket_id=None, accepted_at=None):
+        """注文をデータベースに追加し、チケットIDを返す（ticket_idを指定すると同じIDで登録し直す）"""
+        now = now_epoch()
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO tickets (id, number, status, accepted_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                       (ticket_id, number, status, accepted_at or now, now))
+        ticket_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO order_items (ticket_id, topping, order_count) VALUES (?, ?, ?)",
+                           [(ticket_id, topping, order_count) for topping, order_count in order])
+        self.commit()
+        return ticket_id
+
+    def update_ticket_status(self, ticket_id, new_status):
+        """チケットIDでステータスを更新"""
+        now = now_epoch()
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE tickets
+            SET status = :status, updated_at = :now,
+                called_at = CASE WHEN :status = 'providing' AND called_at IS NULL THEN :now
+                                 WHEN :status = 'cooking' THEN NULL
+                                 ELSE called_at END,
+                served_at = CASE WHEN :status = 'served' THEN :now ELSE NULL END
+            WHERE id = :id
+        ''', {"status": new_status, "now": now, "id": ticket_id})
+        self.commit()
+
+    def update_number_status(self, number, new_status):
+        """番号のステータスを更新（提供済みの注文は対象外）"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id FROM tickets WHERE number = ? AND status != 'served'", (number,))
+        with self.transaction():
+            for (ticket_id,) in cursor.fetchall():
+                self.update_ticket_status(ticket_id, new_status)
+
+    def delete_ticket(self, ticket_id):
+        """チケットIDで注文を削除"""
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM order_items WHERE ticket_id = ?", (ticket_id,))
+        cursor.execute("DELETE FROM tickets WHERE id = ?", (ticket_id,))
+        self.commit()
+
+    def get_numbers_by_status(self, status):
+        """特定のステータスの番号を受付順で取得"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT number FROM tickets WHERE status = ? ORDER BY id ASC", (status,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_active_tickets(self):
+        """調理中・呼出中の注文を受付順で取得"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT t.id, t.number, t.status, t.accepted_at, i.topping, i.order_count
+            FROM tickets AS t JOIN order_items AS i ON i.ticket_id = t.id
+            WHERE t.status IN ('cooking', 'providing')
+            ORDER BY t.id ASC, i.id ASC
+        ''')
+        return cursor.fetchall()
+
+    def get_ticket(self, ticket_id):
+        """チケットIDで注文を取得 (number, status, accepted_at, [(topping, order_count), ...])（アーカイブ済みを含む）"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT number, status, accepted_at FROM all_tickets WHERE id = ?", (ticket_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute("SELECT topping, order_count FROM all_order_items WHERE ticket_id = ? ORDER BY id ASC",
+                       (ticket_id,))
+        return (*row, cursor.fetchall())
+
+    def archive_served(self, served_before):
+        """served_before（UNIX時間）より前に提供済みになった注文をアーカイブへ移し、件数を返す"""
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute('''
+                INSERT INTO order_items_archive
+                SELECT i.* FROM order_items AS i JOIN tickets AS t ON t.id = i.ticket_id
+                WHERE t.status = 'served' AND t.served_at < ?
+            ''', (served_before,))
+            cursor.execute('''
+                DELETE FROM order_items WHERE ticket_id IN
+                    (SELECT id FROM tickets WHERE status = 'served' AND served_at < ?)
+            ''', (served_before,))
+            cursor.execute("INSERT INTO tickets_archive SELECT * FROM tickets WHERE status = 'served' AND served_at < ?",
+                           (served_before,))
+            cursor.execute("DELETE FROM tickets WHERE status = 'served' AND served_at < ?", (served_before,))
+            return cursor.rowcount
+
+    def unarchive_ticket(self, ticket_id):
+        """アーカイブ済みの注文を現役のテーブルに戻す（やり直し用）"""
+        cursor = self.conn.cursor()
+        with self.transaction():
+            cursor.execute("INSERT INTO tickets SELECT * FROM tickets_archive WHERE id = ?", (ticket_id,))
+            if cursor.rowcount == 0:
+                return False
+            cursor.execute("INSERT INTO order_items SELECT * FROM order_items_archive WHERE ticket_id = ?", (ticket_id,))
+            cursor.execute("DELETE FROM order_items_archive WHERE ticket_id = ?", (ticket_id,))
+            cursor.execute("DELETE FROM tickets_archive WHERE id = ?", (ticket_id,))
+            return True
+
+    def get_recent_cook_times(self, limit):
+        """直近limit件の受付から呼び出しまでの秒数を古い順に取得（アーカイブ済みを含む）"""
+        cursor = self.conn.cursor()
+        cursor.execute('''SELECT called_at - accepted_at FROM all_tickets
+                          WHERE called_at IS NOT NULL ORDER BY id DESC LIMIT ?''', (limit,))
+        return [row[0] for row in reversed(cursor.fetchall())]
+
+    def last_id(self, table):
+        """AUTOINCREMENTのテーブルで最後に使ったID（削除した行の分も含む）"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def get_allocator_cursor(self):
+        """整理番号の払い出し位置を取得"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT cursor FROM allocator WHERE id = 1")
+        return cursor.fetchone()[0]
+
+    def set_allocator_cursor(self, value):
+        """整理番号の払い出し位置を保存"""
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE allocator SET cursor = ? WHERE id = 1", (value,))
+        self.commit()
+
+    def add_transition(self, ticket_id, number, old_status, new_status, items=None, created_at=None,
+                       transition_id=None, action_id=None):
+        """ステータスの変化をログに追加し、そのIDを返す。取り消し済みの操作は再実行できなくなる
+
+        同じaction_idのログは1回の操作としてまとめて取り消す（省略時はそのログだけで1回の操作）。
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE transitions SET state = 'dropped' WHERE state = 'undone'")
+        cursor.execute('''INSERT INTO transitions (id, ticket_id, number, old_status, new_status, items, created_at,
+                                                    action_id)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                       (transition_id, ticket_id, number, old_status, new_status,
+                        None if items is None else json.dumps(items, ensure_ascii=False), created_at or now_epoch(),
+                        action_id))
+        transition_id = cursor.lastrowid
+        if action_id is None:
+            cursor.execute("UPDATE transitions SET action_id = id WHERE id = ?", (transition_id,))
+        self.commit()
+        return transition_id
+
+    def set_transition_state(self, transition_id, state):
+        """ログの1件を取り消し済み（'undone'）や有効（'done'）にする"""
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE transitions SET state = ? WHERE id = ?", (state, transition_id))
+        self.commit()
+
+    def get_transitions(self, state, limit, newest_first=True):
+        """stateのログを最大limit件取得 (id, ticket_id, number, old_status, new_status, items, created_at, action_id, cursor)"""
+        order = "DESC" if newest_first else "ASC"
+        cursor = self.conn.cursor()
+        cursor.execute(f'''SELECT id, ticket_id, number, old_status, new_status, items, created_at, action_id, cursor
+                           FROM transitions WHERE state = ? ORDER BY id {order} LIMIT ?''', (state, limit))
+        return [(*row[:5], None if row[5] is None else [tuple(item) for item in json.loads(row[5])], *row[6:])
+                for row in cursor.fetchall()]
+
+    def set_transition_cursor(self, transition_id, value):
+        """注文の追加のログに、オートモードで払い出す前のカーソルを記録する"""
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE transitions SET cursor = ? WHERE id = ?", (value, transition_id))
+        self.commit()
+
+    def delete_transitions(self, transition_ids):
+        """ログを削除する（取り消せなくなったログを捨てるとき）"""
+        cursor = self.conn.cursor()
+        cursor.executemany("DELETE FROM transitions WHERE id = ?", [(transition_id,) for transition_id in transition_ids])
+        self.commit()
+
+    def prune_transitions(self, keep):
+        """新しい方からkeep件を残してログを削除し、削除した件数を返す
+
+        まとめて行った操作（同じaction_id）の途中では切らず、境目の操作は丸ごと残す。
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            DELETE FROM transitions WHERE action_id < (
+                SELECT MIN(action_id) FROM (SELECT action_id FROM transitions ORDER BY id DESC LIMIT ?))
+        ''', (keep,))
+        self.commit()
+        return cursor.rowcount
+
+    def get_all_orders(self):
+        """全ての注文を取得（アーカイブ済みを含む）"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT t.number, i.topping, t.status, i.order_count
+            FROM all_tickets AS t JOIN all_order_items AS i ON i.ticket_id = t.id
+            ORDER BY t.accepted_at ASC, t.id ASC, i.id ASC
+        ''')
+        return cursor.fetchall()
+
+
+class HistoryManager:
+    """整理番号の使用履歴。注文と同じ接続を使い、同じトランザクションで書き込む"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.conn = db_manager.conn
+
+    def create_table(self):
+        """履歴テーブルを作成（スキーマの移行で作られる）"""
+        migrate(self.conn)
+
+    def transaction(self):
+        return self.db_manager.transaction()
+
+    def commit(self):
+        self.db_manager.commit()
+
+    def add_number_to_history(self, number):
+        """整理番号を履歴に追加"""
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO history (number, used_at) VALUES (?, ?)", (number, now_epoch()))
+        self.commit()
+
+    def remove_number_from_history(self, number):
+        """番号の最後の使用履歴を削除（払い出しを取り消したとき）"""
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM history WHERE id = (SELECT MAX(id) FROM history WHERE number = ?)", (number,))
+        self.commit()
+
+    def get_used_numbers(self):
+        """使用された番号をすべて取得"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT number FROM history")
+        return [row[0] for row in cursor.fetchall()]
+
+    def reset_history(self):
+        """履歴をリセット"""
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM history")
+        self.commit()
+
+
+def import_legacy_history(db_manager, history_path):
+    """旧バージョンのhistory.dbの内容を取り込み、取り込んだファイルは名前を変えて残す
+
+    orders.dbの方はスキーマの移行でそのまま新しい形式になるので、
+    ここでは別ファイルだった整理番号の履歴だけを1つのトランザクションで移す。
+    """
+    if not os.path.exists(history_path):
+        return 0
+    conn = db_manager.conn
+    conn.execute("ATTACH DATABASE ? AS legacy", (history_path,))
+    try:
+        has_table = conn.execute(
+            "SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = 'history'").fetchone()
+        imported = 0
+        with db_manager.transaction():
+            if has_table:
+                cursor = conn.execute('''
+                    INSERT INTO history (number, used_at)
+                    SELECT number, COALESCE(CAST(strftime('%s', used_at, '-9 hours') AS INTEGER), ?)
+                    FROM legacy.history ORDER BY id ASC
+                ''', (now_epoch(),))
+                imported = cursor.rowcount
+            if imported:
+                # 移行（v4）ではまだ履歴がなかったので、払い出し位置を取り込んだ履歴の続きにする
+                conn.execute('''UPDATE allocator
+                                SET cursor = (SELECT number FROM history ORDER BY id DESC LIMIT 1) + 1
+                                WHERE id = 1''')
+    finally:
+        conn.execute("DETACH DATABASE legacy")
+    os.replace(history_path, history_path + ".imported")
+    return imported
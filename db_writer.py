@@ -0,0 +1,171 @@
+"""DBへの書き込みを専用のスレッドでまとめてコミットする
+
+OrderStoreはメモリ上の状態をすぐに変え、DBへの書き込み（関数の並び）をここへ渡す。
+書き込みスレッドは待ち行列にたまった分をまとめて1回のトランザクションでコミットし（グループコミット）、
+コミットが終わったらFutureを完了させる（永続化の確認）。
+待ち行列がいっぱいになると、渡す側がコミットを待つ（バックプレッシャー）。
+ある書き込みが失敗したら、後の書き込みはそれを前提にしているかもしれないので、
+渡す側が読み直す（reset()）までに渡された分はすべて実行せずにWriteAbortedにする。
+
+start()する前は、渡された書き込みをその場で実行する（テストやスクリプト用）。
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from metrics import registry as metrics
+
+WRITE_QUEUE_SIZE = 256  # これ以上たまったら、渡す側がコミットを待つ
+WRITE_BATCH_SIZE = 64  # 1回のコミットにまとめる操作の数
+
+
+class WriteAborted(Exception):
+    """先に失敗した書き込みがあるため実行しなかった"""
+
+
+class DatabaseWriter:
+    """db_managerへの書き込みを裏のスレッドで実行する（接続はcheck_same_thread=Falseで開いておく）"""
+
+    def __init__(self, db_manager, maxsize=WRITE_QUEUE_SIZE, batch_size=WRITE_BATCH_SIZE):
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()  # 接続を使う間は持つ（読み出しも含む）
+        self.errors = deque()  # 裏での書き込みで起きた例外
+        self.generation = 0  # reset()のたびに進める
+        self.failed_generation = -1  # 書き込みが失敗した世代（これ以前に渡された分は実行しない）
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self.thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def submit(self, writes):
+        """1回の操作での書き込み（引数なしの関数の並び）を渡し、最後の関数の戻り値を返すFutureを返す
+
+        start()する前はその場で実行し、失敗したら例外をそのまま投げる。
+        """
+        writes = list(writes)
+        future = Future()
+        if not self.running:
+            with self.lock:
+                future.set_result(self._execute(writes))
+            return future
+
+        job = (writes, future, self.generation)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with metrics.timer("db.backpressure"):
+                self.queue.put(job)
+        return future
+
+    def flush(self):
+        """ここまでに渡した書き込みがすべてコミットされるまで待つ"""
+        if self.running:
+            self.submit([]).result()
+
+    @contextmanager
+    def reading(self):
+        """書き込みをすべて反映してから、DBを読み出す間だけ接続を借りる"""
+        self.flush()
+        with self.lock:
+            yield self.db_manager
+
+    def reset(self):
+        """失敗した書き込みの後、渡す側がDBから読み直したら呼ぶ（以降に渡された分はまた実行する）"""
+        self.generation += 1
+
+    def pop_error(self):
+        """裏での書き込みで起きた例外を1つ取り出す（なければNone）"""
+        return self.errors.popleft() if self.errors else None
+
+    def close(self):
+        """残りの書き込みをすべてコミットして、スレッドを止める"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    # ---- 書き込みスレッド ----
+    def _run(self):
+        while True:
+            jobs = [self.queue.get()]
+            while len(jobs) < self.batch_size and jobs[-1] is not None:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = jobs[-1] is None
+            if stop:
+                jobs.pop()
+            if jobs:
+                try:
+                    self._commit(jobs)
+                except Exception as e:
+                    # 失敗したまとまりの分だけ例外にして、スレッドは止めない（止めるとflush()が戻らない）
+                    self._fail(jobs, e)
+            if stop:
+                return
+
+    def _commit(self, jobs):
+        """まとめて1回でコミットする。失敗したら1件ずつやり直し、失敗した分とその後の分を例外にする
+
+        Futureはトランザクションを抜けてコミットが終わってから完了させる。
+        """
+        start = time.perf_counter()
+        jobs = [job for job in jobs if not self._aborted(job)]
+        with self.lock:
+            try:
+                with self.db_manager.transaction():
+                    results = [self._execute(writes) for writes, _, _ in jobs]
+            except Exception:
+                results = None
+            if results is None:
+                for job in jobs:
+                    writes, future, generation = job
+                    if self._aborted(job):
+                        continue
+                    try:
+                        result = self._execute(writes)
+                    except Exception as e:
+                        self.failed_generation = max(self.failed_generation, generation)
+                        self.errors.append(e)
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+        metrics.observe("db.group_commit", time.perf_counter() - start)
+        if results is not None:
+            for (_, future, _), result in zip(jobs, results):
+                future.set_result(result)
+
+    def _aborted(self, job):
+        """先に失敗した書き込みより前の世代なら、実行せずにWriteAbortedで終わらせる"""
+        writes, future, generation = job
+        if writes and generation <= self.failed_generation:
+            future.set_exception(WriteAborted("先に失敗した書き込みがあるため実行しませんでした"))
+            return True
+        return False
+
+    def _fail(self, jobs, error):
+        """まだ完了していない書き込みを例外で終わらせる"""
+        self.errors.append(error)
+        for _, future, generation in jobs:
+            self.failed_generation = max(self.failed_generation, generation)
+            if not future.done():
+                future.set_exception(error)
+
+    def _execute(self, writes):
+        result = None
+        with self.db_manager.transaction():
+            for write in writes:
+                result = write()
+        return result
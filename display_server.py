@@ -0,0 +1,215 @@
+import asyncio
+import json
+import threading
+
+PAGE = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>整理番号</title>
+<style>
+  body { margin: 0; font-family: Arial, sans-serif; display: flex; height: 100vh; }
+  section { flex: 1; text-align: center; padding: 2vh 2vw; }
+  section + section { border-left: 2px solid black; }
+  h1 { font-size: 4vh; }
+  #providing, #providing-title { color: darkgreen; }
+  .numbers { display: flex; flex-wrap: wrap; justify-content: center; gap: 2vh 4vw;
+             font-size: 9vh; font-weight: bold; }
+</style>
+</head>
+<body>
+<section><h1>-調理中-</h1><div id="cooking" class="numbers"></div></section>
+<section><h1 id="providing-title">-できあがり-</h1><div id="providing" class="numbers"></div></section>
+<script>
+const state = {cooking: [], providing: []};
+function render() {
+  for (const key of ["cooking", "providing"]) {
+    document.getElementById(key).innerHTML = state[key].map(n => `<span>${n}</span>`).join("");
+  }
+}
+const source = new EventSource("/events");
+source.addEventListener("snapshot", e => {
+  const data = JSON.parse(e.data);
+  state.cooking = data.cooking;
+  state.providing = data.providing;
+  render();
+});
+source.addEventListener("delta", e => {
+  const data = JSON.parse(e.data);
+  for (const key of ["cooking", "providing"]) {
+    const removed = new Set(data.remove[key]);
+    state[key] = state[key].filter(n => !removed.has(n)).concat(data.add[key]);
+  }
+  render();
+});
+</script>
+</body>
+</html>
+"""
+
+# 送信待ちがこれを超えたクライアントは切断する（再接続時にスナップショットから取り直す）
+MAX_CLIENT_BUFFER = 256 * 1024
+KEEPALIVE_SECONDS = 15
+
+
+def encode_event(event, data, event_id=None):
+    """Server-Sent Eventsの1件分をバイト列にする"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class DisplayServer:
+    """追加の表示用画面（タブレット・テレビなど）に番号を配信する軽量HTTPサーバー
+
+    別スレッドのasyncioループで動き、/ で表示用ページ、/events でSSEを返す。
+    状態は1つのスナップショットとして持ち、変化があれば差分を1回だけエンコードして
+    全クライアントへ同じバイト列を書き込む。
+    """
+
+    def __init__(self, host="0.0.0.0", port=8080):
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.clients = set()
+        self.version = 0
+        self.cooking = []
+        self.providing = []
+        self.snapshot_bytes = encode_event("snapshot", self.snapshot(), 0)
+        self.ready = threading.Event()
+
+    def snapshot(self):
+        return {"version": self.version, "cooking": self.cooking, "providing": self.providing}
+
+    # ---- Tkのスレッドから呼ぶ ----
+    def start(self):
+        """バックグラウンドでサーバーを起動（待ち受けを始めるまで待つ）"""
+        self.thread = threading.Thread(target=self._run, name="display-server", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def stop(self, timeout=1):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def publish(self, cooking, providing):
+        """現在の番号を渡す。前回から変わっていれば差分を配信する"""
+        cooking = list(cooking)
+        providing = list(providing)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._update, cooking, providing)
+        else:
+            self._update(cooking, providing)
+
+    # ---- ここから下はサーバーのスレッドで動く ----
+    def _update(self, cooking, providing):
+        if cooking == self.cooking and providing == self.providing:
+            return
+        delta = {"version": self.version + 1, "add": {}, "remove": {}}
+        for key, old, new in (("cooking", self.cooking, cooking), ("providing", self.providing, providing)):
+            old_set, new_set = set(old), set(new)
+            delta["add"][key] = [n for n in new if n not in old_set]
+            delta["remove"][key] = [n for n in old if n not in new_set]
+
+        self.version += 1
+        self.cooking = cooking
+        self.providing = providing
+        self.snapshot_bytes = encode_event("snapshot", self.snapshot(), self.version)
+        self._broadcast(encode_event("delta", delta, self.version))
+
+    def _broadcast(self, payload):
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                self._drop(writer)
+                continue
+            writer.write(payload)
+
+    def _drop(self, writer):
+        self.clients.discard(writer)
+        writer.close()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.loop.create_task(self._keepalive())
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            for writer in list(self.clients):
+                self._drop(writer)
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    async def _keepalive(self):
+        """無通信で切られないよう、定期的にコメント行を送る"""
+        while True:
+            await asyncio.sleep(KEEPALIVE_SECONDS)
+            self._broadcast(b": keepalive\n\n")
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # ヘッダーは使わない
+            parts = request_line.decode("latin-1").split()
+            path = parts[1] if len(parts) >= 2 else "/"
+        except (ConnectionError, UnicodeDecodeError):
+            writer.close()
+            return
+
+        if path == "/events":
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream; charset=utf-8\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: keep-alive\r\n\r\n")
+            writer.write(self.snapshot_bytes)
+            self.clients.add(writer)
+            try:
+                # 切断されるまで待つ（クライアントからは何も送られてこない）
+                await reader.read()
+            except ConnectionError:
+                pass
+            finally:
+                self.clients.discard(writer)
+                writer.close()
+            return
+
+        if path == "/":
+            self._respond(writer, "200 OK", "text/html; charset=utf-8", PAGE.encode("utf-8"))
+        elif path == "/snapshot":
+            body = json.dumps(self.snapshot(), ensure_ascii=False).encode("utf-8")
+            self._respond(writer, "200 OK", "application/json; charset=utf-8", body)
+        else:
+            self._respond(writer, "404 Not Found", "text/plain; charset=utf-8", b"not found")
+
+    def _respond(self, writer, status, content_type, body):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        writer.close()
+
+
+if __name__ == "__main__":
+    # 動作確認用: http://localhost:8080/ を開くと番号が順に増える
+    import time
+    server = DisplayServer(port=8080).start()
+    print(f"http://localhost:{server.port}/")
+    for n in range(1, 31):
+        server.publish(range(max(1, n - 4), n + 1), range(max(1, n - 8), max(1, n - 4)))
+        time.sleep(2)
+    server.stop()
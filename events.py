@@ -0,0 +1,48 @@
+from collections import defaultdict
+from typing import NamedTuple
+
+
+class TicketAdded(NamedTuple):
+    """注文が追加された"""
+    number: int
+    ticket_id: int
+    status: str
+    items: list
+
+
+class StatusChanged(NamedTuple):
+    """注文のステータスが変わった（提供済みになった場合も含む）"""
+    number: int
+    ticket_id: int
+    old_status: str
+    new_status: str
+
+
+class TicketRemoved(NamedTuple):
+    """注文が取り消された"""
+    number: int
+    ticket_id: int
+    old_status: str
+
+
+class StoreReloaded(NamedTuple):
+    """DBから状態を読み直した（全体を描き直す）"""
+
+
+class EventBus:
+    """状態の変化を購読者に知らせる"""
+
+    def __init__(self):
+        self.handlers = defaultdict(list)  # イベントの型 -> ハンドラ（Noneは全イベント）
+
+    def subscribe(self, event_type, handler):
+        """event_typeのイベントを受け取る。Noneなら全てのイベントを受け取る"""
+        self.handlers[event_type].append(handler)
+        return handler
+
+    def unsubscribe(self, event_type, handler):
+        self.handlers[event_type].remove(handler)
+
+    def publish(self, event):
+        for handler in (*self.handlers.get(type(event), ()), *self.handlers.get(None, ())):
+            handler(event)
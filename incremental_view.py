@@ -0,0 +1,166 @@
+import math
+import time
+
+
+class TreeRenderer:
+    """Treeviewの行をキーごとに管理し、差分だけを反映する
+
+    render()には表示したい行を (キー, values, tags) の並びで渡す。
+    前回からの追加・削除・移動・値やタグの変更だけをTkに送るので、
+    更新のコストは変化した行の数に比例する。
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.rows = {}  # キー -> [iid, values, tags]
+        self.order = []  # 表示中のキーの並び
+
+    def render(self, rows):
+        rows = list(rows)
+        wanted = {key for key, _, _ in rows}
+
+        # 削除
+        if len(wanted) != len(self.order) or any(key not in wanted for key in self.order):
+            removed = [key for key in self.order if key not in wanted]
+            if removed:
+                self.tree.delete(*[self.rows.pop(key)[0] for key in removed])
+                self.order = [key for key in self.order if key in wanted]
+
+        # 追加・移動・変更
+        current = self.order
+        for index, (key, values, tags) in enumerate(rows):
+            values = tuple(values)
+            tags = tuple(tags)
+            row = self.rows.get(key)
+            if row is None:
+                iid = self.tree.insert('', index, values=values, tags=tags)
+                self.rows[key] = [iid, values, tags]
+                current.insert(index, key)
+                continue
+
+            if index >= len(current) or current[index] != key:
+                current.remove(key)
+                current.insert(index, key)
+                self.tree.move(row[0], '', index)
+
+            if row[1] != values or row[2] != tags:
+                self.tree.item(row[0], values=values, tags=tags)
+                row[1] = values
+                row[2] = tags
+
+    def clear(self):
+        """すべての行を削除"""
+        if self.order:
+            self.tree.delete(*[self.rows[key][0] for key in self.order])
+        self.rows.clear()
+        self.order = []
+
+
+class LabelText:
+    """ラベルの表示内容を覚えておき、変化したときだけconfigureする"""
+
+    def __init__(self, label, **options):
+        self.label = label
+        self.options = options
+
+    def set(self, **options):
+        changed = {key: value for key, value in options.items() if self.options.get(key) != value}
+        if changed:
+            self.label.configure(**changed)
+            self.options.update(changed)
+
+
+class RefreshScheduler:
+    """再描画の要求をまとめ、after_idleで1回だけ描き直す
+
+    連続した変更（複数行のやり直しなど）は1回の再描画にまとめる。
+    前回の描画からmin_interval秒たっていなければ、その分だけ遅らせる。
+    """
+
+    def __init__(self, widget, callback, max_rate=20, clock=time.monotonic):
+        self.widget = widget
+        self.callback = callback
+        self.min_interval = 1.0 / max_rate
+        self.clock = clock
+        self.pending = False
+        self.after_id = None
+        self.last_run = None
+        self.requests = 0
+        self.runs = 0
+
+    def request(self, event=None):
+        """再描画を予約（既に予約済みなら何もしない）"""
+        self.requests += 1
+        if self.pending:
+            return
+        self.pending = True
+        wait = 0 if self.last_run is None else self.last_run + self.min_interval - self.clock()
+        if wait > 0:
+            self.after_id = self.widget.after(max(1, math.ceil(wait * 1000)), self._run)
+        else:
+            self.after_id = self.widget.after_idle(self._run)
+
+    def flush(self):
+        """予約を待たずに今すぐ描き直す"""
+        if self.pending:
+            self.widget.after_cancel(self.after_id)
+        self._run()
+
+    def _run(self):
+        self.pending = False
+        self.after_id = None
+        self.last_run = self.clock()
+        self.runs += 1
+        self.callback()
+
+
+class Pager:
+    """長い並びをページに分け、表示中の1ページ分だけを扱う
+
+    番号ボタンや表示用画面のように、全体の件数が増えても
+    ウィジェットの数・描画のコストをpage_sizeまでに抑えるために使う。
+    """
+
+    def __init__(self, page_size, total=0):
+        self.page_size = page_size
+        self.total = total
+        self.page = 0
+
+    @property
+    def page_count(self):
+        return max(1, -(-self.total // self.page_size))
+
+    def set_total(self, total):
+        """件数を更新する（ページがはみ出したら最後のページへ）"""
+        self.total = total
+        self.page = min(self.page, self.page_count - 1)
+
+    def bounds(self):
+        """表示中のページの (開始, 終了) の位置"""
+        start = self.page * self.page_size
+        return start, min(start + self.page_size, self.total)
+
+    def slice(self, items):
+        start, stop = self.bounds()
+        return items[start:stop]
+
+    def next(self, wrap=False):
+        """次のページへ。移動したらTrue"""
+        if self.page + 1 < self.page_count:
+            self.page += 1
+        elif wrap and self.page_count > 1:
+            self.page = 0
+        else:
+            return False
+        return True
+
+    def prev(self):
+        """前のページへ。移動したらTrue"""
+        if self.page == 0:
+            return False
+        self.page -= 1
+        return True
+
+    def show(self, index):
+        """index番目を含むページへ"""
+        self.page = min(max(index, 0) // self.page_size, self.page_count - 1)
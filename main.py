@@ -1,120 +1,26 @@
+import time
+STARTED_AT = time.perf_counter()  # 起動時間の計測用（importより前に記録する）
+
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import ttk
-import sqlite3
+import os
 import play_sound
-import pygame
-from menu_dialogue import open_dialog
-
-class DatabaseManager:
-    def __init__(self, db_name='orders.db'):
-        self.conn = sqlite3.connect(db_name)
-        self.create_table()
-
-    def create_table(self):
-        """データベーステーブルを作成。デフォルトでJSTで保存する"""
-        cursor = self.conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS orders (
-                            id INTEGER PRIMARY KEY,
-                            number INTEGER NOT NULL,
-                            topping TEXT NOT NULL,
-                            order_count INTEGER NOT NULL,
-                            status TEXT NOT NULL,
-                            accepted_at TIMESTAMP DEFAULT (datetime(CURRENT_TIMESTAMP, '+9 hours')),
-                            updated_at TIMESTAMP DEFAULT (datetime(CURRENT_TIMESTAMP, '+9 hours'))
-                        )''')
-        self.conn.commit()
-
-    def add_number(self, number, topping, order_count, status):
-        """番号をデータベースに追加"""
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT INTO orders (number, topping, order_count, status) VALUES (?, ?, ?, ?)", (number, topping, order_count, status))
-        self.conn.commit()
-
-    def update_number_status(self, number, new_status):
-        """番号のステータスを更新"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE orders 
-            SET status = ?, updated_at = (datetime(CURRENT_TIMESTAMP, '+9 hours'))
-            WHERE number = ? AND status != 'served'
-        ''', (new_status, number))
-        self.conn.commit()
-
-    def update_number_status_by_id(self, number_id, new_status):
-        """IDでステータスを更新"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE orders 
-            SET status = ?, updated_at = (datetime(CURRENT_TIMESTAMP, '+9 hours'))
-            WHERE id = ?
-        ''', (new_status, number_id))
-        self.conn.commit()
-
-    def delete_number(self, number):
-        """番号をデータベースから削除"""
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM orders WHERE number = ?", (number,))
-        self.conn.commit()
-
-    def delete_number_by_id(self, number_id):
-        """IDで番号を削除"""
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM orders WHERE id = ?", (number_id,))
-        self.conn.commit()
-
-    def get_numbers_by_status(self, status):
-        """特定のステータスの番号を取得"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT number FROM orders WHERE status = ?", (status,))
-        return [row[0] for row in cursor.fetchall()]
-
-    def get_id_by_number(self, number, limit):
-        """最後に追加された整理番号のIDを取得"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT id FROM orders WHERE number = ? ORDER BY updated_at DESC LIMIT ?", (number, limit))
-        results = cursor.fetchall()
-        return [row[0] for row in results]if results else None
-    
-    def get_all_orders(self):
-        """全ての注文を取得"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT number, topping, status, order_count FROM orders ORDER BY accepted_at ASC")
-        return cursor.fetchall()
-    
-class HistoryManager:
-    def __init__(self, db_name='history.db'):
-        self.conn = sqlite3.connect(db_name)
-        self.create_table()
-
-    def create_table(self):
-        """履歴テーブルを作成"""
-        cursor = self.conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS history (
-                            id INTEGER PRIMARY KEY,
-                            number INTEGER NOT NULL,
-                            used_at TIMESTAMP DEFAULT (datetime(CURRENT_TIMESTAMP, '+9 hours'))
-                        )''')
-        self.conn.commit()
-
-    def add_number_to_history(self, number):
-        """整理番号を履歴に追加"""
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT INTO history (number) VALUES (?)", (number,))
-        self.conn.commit()
-
-    def get_used_numbers(self):
-        """使用された番号をすべて取得"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT number FROM history")
-        return [row[0] for row in cursor.fetchall()]
-
-    def reset_history(self):
-        """履歴をリセット"""
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM history")
-        self.conn.commit()
-
+from menu_dialogue import open_dialog, prepare_dialog
+from core import OrderCore, OrderError, STATUS_LABELS
+from incremental_view import TreeRenderer, LabelText, RefreshScheduler, Pager
+from config import load_config
+from metrics import registry as metrics
+from recorder import SessionRecorder
+
+# 番号ボタンは1ページ分（列数×行数）だけ作る
+NUMBER_COLUMNS = 5
+NUMBER_PAGE_SIZE = 30
+
+# 表示用画面に1度に出す番号の数。超えたらページを順に切り替える
+DISPLAY_COLUMNS = 5
+DISPLAY_PAGE_SIZE = 30
+DISPLAY_ROTATE_MS = 5000
 
 class NumberDisplayApp:
     def __init__(self, master):
@@ -126,32 +32,100 @@ class NumberDisplayApp:
         # グリッドレイアウトの設定
         self.configure_grid()
 
-        self.max_number = 30
+        config = load_config()
+        self.max_number = config["max_number"]
+        self.toppings = config["toppings"]
         self.is_auto = tk.BooleanVar(value=False)
-
-        # データベースの初期化
-        self.db_manager = DatabaseManager()
-
-        # 整理番号の履歴管理DB
-        self.history_manager = HistoryManager()
-
-        # 操作履歴のためのスタック（やり直し用）
-        self.action_history = []
+        self.is_multi = tk.BooleanVar(value=False)
+
+        # 呼び出し音声のミキサーは裏で開く（画面の表示を待たせない）
+        play_sound.start()
+
+        # 注文・番号の操作（DB・履歴・メモリ上の状態）
+        # DBへの書き込みは裏のスレッドでまとめてコミットし、ボタンの処理を待たせない
+        self.core = OrderCore(max_number=self.max_number, background_writes=True)
+        self.db_manager = self.core.db_manager
+        self.history_manager = self.core.history_manager
+        self.order_store = self.core.store
+
+        # 処理時間の計測（環境変数 METRICS=1 または METRICS_FILE を設定したときだけ）
+        self.metrics_file = os.environ.get("METRICS_FILE")
+        if self.metrics_file or os.environ.get("METRICS") == "1":
+            metrics.enable()
+            metrics.instrument(self.db_manager, "db")
+            metrics.instrument(self.history_manager, "history")
+            metrics.instrument(self, "app", names=(
+                "cooking_number", "provide_number", "complete_provide", "undo_action", "redo_action",
+                "open_order_dialog", "update_display", "update_panel", "update_customer_display",
+                "update_prep_board"))
+
+        # 操作の記録（環境変数 SESSION_LOG を設定したときだけ。replay.pyで再生できる）
+        self.recorder = None
+        session_log = os.environ.get("SESSION_LOG")
+        if session_log:
+            self.recorder = SessionRecorder(session_log, self.core, config)
+            self.recorder.instrument(self)
 
         # UIコンポーネントの作成
         self.create_widgets()
 
+        # トッピング選択のダイアログは画面が出た後に作っておき、注文ごとに使い回す
+        self.master.after_idle(lambda: prepare_dialog(self.master))
+
+        # Ctrl+Zで1つ戻す、Ctrl+Yで戻した操作をやり直す
+        self.master.bind("<Control-z>", lambda event: self.undo_action())
+        self.master.bind("<Control-y>", lambda event: self.redo_action())
+
         # デフォルトの値
         self.selected_number = None  # 現在選択されている番号
-        self.used_numbers = []  # 使用済みの番号を追跡
+        self.selected_numbers = []  # 複数選択したときの番号（選択した順）
 
         # 番号表示用のウィンドウを作成
         self.is_hide_bar = False
         self.create_display_window()
 
+        # キッチン向けの集計用のウィンドウを作成
+        self.create_prep_window()
+
+        # 状態が変わったら、まとめて1回だけ描き直す
+        self.panel_refresh = RefreshScheduler(self.master, self.update_panel)
+        self.display_refresh = RefreshScheduler(self.master, self.update_customer_display)
+        self.prep_refresh = RefreshScheduler(self.master, self.update_prep_board)
+        self.order_store.bus.subscribe(None, self.panel_refresh.request)
+        self.order_store.bus.subscribe(None, self.display_refresh.request)
+        self.order_store.bus.subscribe(None, self.prep_refresh.request)
+
+        # 追加の表示用画面への配信（環境変数 DISPLAY_SERVER_PORT を設定したときだけ起動）
+        self.display_server = None
+        port = os.environ.get("DISPLAY_SERVER_PORT")
+        if port:
+            from display_server import DisplayServer
+            self.display_server = DisplayServer(port=int(port)).start()
+            self.server_refresh = RefreshScheduler(self.master, self.publish_to_display_server)
+            self.order_store.bus.subscribe(None, self.server_refresh.request)
+            self.publish_to_display_server()
+
         # ディスプレイを更新
         self.update_display()
 
+        # F12キーで処理時間の一覧を表示する
+        self.create_debug_overlay()
+        self.metrics_interval_ms = 10 * 1000
+        if self.metrics_file:
+            self.export_metrics()
+
+        # 提供済みの注文は一定時間後にアーカイブへ移す（やり直しの猶予を残す）
+        self.archive_after = 10 * 60  # 秒
+        self.archive_interval_ms = 5 * 60 * 1000
+        self.archive_served()
+
+        # 裏での書き込みの失敗を確認する
+        self.check_writes_interval_ms = 1000
+        self.check_writes()
+
+        # ウィンドウを閉じるときは、書き込み待ちの注文を保存してから終了する
+        self.master.protocol("WM_DELETE_WINDOW", self.on_close)
+
     def configure_grid(self):
         """メインウィンドウのグリッドレイアウトを設定"""
         for i in range(5):
@@ -166,13 +140,20 @@ class NumberDisplayApp:
         # 現在選択されている番号の表示ラベル
         self.current_label = ctk.CTkLabel(self.master, text="選択中の番号: ", font=("Arial", 48))
         self.current_label.grid(row=0, column=0, columnspan=2, pady=10, sticky="nsew")
+        self.current_text = LabelText(self.current_label, text="選択中の番号: ", font=("Arial", 48))
 
-        # 番号ボタン用のスクロール可能なフレーム
-        self.create_scrollable_frame()
+        # 番号ボタン用のフレーム
+        self.create_number_grid()
 
-        # オートモード用スイッチボタン
-        self.auto_button = ctk.CTkSwitch(self.master, variable=self.is_auto, text="オートモード")
-        self.auto_button.grid(row=1, column=1, padx=10, pady=10, sticky="nsew")
+        # オートモード・複数選択用スイッチボタン
+        switch_frame = ctk.CTkFrame(self.master, fg_color="transparent")
+        switch_frame.grid(row=1, column=1, padx=10, pady=10, sticky="nsew")
+        self.auto_button = ctk.CTkSwitch(switch_frame, variable=self.is_auto, text="オートモード",
+                                         command=lambda: self.set_auto(self.is_auto.get()))
+        self.auto_button.pack(side="left", expand=True)
+        self.multi_button = ctk.CTkSwitch(switch_frame, variable=self.is_multi, text="複数選択",
+                                          command=lambda: self.set_multi(self.is_multi.get()))
+        self.multi_button.pack(side="left", expand=True)
 
         # アクションボタンの作成(row=2～5)
         self.create_action_buttons()
@@ -199,20 +180,74 @@ class NumberDisplayApp:
 
         self.tree.grid(row=6, column=0, rowspan=2, columnspan=2, padx=10, pady=10, sticky="nsew")
 
-    def create_scrollable_frame(self):
-        """番号ボタンを表示するためのスクロール可能なフレームを作成"""
-        self.scrollable_frame = ctk.CTkScrollableFrame(self.master, width=150, height=200)
-        self.scrollable_frame.grid(row=1, column=0, rowspan=5, padx=10, pady=10, sticky="nsew")
+        # 注文リストは差分だけを反映する
+        self.tree_renderer = TreeRenderer(self.tree)
+
+        # Ctrl・Shiftを押しながら行を選ぶと、複数の番号をまとめて選択できる
+        self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+
+    def create_number_grid(self):
+        """番号ボタンを表示するフレームを作成（1ページ分のボタンだけを作り、ページ送りで使い回す）"""
+        self.number_frame = ctk.CTkFrame(self.master)
+        self.number_frame.grid(row=1, column=0, rowspan=5, padx=10, pady=10, sticky="nsew")
+
+        page_size = min(self.max_number, NUMBER_PAGE_SIZE)
+        rows = -(-page_size // NUMBER_COLUMNS)
+        self.number_pager = Pager(page_size, self.max_number)
+        for column in range(NUMBER_COLUMNS):
+            self.number_frame.grid_columnconfigure(column, weight=1)
+        for row in range(rows):
+            self.number_frame.grid_rowconfigure(row, weight=1)
 
         self.number_buttons = []
-        for i in range(1, self.max_number + 1):
-            button = ctk.CTkButton(self.scrollable_frame, text=str(i), font=("Arial", 18),
-                                   command=lambda num=i: self.select_number(num))
-            button.pack(pady=5, fill='both', expand=True)
+        self.number_button_texts = []
+        for index in range(page_size):
+            button = ctk.CTkButton(self.number_frame, text="", width=40, font=("Arial", 18),
+                                   command=lambda index=index: self.select_number_at(index))
+            button.grid(row=index // NUMBER_COLUMNS, column=index % NUMBER_COLUMNS, padx=2, pady=2, sticky="nsew")
             self.number_buttons.append(button)
-
-        # スクロール速度のカスタマイズ
-        self.scrollable_frame.bind("<MouseWheel>", self.on_mouse_wheel)
+            self.number_button_texts.append(LabelText(button, text=""))
+
+        # ページ送り（番号が1ページに収まらないときだけ）
+        self.page_text = None
+        if self.number_pager.page_count > 1:
+            prev_button = ctk.CTkButton(self.number_frame, text="◀", width=40, command=lambda: self.move_number_page(-1))
+            prev_button.grid(row=rows, column=0, padx=2, pady=2, sticky="nsew")
+            page_label = ctk.CTkLabel(self.number_frame, text="", font=("Arial", 18))
+            page_label.grid(row=rows, column=1, columnspan=NUMBER_COLUMNS - 2, sticky="nsew")
+            self.page_text = LabelText(page_label, text="")
+            next_button = ctk.CTkButton(self.number_frame, text="▶", width=40, command=lambda: self.move_number_page(1))
+            next_button.grid(row=rows, column=NUMBER_COLUMNS - 1, padx=2, pady=2, sticky="nsew")
+
+        # マウスホイールでページ送り（イベントはポインタの下のボタンに届くので、ボタンにも割り当てる。
+        # X11ではホイールがButton-4/5として届く）
+        for widget in (self.number_frame, *self.number_buttons):
+            for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+                widget.bind(sequence, self.on_mouse_wheel)
+        self.show_number_page()
+
+    def show_number_page(self):
+        """表示中のページの番号をボタンに割り当てる（変わったボタンだけ）"""
+        start, stop = self.number_pager.bounds()
+        for index, text in enumerate(self.number_button_texts):
+            if start + index < stop:
+                text.set(text=str(start + index + 1), state="normal")
+            else:
+                text.set(text="", state="disabled")
+        if self.page_text is not None:
+            self.page_text.set(text=f"{self.number_pager.page + 1}/{self.number_pager.page_count}")
+
+    def move_number_page(self, step):
+        """番号ボタンのページを前後に送る"""
+        moved = self.number_pager.next() if step > 0 else self.number_pager.prev()
+        if moved:
+            self.show_number_page()
+
+    def select_number_at(self, index):
+        """表示中のページのindex番目のボタンの番号を選択"""
+        start, stop = self.number_pager.bounds()
+        if start + index < stop:
+            self.select_number(start + index + 1)
 
     def create_action_buttons(self):
         """調理中、提供可能、提供完了用等のアクションボタンを作成"""
@@ -245,8 +280,15 @@ class NumberDisplayApp:
         self.display_window.grid_columnconfigure(1, weight=1)
         self.display_window.grid_columnconfigure((0, 2), weight=10, minsize=(display_width)//2)
 
-        cooking_text_label = ctk.CTkLabel(self.display_window, text="-調理中-", font=("Arial", 24, "bold"))
-        cooking_text_label.grid(row=0, column=0, pady=(0, 20))
+        cooking_header = ctk.CTkFrame(self.display_window, fg_color="transparent")
+        cooking_header.grid(row=0, column=0, pady=(0, 20))
+        cooking_text_label = ctk.CTkLabel(cooking_header, text="-調理中-", font=("Arial", 24, "bold"))
+        cooking_text_label.pack()
+
+        # 今注文したときの待ち時間の目安（記録がないうちは空欄）
+        self.wait_label = ctk.CTkLabel(cooking_header, text="", font=("Arial", 20))
+        self.wait_label.pack()
+        self.wait_text = LabelText(self.wait_label, text="")
 
         provide_text_label = ctk.CTkLabel(self.display_window, text_color="darkgreen", text="-できあがり-", font=("Arial", 24, "bold"))
         provide_text_label.grid(row=0, column=2, pady=(0, 20))
@@ -254,10 +296,16 @@ class NumberDisplayApp:
         # 調理中の番号表示
         self.cooking_label = ctk.CTkLabel(self.display_window, text="", font=("Arial", 54, "bold"))
         self.cooking_label.grid(row=1, column=0, padx=(0, 0), sticky="n")
+        self.cooking_text = LabelText(self.cooking_label, text="")
 
         # 提供中の番号表示
         self.provide_label = ctk.CTkLabel(self.display_window, text_color="darkgreen", text="", font=("Arial", 54, "bold"))
         self.provide_label.grid(row=1, column=2, padx=(0, 0), sticky="n")
+        self.provide_text = LabelText(self.provide_label, text="")
+
+        # 番号が多いときはページに分けて順番に表示する
+        self.display_pagers = {'cooking': Pager(DISPLAY_PAGE_SIZE), 'providing': Pager(DISPLAY_PAGE_SIZE)}
+        self.master.after(DISPLAY_ROTATE_MS, self.rotate_display)
 
         # 調理中ラベルと提供中ラベルの間に縦線を追加
         line_canvas = ctk.CTkCanvas(self.display_window, width=2, height=500, bg="black", highlightthickness=0)
@@ -266,6 +314,19 @@ class NumberDisplayApp:
         # Line setup
         line_canvas.create_line(0, 0, 0, 500, fill="black")
 
+    def create_prep_window(self):
+        """キッチン向けに、調理中の注文のトッピングごとの枚数を表示するサブウィンドウを作成"""
+        self.prep_window = ctk.CTkToplevel(self.master)
+        self.prep_window.title("キッチン")
+        # 閉じても壊さずに隠すだけにする（壊すと注文のたびの更新が失敗する）。F9で再表示
+        self.prep_window.protocol("WM_DELETE_WINDOW", self.prep_window.withdraw)
+        self.master.bind("<F9>", lambda event: self.prep_window.deiconify())
+        prep_header = ctk.CTkLabel(self.prep_window, text="-調理待ち-", font=("Arial", 24, "bold"))
+        prep_header.pack(pady=(10, 0))
+        self.prep_label = ctk.CTkLabel(self.prep_window, text="", font=("Arial", 36, "bold"), justify="left")
+        self.prep_label.pack(padx=20, pady=10, anchor="w")
+        self.prep_text = LabelText(self.prep_label, text="")
+
     def toggle_hide_bar(self, event=None):
         """タブのバーを消す"""
         self.is_hide_bar = not self.is_hide_bar
@@ -273,53 +334,114 @@ class NumberDisplayApp:
         self.display_window.overrideredirect(self.is_hide_bar)
         self.display_window.update_idletasks()
 
+    def create_debug_overlay(self):
+        """処理時間を表示するデバッグ用の表示（普段は隠しておく）"""
+        self.debug_visible = False
+        self.debug_after_id = None
+        self.debug_label = tk.Label(self.master, font=("Courier", 11), justify="left", anchor="nw",
+                                    bg="black", fg="lime")
+        self.debug_text = LabelText(self.debug_label, text="")
+        self.master.bind("<F12>", self.toggle_debug_overlay)
+
+    def toggle_debug_overlay(self, event=None):
+        """デバッグ表示の切り替え"""
+        self.debug_visible = not self.debug_visible
+        if self.debug_visible:
+            self.debug_label.place(relx=1.0, rely=0.0, anchor="ne")
+            self.debug_label.lift()
+            self.update_debug_overlay()
+        else:
+            self.debug_label.place_forget()
+            if self.debug_after_id is not None:
+                self.master.after_cancel(self.debug_after_id)
+                self.debug_after_id = None
+
+    def update_debug_overlay(self):
+        """表示中は1秒ごとに内容を更新"""
+        if not self.debug_visible:
+            return
+        if metrics.enabled:
+            lines = metrics.summary_lines()
+        else:
+            lines = ["計測は無効です（METRICS=1 で起動してください）"]
+        lines.append(f"announcer: {play_sound.announcer.stats()}")
+        self.debug_text.set(text="\n".join(lines))
+        self.debug_after_id = self.master.after(1000, self.update_debug_overlay)
+
+    def export_metrics(self):
+        """計測結果をファイルへ書き出し、次の書き出しを予約"""
+        try:
+            metrics.export(self.metrics_file)
+        except OSError as e:
+            print(f"計測結果を書き出せませんでした: {e}")
+        self.master.after(self.metrics_interval_ms, self.export_metrics)
+
+    def open_order_dialog(self):
+        """トッピングを選ぶダイアログを開き、注文内容を返す"""
+        return open_dialog(self.master)
+
     def select_number(self, num):
-        """番号を選択"""
-        self.selected_number = num
-        self.update_display()
+        """番号を選択（複数選択のときは選択に加える・外す。Noneなら選択をすべて解除）"""
+        if num is not None and self.is_multi.get():
+            if num in self.selected_numbers:
+                self.selected_numbers.remove(num)
+            else:
+                self.selected_numbers.append(num)
+            self.selected_number = self.selected_numbers[-1] if self.selected_numbers else None
+        else:
+            self.selected_number = num
+            self.selected_numbers = []
+            if self.tree.selection():
+                self.tree.selection_remove(*self.tree.selection())
+        self.update_selection_label()
+
+    def on_tree_select(self, event=None):
+        """注文リストで選んだ行の番号を選択する（選択が空になったときは何もしない）"""
+        numbers = list(dict.fromkeys(int(self.tree.item(iid, "values")[0]) for iid in self.tree.selection()))
+        if numbers:
+            self.select_numbers(numbers)
+
+    def select_numbers(self, numbers):
+        """複数の番号をまとめて選択"""
+        self.selected_numbers = list(numbers)
+        self.selected_number = self.selected_numbers[-1]
+        self.update_selection_label()
+
+    def set_auto(self, value):
+        """オートモードの切り替え"""
+        self.is_auto.set(value)
+
+    def set_multi(self, value):
+        """複数選択の切り替え（選択は解除する）"""
+        self.is_multi.set(value)
+        self.select_number(None)
+
+    def selected_targets(self):
+        """まとめて操作する番号（複数選択がなければ選択中の1つ）"""
+        return list(self.selected_numbers) or [self.selected_number]
 
     def handle_auto_add(self):
         """次に利用可能な番号を自動的に追加"""
-        using_numbers = self.db_manager.get_numbers_by_status('cooking') + self.db_manager.get_numbers_by_status('providing')
-        used_numbers = self.history_manager.get_used_numbers()
-        available_numbers = set(range(1, self.max_number + 1)) - set(using_numbers) - set(used_numbers)
-
-        if available_numbers:
-            target_num = min(available_numbers)
-            self.current_label.configure(text=f"選択中の番号(auto): {target_num}", font=self.default_font)
-            order = open_dialog(self.master)
-            if order is None or not order:
-                self.show_info("error:トッピングを選択してください")
-                return
-
-            old_status = "none"
-            for topping, order_count in order:
-                self.db_manager.add_number(target_num, topping, order_count, 'cooking')
-
-            self.add_to_action_history(target_num, old_status, 'cooking', limit=len(order)) #履歴に追加
-            self.history_manager.add_number_to_history(target_num)
+        try:
+            target_num = self.core.next_auto_number()
+            self.current_text.set(text=f"選択中の番号(auto): {target_num}", font=self.default_font)
             # 全ての番号を使用したら1番に戻ってくる
-            if len(used_numbers) >= self.max_number - 1:
-                self.history_manager.reset_history()  # 履歴をリセット
+            if self.core.add_auto(target_num, self.open_order_dialog()):
                 print("整理番号が1番に戻ってきました。")
-            self.update_display()
-        else:
-            self.show_info("error:無効な番号または既に呼び出し中です。")
-
+        except OrderError as e:
+            self.show_info(f"error:{e}")
+            return
+        self.update_selection_label()
 
     def handle_auto_transfer(self, current_status, next_status):
         """番号を自動的にあるステータスから別のステータスへ移動"""
-        current_status_num = self.db_manager.get_numbers_by_status(current_status)
-
-        if current_status_num:
-            target_num = current_status_num[0] #特定ステータスの先頭の数字を取得
-            self.db_manager.update_number_status(target_num, next_status)
-            old_status = current_status
-            self.add_to_action_history(target_num, old_status, next_status, limit=len(current_status_num))  # 履歴に追加
-            if next_status == 'providing':                
+        target_num = self.core.transfer_first(current_status, next_status)
+
+        if target_num is not None:
+            if next_status == 'providing':
                 play_sound.play_sound_thread(target_num)
 
-            self.update_display()
+            self.update_selection_label()
 
     def cooking_number(self):
         """選択された番号を「調理中」に設定"""
@@ -327,106 +449,84 @@ class NumberDisplayApp:
         if self.is_auto.get():
             self.handle_auto_add()
             return
-        
-        cooking_nums = self.db_manager.get_numbers_by_status('cooking')
-        providing_nums = self.db_manager.get_numbers_by_status('providing')
 
-        if self.selected_number and (self.selected_number not in cooking_nums):
-            # 提供中の番号を調理中に戻す
-            if self.selected_number in providing_nums:
-                order = providing_nums
-                old_status = 'providing'
-                self.db_manager.update_number_status(self.selected_number, 'cooking')
-
-            else:
-                order = open_dialog(self.master)
-                if order is None or not order:
-                    self.show_info("error:トッピングを選択してください")
-                    return
-                
-                for topping, order_count in order:
-                    self.db_manager.add_number(self.selected_number, topping, order_count, 'cooking')
-
-                
-                old_status = 'none'
-
-            # 履歴に追加
-            self.add_to_action_history(self.selected_number, old_status, 'cooking', limit=len(order))
-            self.selected_number = None
-            self.update_display()
-        else:
-            self.show_info("error:既に調理中です。")
+        try:
+            # 提供中の番号は調理中に戻し、それ以外は注文を入力してもらう
+            order = None
+            if self.selected_number and self.core.needs_order(self.selected_number):
+                order = self.open_order_dialog()
+            self.core.start_cooking(self.selected_number, order)
+        except OrderError as e:
+            self.show_info(f"error:{e}")
+            return
+        self.select_number(None)
 
     def provide_number(self):
-        """選択された番号を「提供可能」に設定"""
+        """選択された番号（複数選択ならすべて）を「提供可能」に設定"""
         if self.is_auto.get():
             self.handle_auto_transfer('cooking', 'providing')
             return
-        
-        cooking_nums = self.db_manager.get_numbers_by_status('cooking')
-        if self.selected_number in cooking_nums:
-            old_status = 'cooking'
-            self.db_manager.update_number_status(self.selected_number, 'providing')
-            self.add_to_action_history(self.selected_number, old_status, 'providing', limit=len(cooking_nums))  # 履歴に追加
-            play_sound.play_sound_thread(self.selected_number)
-            self.selected_number = None
-            self.update_display()
-        else:
-            self.show_info("error:呼出中に存在しない番号です。")
+
+        numbers = self.selected_targets()
+        try:
+            # 複数選択した番号は1回の操作にまとめ、呼び出しも1回にまとめる
+            self.core.call_many(numbers)
+        except OrderError as e:
+            self.show_info(f"error:{e}")
+            return
+        play_sound.play_sound_thread(numbers)
+        self.select_number(None)
 
     def complete_provide(self):
-        """呼出中の番号を「提供完了」に設定"""
+        """呼出中の番号（複数選択ならすべて）を「提供完了」に設定"""
         if self.is_auto.get():
             self.handle_auto_transfer('providing', 'served')
             return
-        
-        providing_nums = self.db_manager.get_numbers_by_status('providing')
-        if self.selected_number in providing_nums:
-            old_status = 'providing'
-            self.db_manager.update_number_status(self.selected_number, "served")
-            self.add_to_action_history(self.selected_number, old_status, 'served', limit=len(providing_nums))  # 履歴に追加
-            self.selected_number = None
-            self.update_display()
-        else:
-            self.show_info("error:呼出中リストに存在しない番号です。")
 
-    def undo_action(self):
-        """最後の操作をやり直す"""
-        if not self.action_history:
-            self.show_info("error:やり直し可能な操作がありません。")
+        try:
+            self.core.complete_many(self.selected_targets())
+        except OrderError as e:
+            self.show_info(f"error:{e}")
             return
+        self.select_number(None)
 
-        # 最後の操作を取得して、戻す
-        last_action = self.action_history.pop()
-        number, number_id_list, old_status, new_status = last_action
+    def undo_action(self):
+        """最後の操作をやり直す（ログから取り消すので再起動後も戻せる）"""
+        # 番号を削除する、または元の状態に戻す（まとめて行った操作はまとめて戻す）
+        try:
+            action = self.core.undo()
+        except OrderError as e:
+            self.show_info(f"error:{e}")
+            return
 
-        for number_id in number_id_list:
-            if old_status == 'none':
-                # 番号を削除する
-                self.db_manager.delete_number_by_id(number_id)
-            else:
-                # 番号を元の状態に戻す
-                self.db_manager.update_number_status_by_id(number_id, old_status)
-        
-        status_mapping = {
-        "none": "未注文",
-        "cooking": "調理中",
-        "providing": "呼出中",
-        "served": "提供済み",
-        }
+        for transition in action:
+            if transition.new_status == 'providing':
+                # まだ流れていない呼び出しは取り消す
+                play_sound.cancel_sound(transition.number)
+
+        transition = action[0]
+        self.show_info(f"番号 {'、'.join(str(t.number) for t in action)} を「{STATUS_LABELS[transition.new_status]}」"
+                       f"から「{STATUS_LABELS[transition.old_status]}」に戻しました。")
+
+    def redo_action(self):
+        """戻した操作をもう一度行う"""
+        try:
+            action = self.core.redo()
+        except OrderError as e:
+            self.show_info(f"error:{e}")
+            return
 
-        # ディスプレイを更新
-        self.update_display()
-        self.show_info(f"番号 {number} を「{status_mapping[new_status]}」から「{status_mapping[old_status]}」に戻しました。")
+        called = [transition.number for transition in action if transition.new_status == 'providing']
+        if called:
+            play_sound.play_sound_thread(called)
 
-    def add_to_action_history(self, number, old_status, new_status, limit=1):
-        """操作履歴に追加"""
-        number_id_list = self.db_manager.get_id_by_number(number, limit)
-        self.action_history.append((number, number_id_list, old_status, new_status))
+        transition = action[0]
+        self.show_info(f"番号 {'、'.join(str(t.number) for t in action)} を「{STATUS_LABELS[transition.old_status]}」"
+                       f"から「{STATUS_LABELS[transition.new_status]}」にやり直しました。")
 
-    def format_display_numbers(self, numbers, n=5):
+    def format_display_numbers(self, numbers, n=DISPLAY_COLUMNS):
         """数字の要素数nごとに改行する"""
-        numbers = [f"{num:>3}" if num < 10 else str(num) for num in set(numbers)]
+        numbers = [f"{num:>3}" if num < 10 else str(num) for num in sorted(set(numbers))]
         # 横並び
         return "\n".join(["　".join(map(str, numbers[i:i + n])) for i in range(0, len(set(numbers)), n)])
         # 縦並び(制作中)
@@ -434,40 +534,112 @@ class NumberDisplayApp:
 
     def update_display(self):
         """調理中と提供可能な番号を画面に更新, ついでにコントロールパネルの注文リストも更新"""
-        cooking_numbers = self.db_manager.get_numbers_by_status('cooking')
-        providing_numbers = self.db_manager.get_numbers_by_status('providing')
-
-        self.current_label.configure(text=f"選択中の番号: {self.selected_number}", font=self.default_font)
-        self.cooking_label.configure(text=self.format_display_numbers(cooking_numbers))
-        self.provide_label.configure(text=self.format_display_numbers(providing_numbers))
-
-        # Listboxの更新
-        for row in self.tree.get_children():
-            self.tree.delete(row)
-
+        self.update_selection_label()
+        self.display_refresh.flush()
+        self.panel_refresh.flush()
+        self.prep_refresh.flush()
+
+    def update_selection_label(self):
+        """選択中の番号の表示を更新"""
+        if len(self.selected_numbers) > 1:
+            self.current_text.set(text=f"選択中の番号: {', '.join(map(str, self.selected_numbers))}",
+                                  font=self.default_font)
+            return
+        self.current_text.set(text=f"選択中の番号: {self.selected_number}", font=self.default_font)
+
+    def update_customer_display(self):
+        """番号表示用のウィンドウを更新（表示内容が変わったラベルだけ）"""
+        for status, text in (('cooking', self.cooking_text), ('providing', self.provide_text)):
+            numbers = sorted(self.order_store.numbers_by_status(status))
+            pager = self.display_pagers[status]
+            pager.set_total(len(numbers))
+            label = self.format_display_numbers(pager.slice(numbers))
+            if pager.page_count > 1:
+                label += f"\n\n({pager.page + 1}/{pager.page_count})"
+            text.set(text=label)
+        self.update_wait_estimate()
+
+    def update_wait_estimate(self):
+        """待ち時間の目安を更新（見積もりはイベントごとに更新済みなので、ここでは表を読まない）"""
+        estimator = self.core.wait_estimator
+        minutes = estimator.estimate_minutes()
+        if minutes is None:
+            self.wait_text.set(text="")
+            return
+        ready_at = time.strftime("%H:%M", time.localtime(estimator.ready_at()))
+        self.wait_text.set(text=f"待ち時間の目安 約{minutes}分（{ready_at}ごろ）")
+
+    def rotate_display(self):
+        """番号が1ページに収まらないときは、表示用画面のページを順番に切り替える（目安の時刻も進める）"""
+        rotated = [pager.next(wrap=True) for pager in self.display_pagers.values()]
+        if any(rotated):
+            self.update_customer_display()
+        else:
+            self.update_wait_estimate()  # できあがり時刻は時間とともに進む
+        self.master.after(DISPLAY_ROTATE_MS, self.rotate_display)
+
+    def update_prep_board(self):
+        """キッチン向けの集計を更新（枚数はイベントごとに増減済みなので、ここでは数え直さない）"""
+        prep_counts = self.core.prep_counts
+        lines = [f"{topping}  ×{count}" for topping, count in prep_counts.pending(self.toppings)]
+        lines.append(f"\n注文 {prep_counts.ticket_count()}件")
+        self.prep_text.set(text="\n".join(lines))
+
+    def publish_to_display_server(self):
+        """追加の表示用画面へ現在の番号を配信"""
+        self.display_server.publish(self.order_store.numbers_by_status('cooking'),
+                                    self.order_store.numbers_by_status('providing'))
+
+    def update_panel(self):
+        """コントロールパネルの注文リストを更新（差分のみ）"""
         status_mapping = {
         "cooking": "調理中",
         "providing": "呼出中"
         }
 
-        orders = self.db_manager.get_all_orders()
-        for idx, order in enumerate(orders):
-            status = status_mapping.get(order[2])
-            if not status:
-                continue
-            
-            self.tree.insert('', 'end', values=(order[0], status, order[1], order[3]))
-
+        rows = []
+        for ticket in self.order_store.active_tickets():
+            status = status_mapping.get(ticket.status)
             # ステータスに応じて背景色を変更
-            if status == "呼出中":
-                self.tree.item(self.tree.get_children()[-1], tags=('providing',))
+            tags = ('providing',) if status == "呼出中" else ()
+            for idx, (topping, order_count) in enumerate(ticket.items):
+                rows.append(((ticket.id, idx), (ticket.number, status, topping, order_count), tags))
+        self.tree_renderer.render(rows)
+
+    def archive_served(self):
+        """提供済みの注文をアーカイブへ移し、次の実行を予約"""
+        self.core.archive(self.archive_after)
+        self.master.after(self.archive_interval_ms, self.archive_served)
+
+    def check_writes(self):
+        """裏での書き込みに失敗していたら画面をDBの内容に戻して知らせ、次の確認を予約"""
+        error = self.core.check_writes()
+        if error is not None:
+            self.show_info(f"error:保存に失敗しました（{error}）")
+        self.master.after(self.check_writes_interval_ms, self.check_writes)
+
+    def on_close(self):
+        """書き込み待ちの分をDBへコミットしてからウィンドウを閉じる"""
+        if self.recorder is not None:
+            self.recorder.close(self.core)
+        self.core.close()
+        self.master.destroy()
+
+    def report_startup(self):
+        """起動から操作できるようになるまでの時間を記録する（最初のアイドル時に呼ぶ）"""
+        self.startup_seconds = time.perf_counter() - STARTED_AT
+        metrics.observe("app.startup", self.startup_seconds)
+        print(f"起動時間: {self.startup_seconds:.2f}秒")
 
     def show_info(self, text):
-        self.current_label.configure(text=text)
+        self.current_text.set(text=text)
 
     def on_mouse_wheel(self, event):
-        """スクロール可能フレームのスクロール速度をカスタマイズ"""
-        self.scrollable_frame._parent_canvas.yview_scroll(int(-1 * (event.delta / abs(event.delta)) * 100), "units")
+        """マウスホイールで番号ボタンのページを送る"""
+        if event.num == 4 or event.delta > 0:
+            self.move_number_page(-1)
+        elif event.num == 5 or event.delta < 0:
+            self.move_number_page(1)
 
 
 # メインウィンドウの作成
@@ -477,5 +649,10 @@ if __name__ == "__main__":
     
     root = ctk.CTk()  # customTkinter のメインウィンドウ
     app = NumberDisplayApp(root)
+    root.after_idle(app.report_startup)
     root.mainloop()
-    pygame.mixer.quit()
+    if app.display_server is not None:
+        app.display_server.stop()
+    play_sound.shutdown()
+    if app.metrics_file:
+        metrics.export(app.metrics_file)
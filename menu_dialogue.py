@@ -1,17 +1,25 @@
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import ttk
+from config import load_config
+from incremental_view import TreeRenderer
 
 class ThreeOptionDialog(ctk.CTkToplevel):
+    """選択肢のボタンを並べたダイアログ
+
+    一度作ったら閉じずに隠しておき、ask()のたびにreset()して表示し直す。
+    """
+
     def __init__(self, parent, title="選択肢", message="どれを選びますか？", options=None):
         super().__init__(parent)
 
         self.title(title)
 
         self.result = None
+        self.done = tk.BooleanVar(self, value=False)
 
-        # モーダルにして親ウィンドウを無効化
-        self.grab_set()
+        # ×ボタンで閉じたときは破棄せずに隠す
+        self.protocol("WM_DELETE_WINDOW", self.close_dialog)
 
         # グリッドの設定
         self.columnconfigure(0, weight=2)  # 3列のグリッドを設定
@@ -44,9 +52,28 @@ class ThreeOptionDialog(ctk.CTkToplevel):
         self.tree.column('order_count', width=100, anchor=tk.CENTER, stretch=False)
 
         self.tree.grid(row=5, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
+        self.tree_renderer = TreeRenderer(self.tree)
 
         self.order_dict = {}
 
+    def reset(self):
+        """前回の注文内容を消す"""
+        self.result = None
+        self.order_dict.clear()
+        self.tree_renderer.clear()
+
+    def ask(self):
+        """ダイアログを表示し、決定されたら注文内容を返す（閉じられたらNone）"""
+        self.reset()
+        self.done.set(False)
+        self.deiconify()
+        self.lift()
+        self.focus_force()
+        # モーダルにして親ウィンドウを無効化
+        self.grab_set()
+        self.wait_variable(self.done)  # 決定・閉じるまで待機
+        return self.result
+
     def add_to_order(self, option):
         """選択されたオプションを注文に追加し、ツリービューを更新"""
         if option in self.order_dict:
@@ -58,14 +85,8 @@ class ThreeOptionDialog(ctk.CTkToplevel):
         self.update_tree()
 
     def update_tree(self):
-        """ツリービューを注文の内容で更新"""
-        # 既存のアイテムをクリア
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        # 新しい注文内容を表示
-        for topping, count in self.order_dict.items():
-            self.tree.insert('', 'end', values=(topping, count))
+        """ツリービューを注文の内容で更新（増えた行・数が変わった行だけ）"""
+        self.tree_renderer.render((topping, (topping, count), ()) for topping, count in self.order_dict.items())
 
     def confirm_order(self):
         """全ての注文を返し、ダイアログを閉じる"""
@@ -73,27 +94,36 @@ class ThreeOptionDialog(ctk.CTkToplevel):
         self.close_dialog()
 
     def close_dialog(self):
-        """ダイアログを閉じる処理"""
+        """ダイアログを隠す（次の注文で使い回す）"""
         if self.winfo_exists():
             self.grab_release()
-            self.destroy()
+            self.withdraw()
+        self.done.set(True)
+
+
+_dialog = None
+
+
+def prepare_dialog(root):
+    """ダイアログを作って隠しておく（作成済みならそれを返す）"""
+    global _dialog
+    if _dialog is None or _dialog.master is not root or not _dialog.winfo_exists():
+        options = load_config()["toppings"]
+        _dialog = ThreeOptionDialog(root, message="どのソースを選びますか？", options=options)
+        _dialog.withdraw()
+    return _dialog
 
 
 def open_dialog(root):
     """ダイアログを開く処理"""
-    options = ["はちみつ", "チョコソース", "ケチャップ＆マスタード", "ケチャップのみ", "マスタードのみ", "プレーン", "後でトッピング"]
-
-    dialog = ThreeOptionDialog(root, message="どのソースを選びますか？", options=options)
-    root.wait_window(dialog)  # ダイアログが閉じるまで待機
-    
-    return dialog.result
+    return prepare_dialog(root).ask()
 
 
 if __name__ == "__main__":
     root = ctk.CTk()
     root.geometry("400x300")
     # ダイアログを開くボタン
-    open_button = ctk.CTkButton(root, text="Open Dialog", command=lambda: open_dialog(root))
+    open_button = ctk.CTkButton(root, text="Open Dialog", command=lambda: print(open_dialog(root)))
     open_button.grid(row=0, column=0)
 
     root.mainloop()
\ No newline at end of file
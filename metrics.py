@@ -0,0 +1,168 @@
+"""処理時間の計測（有効にしたときだけ）
+
+操作やDB呼び出しの時間を対数刻みのバケットに数えるだけなので、1回の記録は数マイクロ秒で済む。
+JSONまたはPrometheusのテキスト形式でファイルへ書き出せる。
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# バケットの上限（秒）。これを超えた分は+Infに入る
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """処理時間（秒）のヒストグラム"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 末尾は+Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """q（0〜1）分位点の見積もり。値が入ったバケットの上限を返す（+Infなら最大値）"""
+        with self.lock:
+            if not self.count:
+                return None
+            rank = max(1, -(-self.count * q // 1))
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.buckets[index] if index < len(self.buckets) else self.max
+            return self.max
+
+    def snapshot(self):
+        with self.lock:
+            return {"count": self.count, "sum": self.sum, "max": self.max, "counts": list(self.counts)}
+
+
+class Metrics:
+    """名前ごとのヒストグラムをまとめて持つ。enable()するまでは何も記録しない"""
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, seconds):
+        if self.enabled:
+            self.histogram(name).observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """withブロックの処理時間を記録"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name).observe(time.perf_counter() - start)
+
+    def wrap(self, func, name):
+        """呼び出しごとの処理時間を記録する関数を返す"""
+        histogram = self.histogram(name)
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return timed
+
+    def instrument(self, obj, prefix, names=None, exclude=("transaction",)):
+        """objのメソッド（省略時は公開メソッドすべて）を計測付きに差し替える。無効なら何もしない"""
+        if not self.enabled:
+            return
+        if names is None:
+            names = [name for name in dir(type(obj))
+                     if not name.startswith("_") and callable(getattr(type(obj), name))]
+        for name in names:
+            if name not in exclude:
+                setattr(obj, name, self.wrap(getattr(obj, name), f"{prefix}.{name}"))
+
+    # ---- 出力 ----
+    def to_dict(self):
+        result = {}
+        for name, histogram in sorted(self.histograms.items()):
+            snapshot = histogram.snapshot()
+            if not snapshot["count"]:
+                continue
+            result[name] = {
+                "count": snapshot["count"],
+                "sum": snapshot["sum"],
+                "max": snapshot["max"],
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+                "buckets": dict(zip([*map(str, histogram.buckets), "+Inf"], snapshot["counts"])),
+            }
+        return result
+
+    def to_prometheus(self):
+        """Prometheusのテキスト形式（node_exporterのtextfile collectorで読める）"""
+        lines = ["# HELP app_latency_seconds Latency of instrumented calls.",
+                 "# TYPE app_latency_seconds histogram"]
+        for name, histogram in sorted(self.histograms.items()):
+            snapshot = histogram.snapshot()
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip([*map(repr, histogram.buckets), "+Inf"], snapshot["counts"]):
+                cumulative += count
+                lines.append(f'app_latency_seconds_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'app_latency_seconds_sum{{name="{label}"}} {snapshot["sum"]!r}')
+            lines.append(f'app_latency_seconds_count{{name="{label}"}} {snapshot["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """ファイルへ書き出す（拡張子が.promならPrometheus形式、それ以外はJSON）"""
+        if path.endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def summary_lines(self):
+        """デバッグ表示用の1行ずつの要約（ミリ秒）"""
+        lines = [f"{'name':<32}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"]
+        for name, stats in self.to_dict().items():
+            lines.append(f"{name:<32}{stats['count']:>7}" + "".join(
+                f"{stats[key] * 1000:>9.2f}" for key in ("p50", "p95", "p99", "max")))
+        return lines
+
+
+registry = Metrics()
@@ -0,0 +1,45 @@
+class NumberAllocator:
+    """整理番号の払い出し
+
+    使用中の番号をビット列で持ち、カーソル以降で最初の空き番号を返す。
+    最後まで使ったら1番から探し直す（折り返し）。
+    ビット演算だけで求まるので、履歴の長さやmax_numberにほぼ依存しない。
+    """
+
+    def __init__(self, max_number, cursor=1):
+        self.max_number = max_number
+        self.cursor = cursor
+        self.in_use = 0  # i番目のビットが番号iの使用中を表す
+        self.all_numbers = ((1 << (max_number + 1)) - 1) & ~1
+
+    def mark_in_use(self, number):
+        """番号を使用中にする（手動で選んだ番号も含む）"""
+        self.in_use |= 1 << number
+
+    def release(self, number):
+        """番号を空きに戻す"""
+        self.in_use &= ~(1 << number)
+
+    def is_in_use(self, number):
+        return bool(self.in_use >> number & 1)
+
+    def peek(self):
+        """次に払い出す番号（空きがなければNone）"""
+        free = self.all_numbers & ~self.in_use
+        if not free:
+            return None
+        upper = free >> self.cursor << self.cursor
+        candidates = upper or free  # カーソル以降に空きがなければ1番から
+        return (candidates & -candidates).bit_length() - 1
+
+    def allocate(self, number):
+        """番号の払い出しを確定し、カーソルを進める。折り返したらTrueを返す"""
+        wrapped = number < self.cursor
+        self.mark_in_use(number)
+        self.cursor = number + 1
+        return wrapped
+
+    def unallocate(self, number, cursor):
+        """払い出しを取り消し、カーソルを払い出す前の位置に戻す（同じ番号を次にまた使う）"""
+        self.release(number)
+        self.cursor = cursor
@@ -0,0 +1,416 @@
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from typing import NamedTuple
+from database import now_epoch
+from db_writer import DatabaseWriter
+from events import EventBus, TicketAdded, StatusChanged, TicketRemoved, StoreReloaded
+from number_allocator import NumberAllocator
+
+ACTIVE_STATUSES = ('cooking', 'providing')
+UNDO_LIMIT = 100  # メモリ上に持つ取り消し・再実行の操作の数（足りなくなったらログから読み足す）
+TRANSITION_LOG_KEEP = 10000  # ログに残す件数
+
+
+class OrderError(Exception):
+    """操作できなかった理由（メッセージはそのまま画面に表示する）"""
+
+
+class Transition(NamedTuple):
+    """ステータスの変化1件（transitionsテーブルの1行）"""
+    id: int
+    ticket_id: int
+    number: int
+    old_status: str
+    new_status: str
+    items: list  # 注文の追加のときだけ注文内容
+    created_at: int
+    action_id: int  # 同じ操作でまとめて変えたログは同じID
+    cursor: int = None  # オートモードで払い出した注文の追加のときだけ、払い出す前のカーソル
+
+
+def group_actions(transitions):
+    """ID順のログを、同じ操作（action_id）ごとのタプルにまとめる"""
+    actions = []
+    for transition in transitions:
+        if actions and actions[-1][-1].action_id == transition.action_id:
+            actions[-1] += (transition,)
+        else:
+            actions.append((transition,))
+    return actions
+
+
+class Ticket:
+    """整理番号1枚分の注文"""
+    __slots__ = ('id', 'number', 'status', 'accepted_at', 'items')
+
+    def __init__(self, ticket_id, number, status, accepted_at=None, items=None):
+        self.id = ticket_id
+        self.number = number
+        self.status = status
+        self.accepted_at = accepted_at
+        self.items = items if items is not None else []  # [(topping, order_count), ...]
+
+
+class OrderStore:
+    """注文状態をメモリ上に保持し、書き込みはDatabaseWriterに渡してDBへ反映する
+
+    起動時に一度だけDBから読み込み、以降の読み出しはすべてメモリから返す。
+    操作はまずメモリ上の状態を変えてbusへイベントを流し、DBへの書き込みは1操作ごとにまとめて
+    writerへ渡す（writerを起動していれば裏のスレッドでコミットされる）。
+    チケットIDとログのIDはメモリ上で払い出すので、コミットを待たずに使える。
+    DBを読むのは起動時と、提供済みの注文を元に戻すとき・取り消し用のログを読み足すときのみ。
+
+    ステータスの変化はチケットIDごとtransitionsテーブルに記録し、取り消し（undo）と
+    再実行（redo）はそのログを元に行う。まとめて変えた分（update_statuses）は1回の操作として扱う。
+    直近の操作（Transitionのタプル）だけをメモリ上のリングに持つので、再起動後もログの続きから取り消せる。
+    """
+
+    def __init__(self, db_manager, history_manager=None, max_number=30, bus=None, writer=None):
+        self.db_manager = db_manager
+        self.writer = writer if writer is not None else DatabaseWriter(db_manager)
+        self.bus = bus if bus is not None else EventBus()
+        self.history_manager = history_manager
+        self.max_number = max_number
+        self.tickets = {}  # 番号 -> Ticket（調理中・呼出中のみ）
+        self.by_status = {status: {} for status in ACTIVE_STATUSES}  # ステータス -> 番号の順序付き集合
+        self.allocator = None
+        self.undo_ring = deque(maxlen=UNDO_LIMIT)  # 右端が最後の操作
+        self.redo_ring = deque(maxlen=UNDO_LIMIT)  # 右端が次に再実行する操作
+        self.undo_more = self.redo_more = False  # リングに入りきらない分がログに残っているか
+        self.pending_writes = None  # 操作中にためているDBへの書き込み
+        self.last_ticket_id = 0
+        self.last_transition_id = 0
+        self.load()
+
+    def load(self):
+        """DBから現在の状態を読み込む（起動時・復旧時のみ）"""
+        self.tickets.clear()
+        for members in self.by_status.values():
+            members.clear()
+
+        self.writer.reset()  # 失敗した書き込みの後に渡された分は実行しない（ここで読むDBの内容から続ける）
+        with self.writer.reading() as db:
+            self.allocator = NumberAllocator(self.max_number, db.get_allocator_cursor())
+            rows = db.get_active_tickets()
+            self.last_ticket_id = db.last_id('tickets')
+            self.last_transition_id = db.last_id('transitions')
+        for ticket_id, number, status, accepted_at, topping, order_count in rows:
+            ticket = self.tickets.get(number)
+            if ticket is None:
+                ticket = self.tickets[number] = Ticket(ticket_id, number, status, accepted_at)
+                self.by_status[status][number] = ticket
+                self.allocator.mark_in_use(number)
+            ticket.items.append((topping, order_count))
+
+        # 現在の状態はticketsテーブルにあるので、ログは取り消し用に直近の分だけ読めばよい
+        self.undo_ring.clear()
+        self.redo_ring.clear()
+        self.undo_more = self.redo_more = True
+        self._fill_rings()
+        self.bus.publish(StoreReloaded())
+
+    # ---- 読み出し ----
+    def numbers_by_status(self, status):
+        """特定のステータスの番号を受付順で取得"""
+        return list(self.by_status.get(status, ()))
+
+    def first_number(self, status):
+        """特定のステータスで最も古い番号を取得"""
+        return next(iter(self.by_status.get(status, ())), None)
+
+    def status_of(self, number):
+        """番号の現在のステータスを取得（未使用・提供済みはNone）"""
+        ticket = self.tickets.get(number)
+        return ticket.status if ticket else None
+
+    def next_number(self):
+        """オートモードで次に使う番号（空きがなければNone）"""
+        return self.allocator.peek()
+
+    def active_tickets(self):
+        """調理中・呼出中の注文を受付順で取得"""
+        return sorted(self.tickets.values(), key=lambda t: t.id)
+
+    # ---- 書き込み ----
+    @contextmanager
+    def transaction(self):
+        """1回の操作での書き込み（履歴を含む）をまとめて1回でコミットさせる。失敗したらDBから読み直す"""
+        if self.pending_writes is not None:
+            yield self  # 入れ子なら外側でまとめて渡す
+            return
+        self.pending_writes = []
+        try:
+            yield self
+            writes, self.pending_writes = self.pending_writes, None
+            if writes:
+                self.writer.submit(writes)
+        except BaseException:
+            self.pending_writes = None
+            self.load()
+            raise
+
+    def add_order(self, number, order, status='cooking'):
+        """注文を追加し、チケットIDを返す"""
+        order = list(order)
+        with self.transaction():
+            self.last_ticket_id += 1
+            ticket = Ticket(self.last_ticket_id, number, None, now_epoch(), order)
+            self._write(self.db_manager.add_ticket, number, order, status, ticket.id, ticket.accepted_at)
+            self._log(ticket.id, number, 'none', status, order)
+            self._insert(ticket, status)
+        return ticket.id
+
+    def update_status(self, number, new_status):
+        """番号のステータスを更新し、対象のチケットIDを返す"""
+        ticket = self.tickets.get(number)
+        if ticket is None:
+            return None
+        with self.transaction():
+            self._log(ticket.id, number, ticket.status, new_status)
+            self._change_status(ticket, new_status)
+        return ticket.id
+
+    def update_statuses(self, numbers, new_status):
+        """複数の番号のステータスを1回の操作としてまとめて更新し、対象のチケットIDのリストを返す"""
+        tickets = [self.tickets[number] for number in dict.fromkeys(numbers) if number in self.tickets]
+        if not tickets:
+            return []
+        with self.transaction():
+            action_id = self.last_transition_id + 1
+            for ticket in tickets:
+                self._log(ticket.id, ticket.number, ticket.status, new_status, action_id=action_id)
+                self._change_status(ticket, new_status)
+        return [ticket.id for ticket in tickets]
+
+    def undo(self):
+        """最後の操作を取り消し、そのTransitionのタプルを返す（取り消せる操作がなければNone）"""
+        self._fill_rings()
+        if not self.undo_ring:
+            return None
+        action = self.undo_ring[-1]
+        try:
+            with self.transaction():
+                for transition in reversed(action):
+                    self.revert(transition.number, transition.ticket_id, transition.old_status, transition.cursor)
+                    self._write(self.db_manager.set_transition_state, transition.id, 'undone')
+        except OrderError:
+            self._drop(action)
+            raise
+        self.undo_ring.pop()
+        self._push(self.redo_ring, action)
+        return action
+
+    def redo(self):
+        """取り消した操作をやり直し、そのTransitionのタプルを返す（なければNone）"""
+        self._fill_rings()
+        if not self.redo_ring:
+            return None
+        action = self.redo_ring[-1]
+        try:
+            with self.transaction():
+                for transition in action:
+                    self._reapply(transition)
+        except OrderError:
+            self._drop(action)
+            raise
+        self.redo_ring.pop()
+        self._push(self.undo_ring, action)
+        return action
+
+    def revert(self, number, ticket_id, old_status, cursor=None):
+        """やり直し用：指定したチケットを元のステータスに戻す
+
+        cursorを渡すと（オートモードで払い出した注文の追加の取り消し）、払い出し位置と履歴も戻す。
+        """
+        with self.transaction():
+            if old_status == 'none':
+                self._write(self.db_manager.delete_ticket, ticket_id)
+                ticket = self.tickets.get(number)
+                removed_status = None
+                if ticket is not None and ticket.id == ticket_id:
+                    removed_status = ticket.status
+                    self._discard(ticket)
+                if cursor is not None:
+                    # 払い出しを取り消した番号は次にまた使う
+                    self.allocator.unallocate(number, cursor)
+                    self._write(self.db_manager.set_allocator_cursor, self.allocator.cursor)
+                    if self.history_manager is not None:
+                        self._write(self.history_manager.remove_number_from_history, number)
+                self.bus.publish(TicketRemoved(number, ticket_id, removed_status))
+                return
+
+            ticket = self.tickets.get(number)
+            if ticket is None or ticket.id != ticket_id:
+                # 提供済みで手元にない注文はDBから復元する（アーカイブ済みなら戻す）
+                with self.writer.reading() as db:
+                    row = db.get_ticket(ticket_id)
+                if row is None:
+                    # 注文の書き込みが失敗していると、ログだけが残っている
+                    raise OrderError("元に戻す注文が見つかりません。")
+                number, status, accepted_at, items = row
+                self._write(self.db_manager.unarchive_ticket, ticket_id)
+                ticket = self.tickets[number] = Ticket(ticket_id, number, None, accepted_at, items)
+            current_status = ticket.status or 'served'
+            self._write(self.db_manager.update_ticket_status, ticket_id, old_status)
+            self._set_status(ticket, old_status)
+            self.bus.publish(StatusChanged(number, ticket_id, current_status, old_status))
+
+    def archive_served(self, older_than):
+        """提供済みになってからolder_than秒たった注文をアーカイブへ移す（件数を返すFuture）"""
+        return self.writer.submit([partial(self.db_manager.archive_served, now_epoch() - older_than)])
+
+    def prune_log(self, keep=TRANSITION_LOG_KEEP):
+        """ステータス変化のログを直近keep件だけ残す（削除した件数を返すFuture）"""
+        return self.writer.submit([partial(self.db_manager.prune_transitions, keep)])
+
+    def commit_allocation(self, number):
+        """オートモードでの番号の払い出しを確定し、履歴に残す。1番に戻ったらTrueを返す"""
+        with self.transaction():
+            self._mark_allocated(number, self.allocator.cursor)
+            wrapped = self.allocator.allocate(number)
+            self._write(self.db_manager.set_allocator_cursor, self.allocator.cursor)
+            if self.history_manager is not None:
+                self._write(self.history_manager.add_number_to_history, number)
+        return wrapped
+
+    def check_writes(self):
+        """裏での書き込みに失敗していたらDBの内容に戻し、その例外を返す（なければNone）"""
+        error = self.writer.pop_error()
+        if error is not None:
+            while self.writer.pop_error() is not None:
+                pass
+            self.load()
+        return error
+
+    # ---- 内部処理 ----
+    def _write(self, func, *args):
+        """DBへの書き込みを操作の終わりにまとめて渡すよう予約する（transaction()の中で呼ぶ）"""
+        self.pending_writes.append(partial(func, *args))
+
+    def _log(self, ticket_id, number, old_status, new_status, items=None, action_id=None):
+        """ステータスの変化をログに記録する。新しい操作をしたら取り消し済みの操作は再実行できない
+
+        action_idが直前のログと同じなら、同じ操作の続きとしてリングの右端の操作に加える。
+        """
+        now = now_epoch()
+        self.last_transition_id += 1
+        transition = Transition(self.last_transition_id, ticket_id, number, old_status, new_status, items, now,
+                                action_id or self.last_transition_id)
+        self._write(self.db_manager.add_transition, ticket_id, number, old_status, new_status, items, now,
+                    transition.id, transition.action_id)
+        if self.undo_ring and self.undo_ring[-1][-1].action_id == transition.action_id:
+            self.undo_ring[-1] += (transition,)
+        else:
+            self._push(self.undo_ring, (transition,))
+        self.redo_ring.clear()
+        self.redo_more = False
+
+    def _reapply(self, transition):
+        """取り消したログ1件をやり直す"""
+        if transition.old_status == 'none':
+            self._write(self.db_manager.add_ticket, transition.number, transition.items,
+                        transition.new_status, transition.ticket_id, transition.created_at)
+            if transition.cursor is not None:
+                # 取り消しで戻した払い出し位置を進め直し、履歴にも残し直す
+                self.allocator.allocate(transition.number)
+                self._write(self.db_manager.set_allocator_cursor, self.allocator.cursor)
+                if self.history_manager is not None:
+                    self._write(self.history_manager.add_number_to_history, transition.number)
+            self._insert(Ticket(transition.ticket_id, transition.number, None, transition.created_at,
+                                list(transition.items)), transition.new_status)
+        else:
+            ticket = self.tickets.get(transition.number)
+            if ticket is None or ticket.id != transition.ticket_id:
+                # 書き込みの失敗などで、メモリ上の状態がログと合わなくなっている
+                raise OrderError("やり直す注文が見つかりません。")
+            self._change_status(ticket, transition.new_status)
+        self._write(self.db_manager.set_transition_state, transition.id, 'done')
+
+    def _mark_allocated(self, number, cursor):
+        """直前の注文の追加のログに、オートモードで払い出したこと（払い出す前のカーソル）を残す"""
+        if not self.undo_ring:
+            return
+        transition = self.undo_ring[-1][-1]
+        if transition.old_status != 'none' or transition.number != number:
+            return
+        self.undo_ring[-1] = self.undo_ring[-1][:-1] + (transition._replace(cursor=cursor),)
+        self._write(self.db_manager.set_transition_cursor, transition.id, cursor)
+
+    def _drop(self, action):
+        """取り消し・やり直しできない操作のログを捨てて読み直す（残すと次も同じところで止まる）"""
+        self.writer.submit([partial(self.db_manager.delete_transitions, [t.id for t in action])])
+        self.load()
+
+    def _push(self, ring, action):
+        """リングに操作を積む。あふれた分はログに残っているので、空になったら読み足す"""
+        if len(ring) == ring.maxlen:
+            if ring is self.undo_ring:
+                self.undo_more = True
+            else:
+                self.redo_more = True
+        ring.append(action)
+
+    def _fill_rings(self):
+        """リングが空になり、ログに続きが残っていれば読み足す"""
+        fill_undo = self.undo_more and not self.undo_ring
+        fill_redo = self.redo_more and not self.redo_ring
+        if not (fill_undo or fill_redo):
+            return
+        with self.writer.reading() as db:
+            if fill_undo:
+                rows = db.get_transitions('done', UNDO_LIMIT)
+                actions = group_actions(Transition(*row) for row in reversed(rows))
+                self.undo_more = len(rows) == UNDO_LIMIT
+                if self.undo_more and len(actions) > 1:
+                    actions.pop(0)  # 一番古い操作は途中までしか読めていないかもしれない
+                self.undo_ring.extend(actions)
+            if fill_redo:
+                rows = db.get_transitions('undone', UNDO_LIMIT, newest_first=False)
+                actions = group_actions(Transition(*row) for row in rows)
+                self.redo_more = len(rows) == UNDO_LIMIT
+                if self.redo_more and len(actions) > 1:
+                    actions.pop()
+                self.redo_ring.extend(reversed(actions))
+
+    def _insert(self, ticket, status):
+        self.tickets[ticket.number] = ticket
+        self._set_status(ticket, status)
+        self.bus.publish(TicketAdded(ticket.number, ticket.id, status, ticket.items))
+
+    def _change_status(self, ticket, new_status):
+        old_status = ticket.status
+        self._write(self.db_manager.update_ticket_status, ticket.id, new_status)
+        self._set_status(ticket, new_status)
+        self.bus.publish(StatusChanged(ticket.number, ticket.id, old_status, new_status))
+
+    def _set_status(self, ticket, status):
+        """チケットを指定したステータスの集合へ移す"""
+        members = self.by_status.get(ticket.status)
+        if members is not None:
+            members.pop(ticket.number, None)
+        ticket.status = status
+
+        members = self.by_status.get(status)
+        if members is None:
+            # 提供済みは手元に残さない
+            self.tickets.pop(ticket.number, None)
+            self.allocator.release(ticket.number)
+            return
+
+        self.allocator.mark_in_use(ticket.number)
+        last = next(reversed(members.values()), None)
+        members[ticket.number] = ticket
+        if last is not None and last.id > ticket.id:
+            # 受付順より前に戻ってきた番号は並べ直す
+            ordered = sorted(members.values(), key=lambda t: t.id)
+            members.clear()
+            members.update((t.number, t) for t in ordered)
+
+    def _discard(self, ticket):
+        """チケットをメモリから取り除く"""
+        members = self.by_status.get(ticket.status)
+        if members is not None:
+            members.pop(ticket.number, None)
+        self.tickets.pop(ticket.number, None)
+        self.allocator.release(ticket.number)
@@ -1,33 +1,232 @@
-import pygame
+import glob
+import os
 import threading
+import time
+import audio_render
+import voice_bundle
+from metrics import registry as metrics
+from announcer import Announcer
+from sound_cache import SoundCache
+
+SOUND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sound")
+
+num_wav = os.path.join(SOUND_DIR, "metan_num.wav")
+providing_wav = os.path.join(SOUND_DIR, "metan_providing.wav")
+
+# デコード済み音声のキャッシュ上限（番号の範囲を広げる場合はここを調整）
+SOUND_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 呼び出しの待ち行列の上限
+ANNOUNCE_QUEUE_SIZE = 16
+
+# 呼び出し音声の再生方法
+#   "prerendered": 3つのクリップを番号ごとに1つへつないだ音声を1回で再生（sound/announce/ にキャッシュ）
+#   "clips": クリップを順番に再生
+ANNOUNCE_MODE = "prerendered"
+
+# ミキサーを開くまで待つ上限（秒）
+MIXER_TIMEOUT = 10
+
+pygame = None  # start()で裏スレッドから読み込む（importと音声デバイスの初期化に時間がかかるため）
+bundle = None  # ミキサーの形式に合うバンドル（voice_bundle.pyで作成）があれば、そこから読み込む
+mixer_ready = threading.Event()
+mixer_error = None
+_start_lock = threading.Lock()
+_start_thread = None
+
+
+def start():
+    """ミキサーを裏で開き、続けて呼び出し音声を読み込む（何度呼んでもよい）"""
+    global _start_thread
+    with _start_lock:
+        if _start_thread is None:
+            _start_thread = threading.Thread(target=_open_mixer, name="mixer-init", daemon=True)
+            _start_thread.start()
+        return _start_thread
+
+
+def _open_mixer():
+    global pygame, mixer_error
+    try:
+        import pygame as module
+        module.mixer.init()
+        # 呼び出し専用のチャンネルを確保
+        module.mixer.set_reserved(1)
+        pygame = module
+        _open_bundle()
+    except Exception as e:
+        mixer_error = e
+        print(f"音声の初期化に失敗しました: {e}")
+        return
+    finally:
+        mixer_ready.set()
+    preload_sounds().join()
+
+
+def _open_bundle():
+    """ミキサーの形式に合うバンドルがあれば開く（なければWAVファイルから読み込む）"""
+    global bundle
+    mixer_format = _mixer_format()
+    if mixer_format is None:
+        return
+    path = voice_bundle.bundle_path(SOUND_DIR, *mixer_format)
+    if not os.path.exists(path):
+        return
+    try:
+        opened = voice_bundle.VoiceBundle(path)
+    except (OSError, ValueError) as e:
+        print(f"音声バンドルを開けませんでした（WAVファイルを使います）: {e}")
+        return
+    if opened.matches(*mixer_format):
+        bundle = opened
+    else:
+        opened.close()
+
+
+def wait_for_mixer():
+    """ミキサーが開くまで待つ（開けなかったらRuntimeError）"""
+    start()
+    if not mixer_ready.wait(MIXER_TIMEOUT) or mixer_error is not None:
+        raise RuntimeError(f"ミキサーを開けません: {mixer_error}")
+
+
+def shutdown():
+    """呼び出しを止めてミキサーを閉じる"""
+    announcer.stop(timeout=1)
+    if pygame is not None:
+        pygame.mixer.quit()
+    if bundle is not None:
+        bundle.close()
+
+
+def number_wav(providing_num):
+    """番号の音声ファイルのパス"""
+    return os.path.join(SOUND_DIR, f"metan_{providing_num}.wav")
+
+
+def _decoded_size(path, sound):
+    """ミキサーの形式にデコードされた後のバイト数を見積もる"""
+    frequency, size, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * frequency * channels * abs(size) // 8)
+
+
+def _mixer_format():
+    """連結済み音声を作れるミキサーの形式なら (周波数, チャンネル数) を返す"""
+    frequency, size, channels = pygame.mixer.get_init()
+    if size != -16:
+        return None
+    return frequency, channels
+
+
+def _load_clip(path):
+    """クリップを読み込む（バンドルにあればファイルを開かずにmmapから）"""
+    name = voice_bundle.clip_name(path)
+    if bundle is not None and name in bundle:
+        return pygame.mixer.Sound(buffer=bundle.get(name))
+    return pygame.mixer.Sound(path)
+
+
+def _load_announcement(providing_num):
+    """番号の連結済み音声を読み込む。バンドルになく、ファイルもなければ作ってディスクに保存する"""
+    name = voice_bundle.call_name(providing_num)
+    if bundle is not None and name in bundle:
+        return pygame.mixer.Sound(buffer=bundle.get(name))
+    frequency, channels = _mixer_format()
+    path = audio_render.announcement_path(SOUND_DIR, frequency, channels, providing_num)
+    if not os.path.exists(path):
+        clip = number_wav(providing_num)
+        frames = audio_render.render_announcement(
+            [num_wav, clip, providing_wav], frequency, channels, converted=converted_clips)
+        converted_clips.pop(clip, None)  # 共通の前置き・後置きだけ変換済みのものを使い回す
+        try:
+            audio_render.write_wav(path, frequency, channels, frames)
+        except OSError:
+            return pygame.mixer.Sound(buffer=frames)
+    return pygame.mixer.Sound(path)
+
+
+sound_cache = SoundCache(_load_clip, max_bytes=SOUND_CACHE_MAX_BYTES, size_of=_decoded_size)
+converted_clips = {}  # 連結用に変換済みのクリップ（前置き・後置き）
+announce_cache = SoundCache(_load_announcement, max_bytes=SOUND_CACHE_MAX_BYTES, size_of=_decoded_size)
+
+
+def use_prerendered():
+    return ANNOUNCE_MODE == "prerendered" and _mixer_format() is not None
+
+
+def preload_sounds():
+    """呼び出し音声をバックグラウンドで読み込んでおく"""
+    if use_prerendered():
+        return announce_cache.preload_async(audio_render.clip_numbers(SOUND_DIR))
+    number_files = sorted(glob.glob(os.path.join(SOUND_DIR, "metan_*.wav")))
+    return sound_cache.preload_async(number_files, pinned=(num_wav, providing_wav))
+
+
+def play_sound(providing_num, cancelled=None):
+    """引数で指定した番号（まとめて呼び出すときは番号のタプル）を呼び出す音声を再生
+
+    "prerendered"では連結済みの音声を1回だけ再生する。
+    "clips"と複数の番号ではChannel.queueでクリップをつなぎ、クリップの境目はミキサー側で切り替わる。
+    キューには1つしか積めないので、次のクリップは前のクリップの再生中（半分まで進んだところ）に積む。
+    その時刻と再生の終わりは各クリップの長さから求め、待機はcancelledだけで行う（チャンネルの状態は見ない）。
+    取り消されたらすぐに止まる。
+    """
+    cancelled = cancelled or threading.Event()
+    wait_for_mixer()
+    channel = pygame.mixer.Channel(0)
+
+    numbers = providing_num if isinstance(providing_num, tuple) else (providing_num,)
+    if len(numbers) == 1 and use_prerendered():
+        with metrics.timer("sound.load"):
+            sound = announce_cache.get(providing_num)
+        channel.play(sound)
+        _observe_start()
+        if cancelled.wait(sound.get_length()):
+            channel.stop()
+        return
+
+    sound_files = [num_wav, *map(number_wav, numbers), providing_wav]
+    with metrics.timer("sound.load"):
+        sounds = [sound_cache.get(file) for file in sound_files]
+    channel.play(sounds[0])
+    started = time.perf_counter()
+    _observe_start()
+    clip_start = 0  # 再生中のクリップが始まる時刻（再生開始からの秒数）
+    for previous, sound in zip(sounds, sounds[1:]):
+        if cancelled.wait(max(0, started + clip_start + previous.get_length() / 2 - time.perf_counter())):
+            channel.stop()
+            return
+        channel.queue(sound)
+        clip_start += previous.get_length()
+    if cancelled.wait(max(0, started + clip_start + sounds[-1].get_length() - time.perf_counter())):
+        channel.stop()
+
+
+def _observe_start():
+    """呼び出しを受け付けてから再生を始めるまでの時間を記録"""
+    if announcer.queued_at is not None:
+        metrics.observe("sound.queued_to_play", time.perf_counter() - announcer.queued_at)
+
+
+announcer = Announcer(play_sound, maxsize=ANNOUNCE_QUEUE_SIZE)
+
+
+def play_sound_thread(providing_num):
+    """呼び出しを再生待ちの列に追加（番号のリストなら1回の呼び出しにまとめる。同じ番号が待っていれば追加しない）"""
+    return announcer.announce(providing_num)
+
+
+def cancel_sound(providing_num:int):
+    """取り消された番号の呼び出しをやめる"""
+    announcer.cancel(providing_num)
 
-num_wav = "sound\\metan_num.wav"
-providing_wav = "sound\\metan_providing.wav"
-
-pygame.mixer.init()
-
-# スレッド排他制御用のロックを作成
-lock = threading.Lock()
-
-def play_sound(providing_num:int):
-    "引数で指定した番号を呼び出す音声を再生"
-    sound_files = [num_wav, f"sound\\metan_{str(providing_num)}.wav", providing_wav]
-    sounds = [pygame.mixer.Sound(file) for file in sound_files]
-    for sound in sounds:
-        sound.play()
-        while pygame.mixer.get_busy():
-            pygame.time.wait(100)
-
-# 音声再生を別スレッドで開始
-def play_sound_thread(providing_num:int):
-    """音声再生を別スレッドで実行し、同時に並列実行されないように制御"""
-    def sound_with_lock():
-        with lock:
-            play_sound(providing_num)
-    
-    thread = threading.Thread(target=sound_with_lock)
-    thread.start()
 
 if __name__ == "__main__":
-    play_sound_thread("1")
-    play_sound_thread("2")
\ No newline at end of file
+    start().join()
+    play_sound_thread(1)
+    play_sound_thread(2)
+    play_sound_thread(1)
+    while announcer.queue_depth() or announcer.current is not None:
+        time.sleep(0.1)
+    print(sound_cache.stats(), announce_cache.stats(), announcer.stats())
+    shutdown()
@@ -0,0 +1,69 @@
+"""キッチン向けの集計（調理中の注文のトッピングごとの枚数）
+
+注文の追加・ステータスの変化・取り消しのイベントごとに、変わった注文の分だけカウンターを増減する。
+表示のたびに全注文を数え直したり、DBをGROUP BYで集計したりはしない。
+"""
+from collections import Counter
+from events import TicketAdded, StatusChanged, TicketRemoved, StoreReloaded
+
+
+class PrepCounts:
+    """調理中の注文のトッピングごとの合計数"""
+
+    def __init__(self, store):
+        self.store = store
+        self.counts = Counter()  # トッピング -> 枚数
+        self.cooking = {}  # チケットID -> 注文内容（数えている注文）
+        store.bus.subscribe(TicketAdded, self.on_added)
+        store.bus.subscribe(StatusChanged, self.on_status_changed)
+        store.bus.subscribe(TicketRemoved, self.on_removed)
+        store.bus.subscribe(StoreReloaded, lambda event: self.rebuild())
+        self.rebuild()
+
+    def rebuild(self):
+        """メモリ上の注文から数え直す（起動時・DBから読み直したときのみ）"""
+        self.counts.clear()
+        self.cooking.clear()
+        for ticket in self.store.active_tickets():
+            if ticket.status == 'cooking':
+                self._add(ticket.id, ticket.items)
+
+    def on_added(self, event):
+        if event.status == 'cooking':
+            self._add(event.ticket_id, event.items)
+
+    def on_status_changed(self, event):
+        if event.old_status == 'cooking':
+            self._remove(event.ticket_id)
+        if event.new_status == 'cooking':
+            ticket = self.store.tickets.get(event.number)
+            if ticket is not None:
+                self._add(event.ticket_id, ticket.items)
+
+    def on_removed(self, event):
+        self._remove(event.ticket_id)
+
+    def pending(self, order=()):
+        """(トッピング, 枚数) の並び。orderにあるトッピングはその順に先に並べる"""
+        rank = {topping: index for index, topping in enumerate(order)}
+        return sorted(self.counts.items(), key=lambda item: (rank.get(item[0], len(rank)), item[0]))
+
+    def ticket_count(self):
+        """調理中の注文の数"""
+        return len(self.cooking)
+
+    def _add(self, ticket_id, items):
+        if ticket_id in self.cooking:
+            return
+        self.cooking[ticket_id] = items
+        for topping, order_count in items:
+            self.counts[topping] += order_count
+
+    def _remove(self, ticket_id):
+        items = self.cooking.pop(ticket_id, None)
+        if items is None:
+            return
+        for topping, order_count in items:
+            self.counts[topping] -= order_count
+            if self.counts[topping] <= 0:
+                del self.counts[topping]
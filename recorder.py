@@ -0,0 +1,117 @@
+"""操作パネルでの操作の記録（有効にしたときだけ）
+
+環境変数 SESSION_LOG=session.jsonl を設定してmain.pyを起動すると、ボタン・番号の選択・スイッチの操作と
+トッピング選択の結果を、開始からの時刻つきで1行1件のJSONとして書き出す。
+開始時のDBは session.start.db に複製し、終了時のDBの内容を最後の行に残すので、
+replay.pyで同じ操作を流し直して結果を比べられる。
+
+    {"session": 1, "started_at": ..., "config": {...}, "snapshot": "session.start.db"}
+    {"t": 1.52, "dialog": [["はちみつ", 1]]}
+    {"t": 1.50, "action": "cooking_number", "args": [], "ms": 35.2}
+    {"t": 80.1, "final": {"orders": [...], "allocator": 2, "history": [1]}}
+"""
+import json
+import os
+import sqlite3
+import time
+from functools import wraps
+from database import HistoryManager
+
+# 記録する操作（NumberDisplayAppのメソッド名）。操作の中から呼ばれた分は記録しない
+ACTIONS = ("select_number", "select_numbers", "set_auto", "set_multi", "cooking_number", "provide_number",
+           "complete_provide", "undo_action", "redo_action")
+# 戻り値を記録するメソッド（再生時は記録した値を順に返す）
+RESULTS = ("open_order_dialog",)
+
+
+def database_state(db_manager):
+    """再生結果と比べるDBの内容（時刻は除く）"""
+    return {
+        "orders": [list(row) for row in db_manager.get_all_orders()],
+        "allocator": db_manager.get_allocator_cursor(),
+        "history": HistoryManager(db_manager).get_used_numbers(),
+    }
+
+
+def read_session(path):
+    """記録を読み込み、(ヘッダー, 操作の並び, トッピング選択の結果の並び, 終了時のDBの内容) を返す"""
+    header, actions, dialogs, final = None, [], [], None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "session" in entry:
+                header = entry
+            elif "action" in entry:
+                actions.append(entry)
+            elif "dialog" in entry:
+                dialogs.append(entry["dialog"])
+            elif "final" in entry:
+                final = entry["final"]
+    if header is None:
+        raise ValueError(f"操作の記録ではありません: {path}")
+    return header, actions, dialogs, final
+
+
+class SessionRecorder:
+    """操作を1行1件のJSONで記録する（行ごとに書き出すので、途中で落ちても残る）"""
+
+    def __init__(self, path, core, config, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.depth = 0  # 記録中の操作の入れ子の深さ
+
+        snapshot = f"{os.path.splitext(path)[0]}.start.db"
+        with core.writer.reading() as db:
+            destination = sqlite3.connect(snapshot)
+            try:
+                db.conn.backup(destination)
+            finally:
+                destination.close()
+
+        self.file = open(path, "w", encoding="utf-8", buffering=1)
+        self.write({"session": 1, "started_at": time.time(), "config": config,
+                    "snapshot": os.path.basename(snapshot)})
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def elapsed(self):
+        return round(self.clock() - self.started, 4)
+
+    def instrument(self, app, names=ACTIONS, results=RESULTS):
+        """appのメソッドを記録付きに差し替える（ボタンに渡す前に呼ぶ）"""
+        for name in names:
+            setattr(app, name, self.wrap_action(getattr(app, name), name))
+        for name in results:
+            setattr(app, name, self.wrap_result(getattr(app, name)))
+
+    def wrap_action(self, func, name):
+        @wraps(func)
+        def recorded(*args):
+            if self.depth:
+                return func(*args)
+            start = self.clock()
+            self.depth += 1
+            try:
+                return func(*args)
+            finally:
+                self.depth -= 1
+                self.write({"t": round(start - self.started, 4), "action": name, "args": list(args),
+                            "ms": round((self.clock() - start) * 1000, 3)})
+        return recorded
+
+    def wrap_result(self, func):
+        @wraps(func)
+        def recorded(*args):
+            result = func(*args)
+            self.write({"t": self.elapsed(), "dialog": result})
+            return result
+        return recorded
+
+    def close(self, core):
+        """終了時のDBの内容を書き出して閉じる（coreを閉じる前に呼ぶ）"""
+        with core.writer.reading() as db:
+            self.write({"t": self.elapsed(), "final": database_state(db)})
+        self.file.close()
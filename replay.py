@@ -0,0 +1,125 @@
+"""記録した操作（recorder.py）を画面・音声なしで再生する
+
+記録開始時のDBの複製に、記録した操作とトッピング選択の結果を順に流し、
+最後のDBの内容が記録と一致するかと、操作ごとの処理時間（後回しにした再描画は除く）をJSONで出力する。
+Tk・pygameはbench.pyと同じくモックに差し替える。一致しなければ終了コード1を返すので、
+本番の混雑時の記録をそのまま回帰テスト・性能テストに使える。
+
+    python replay.py session.jsonl              # できるだけ速く再生
+    python replay.py session.jsonl --speed 1    # 記録と同じ速さで再生
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+import bench
+from recorder import database_state, read_session
+
+
+class Replayer:
+    """1つの記録を再生し、操作ごとの処理時間と最後のDBの内容を集める"""
+
+    def __init__(self, path, speed=0):
+        self.path = path
+        self.speed = speed  # 0ならできるだけ速く、1なら記録と同じ速さ
+        self.header, self.actions, dialogs, self.expected = read_session(path)
+        self.dialogs = deque(dialogs)
+        self.latencies = defaultdict(list)  # 操作名 -> [ミリ秒, ...]
+        self.recorded = defaultdict(list)  # 操作名 -> 記録時の[ミリ秒, ...]
+        self.state = None
+
+    def next_dialog(self, root=None):
+        """open_dialogの代わりに、記録したトッピング選択の結果を順に返す"""
+        if not self.dialogs:
+            raise RuntimeError("記録したトッピング選択の結果が足りません")
+        order = self.dialogs.popleft()
+        return None if order is None else [tuple(item) for item in order]
+
+    def run(self, workdir):
+        """workdirに記録開始時のDBを複製し、操作を順に流す"""
+        snapshot = os.path.join(os.path.dirname(os.path.abspath(self.path)), self.header["snapshot"])
+        shutil.copyfile(snapshot, os.path.join(workdir, "orders.db"))
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            app = bench.create_headless_app(self.next_dialog, self.header["config"])
+            started = time.perf_counter()
+            for entry in self.actions:
+                if self.speed:
+                    delay = started + entry["t"] / self.speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                name = entry["action"]
+                start = time.perf_counter()
+                getattr(app, name)(*entry["args"])
+                # 記録した時間と同じく、after_idleで後回しにした再描画は含めない
+                self.latencies[name].append((time.perf_counter() - start) * 1000)
+                self.recorded[name].append(entry["ms"])
+                bench.flush_refresh(app)
+            with app.core.writer.reading() as db:
+                self.state = database_state(db)
+            app.core.close()
+        finally:
+            os.chdir(cwd)
+
+    def matches(self):
+        """最後のDBの内容が記録と一致するか（記録に終了時の内容がなければNone）"""
+        return None if self.expected is None else self.state == self.expected
+
+    def results(self):
+        actions = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            recorded = sorted(self.recorded[name])
+            actions[name] = {
+                "count": len(values),
+                "p50_ms": round(bench.percentile(values, 50), 3),
+                "p95_ms": round(bench.percentile(values, 95), 3),
+                "max_ms": round(values[-1], 3),
+                "recorded_p50_ms": round(bench.percentile(recorded, 50), 3),
+                "recorded_p95_ms": round(bench.percentile(recorded, 95), 3),
+            }
+        result = {
+            "session": os.path.basename(self.path),
+            "revision": bench.git_revision(),
+            "speed": self.speed,
+            "state_matches": self.matches(),
+            "actions": actions,
+        }
+        if self.matches() is False:
+            result["expected_state"] = self.expected
+            result["replayed_state"] = self.state
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="記録した操作を画面なしで再生し、結果と処理時間を確認する")
+    parser.add_argument("session", help="SESSION_LOGで記録したファイル")
+    parser.add_argument("--speed", type=float, default=0, help="再生の速さ（1で記録と同じ、0でできるだけ速く）")
+    parser.add_argument("--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    replayer = Replayer(args.session, args.speed)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as workdir:
+        # アプリのprintは結果のJSONと混ざらないよう標準エラーへ
+        with contextlib.redirect_stdout(sys.stderr):
+            replayer.run(workdir)
+
+    text = json.dumps(replayer.results(), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if replayer.matches() is False else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""営業後の集計レポート
+
+注文のデータベース（複数日・複数店舗ならファイルを並べて指定）を少しずつ読み込み、
+待ち時間の分布・10分ごとの受付数・トッピングの内訳を集計する。
+待ち時間は1秒刻みのヒストグラムに積むので、行数が増えてもメモリ使用量は変わらない。
+numpyがあればチャンクごとにまとめて計算する。
+
+    python report.py orders.db
+    python report.py day1/orders.db day2/orders.db --json
+"""
+import argparse
+import json
+import sqlite3
+import sys
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+try:
+    import numpy as np
+except ImportError:  # numpyがなくても同じ結果になる（少し遅いだけ）
+    np = None
+
+JST = timezone(timedelta(hours=9), "JST")
+BUCKET_SECONDS = 10 * 60
+MAX_LATENCY = 4 * 60 * 60  # これより長い待ち時間は最後のビンにまとめる
+CHUNK_SIZE = 10000
+PERCENTILES = (50, 90, 95, 99)
+
+
+class LatencyHistogram:
+    """1秒刻みの待ち時間ヒストグラム"""
+
+    def __init__(self, max_seconds=MAX_LATENCY):
+        self.max_seconds = max_seconds
+        if np is not None:
+            self.counts = np.zeros(max_seconds + 1, dtype=np.int64)
+        else:
+            self.counts = array("q", bytes(8 * (max_seconds + 1)))
+        self.total = 0
+        self.sum = 0
+
+    def add_many(self, values):
+        """待ち時間（秒）の並びをまとめて追加"""
+        if np is not None:
+            values = np.clip(np.asarray(values, dtype=np.int64), 0, self.max_seconds)
+            if values.size:
+                self.counts += np.bincount(values, minlength=self.max_seconds + 1)
+                self.total += int(values.size)
+                self.sum += int(values.sum())
+            return
+        counts = self.counts
+        limit = self.max_seconds
+        for value in values:
+            value = 0 if value < 0 else limit if value > limit else value
+            counts[value] += 1
+            self.total += 1
+            self.sum += value
+
+    def percentile(self, p):
+        """p%点（nearest-rank）。データがなければNone"""
+        if not self.total:
+            return None
+        rank = max(1, -(-self.total * p // 100))  # 切り上げ
+        if np is not None:
+            return int(np.searchsorted(np.cumsum(self.counts), rank))
+        seen = 0
+        for seconds, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return seconds
+        return self.max_seconds
+
+    def summary(self):
+        return {
+            "count": self.total,
+            "mean": round(self.sum / self.total, 1) if self.total else None,
+            **{f"p{p}": self.percentile(p) for p in PERCENTILES},
+        }
+
+
+def fetch_chunks(conn, sql, chunk_size=CHUNK_SIZE):
+    """クエリの結果をchunk_size行ずつ返す"""
+    cursor = conn.execute(sql)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+class Report:
+    """複数のデータベースをまとめて集計する"""
+
+    def __init__(self):
+        self.cook_to_call = LatencyHistogram()
+        self.call_to_serve = LatencyHistogram()
+        self.per_bucket = Counter()  # 10分ごとの区切りの開始時刻（UNIX時間 // 600） -> 受付数
+        self.toppings = Counter()
+        self.tickets = 0
+
+    def add_tickets(self, rows):
+        """(accepted_at, called_at, served_at) の並びを集計"""
+        self.tickets += len(rows)
+        if np is not None:
+            data = np.array(rows, dtype=np.float64)  # NULLはnanになる
+            accepted, called, served = data[:, 0], data[:, 1], data[:, 2]
+            has_call = ~np.isnan(called)
+            self.cook_to_call.add_many((called - accepted)[has_call])
+            has_serve = has_call & ~np.isnan(served)
+            self.call_to_serve.add_many((served - called)[has_serve])
+            buckets, counts = np.unique(accepted.astype(np.int64) // BUCKET_SECONDS, return_counts=True)
+            self.per_bucket.update(dict(zip(buckets.tolist(), counts.tolist())))
+            return
+
+        self.cook_to_call.add_many([called - accepted for accepted, called, _ in rows if called is not None])
+        self.call_to_serve.add_many([served - called for _, called, served in rows
+                                     if called is not None and served is not None])
+        self.per_bucket.update(accepted // BUCKET_SECONDS for accepted, _, _ in rows)
+
+    def add_database(self, path, chunk_size=CHUNK_SIZE):
+        """1つのデータベースファイルを読み込む（読み取り専用で開く）"""
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            # 読み取り専用なので移行はできない。古い形式（v5より前）ならアプリで一度開いてもらう
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'all_tickets'").fetchone() is None:
+                raise ValueError(f"{path} は古い形式です。一度アプリ（main.py）を起動して移行してから集計してください")
+            for rows in fetch_chunks(conn, "SELECT accepted_at, called_at, served_at FROM all_tickets", chunk_size):
+                self.add_tickets(rows)
+            sql = "SELECT topping, SUM(order_count) FROM all_order_items GROUP BY topping"
+            for rows in fetch_chunks(conn, sql, chunk_size):
+                self.toppings.update(dict(rows))
+        finally:
+            conn.close()
+
+    def to_dict(self):
+        return {
+            "tickets": self.tickets,
+            "cook_to_call_seconds": self.cook_to_call.summary(),
+            "call_to_serve_seconds": self.call_to_serve.summary(),
+            "orders_per_10min": {
+                datetime.fromtimestamp(bucket * BUCKET_SECONDS, JST).strftime("%Y-%m-%d %H:%M"): count
+                for bucket, count in sorted(self.per_bucket.items())
+            },
+            "toppings": dict(self.toppings.most_common()),
+        }
+
+
+def format_text(result):
+    """レポートを読みやすい文字列にする"""
+    lines = [f"注文数: {result['tickets']}", ""]
+    for key, title in (("cook_to_call_seconds", "受付→呼出"), ("call_to_serve_seconds", "呼出→提供")):
+        summary = result[key]
+        values = "  ".join(f"p{p}={summary[f'p{p}']}秒" for p in PERCENTILES)
+        lines.append(f"{title}: {summary['count']}件 平均={summary['mean']}秒  {values}")
+    lines += ["", "10分ごとの受付数:"]
+    lines += [f"  {bucket}  {count:>4} {'#' * count}" for bucket, count in result["orders_per_10min"].items()]
+    lines += ["", "トッピング:"]
+    lines += [f"  {topping}: {count}" for topping, count in result["toppings"].items()]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="注文データベースから待ち時間・受付数・トッピングを集計する")
+    parser.add_argument("databases", nargs="+", help="orders.dbのパス（複数指定可）")
+    parser.add_argument("--json", action="store_true", help="JSONで出力")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    report = Report()
+    for path in args.databases:
+        try:
+            report.add_database(path, args.chunk_size)
+        except ValueError as e:
+            sys.exit(f"error: {e}")
+    result = report.to_dict()
+    if args.json:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(format_text(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class SoundCache:
+    """デコード済みの音声をメモリ上にLRUで保持する
+
+    loaderにはファイルパスから音声オブジェクトを作る関数（pygame.mixer.Soundなど）を渡す。
+    size_ofで1件あたりのバイト数を見積もり、合計がmax_bytesを超えたら
+    最も長く使われていないものから捨てる。pinしたもの（共通の前置き・後置き）は捨てない。
+    """
+
+    def __init__(self, loader, max_bytes=64 * 1024 * 1024, size_of=None):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.size_of = size_of or (lambda path, sound: os.path.getsize(path))
+        self.lock = threading.Lock()
+        self.sounds = OrderedDict()  # パス -> (音声, バイト数)
+        self.pinned = set()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path):
+        """音声を取得。キャッシュになければ読み込む"""
+        with self.lock:
+            entry = self.sounds.get(path)
+            if entry is not None:
+                self.sounds.move_to_end(path)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return self._load(path)
+
+    def pin(self, *paths):
+        """容量を超えても捨てない音声として登録"""
+        with self.lock:
+            self.pinned.update(paths)
+
+    def preload(self, paths, pinned=()):
+        """音声をまとめて読み込む（ヒット・ミスの集計には含めない）"""
+        self.pin(*pinned)
+        for path in [*pinned, *paths]:
+            with self.lock:
+                if path in self.sounds:
+                    continue
+            try:
+                self._load(path)
+            except Exception as e:
+                print(f"音声の読み込みに失敗しました: {path} ({e})")
+
+    def preload_async(self, paths, pinned=()):
+        """音声の読み込みをバックグラウンドで行う"""
+        thread = threading.Thread(target=self.preload, args=(list(paths), tuple(pinned)), daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """キャッシュの利用状況を取得"""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.sounds),
+                "bytes": self.total_bytes,
+            }
+
+    def _load(self, path):
+        sound = self.loader(path)
+        size = self.size_of(path, sound)
+        with self.lock:
+            if path in self.sounds:
+                # 別スレッドが先に読み込んでいた
+                self.sounds.move_to_end(path)
+                return self.sounds[path][0]
+            self.sounds[path] = (sound, size)
+            self.total_bytes += size
+            self._evict()
+        return sound
+
+    def _evict(self):
+        """上限を超えた分を古い順に捨てる"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        for path in list(self.sounds):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if path in self.pinned or path == next(reversed(self.sounds)):
+                continue
+            _, size = self.sounds.pop(path)
+            self.total_bytes -= size
+            self.evictions += 1
@@ -1,7 +1,36 @@
 import unittest
 import sqlite3
-from unittest.mock import patch
-from main import DatabaseManager, HistoryManager  # モジュール名は適切に変更してください
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import urllib.request
+import threading
+import time
+import wave
+from array import array
+from unittest.mock import Mock, patch
+from database import DatabaseManager, HistoryManager, MIGRATIONS, migrate, import_legacy_history
+from order_store import OrderStore
+from core import OrderCore, OrderError
+from db_writer import DatabaseWriter
+from wait_estimator import WaitEstimator
+from prep_board import PrepCounts
+from recorder import SessionRecorder, read_session
+from incremental_view import TreeRenderer, LabelText, RefreshScheduler, Pager
+from events import EventBus, TicketAdded, StatusChanged, TicketRemoved
+from display_server import DisplayServer
+from sound_cache import SoundCache
+from number_allocator import NumberAllocator
+from announcer import Announcer
+import audio_render
+import voice_bundle
+import report
+import config
+from metrics import Metrics, Histogram
 
 class TestDatabaseManager(unittest.TestCase):
 
@@ -9,7 +38,7 @@ class TestDatabaseManager(unittest.TestCase):
         """テスト用にメモリ内データベースを使用"""
         self.db_manager = DatabaseManager(':memory:')  # メモリ内データベースを使用
         self.db_manager.create_table()
-        self.db_manager.add_number(1, 'cooking')
+        self.ticket_id = self.db_manager.add_ticket(1, [('はちみつ', 1)], 'cooking')
 
     def test_add_number(self):
         """番号をデータベースに追加できているか"""
@@ -22,26 +51,489 @@ class TestDatabaseManager(unittest.TestCase):
         result = self.db_manager.get_numbers_by_status('providing')
         self.assertIn(1, result)
 
+    def test_update_ticket_status(self):
+        """チケットIDでステータスを更新し、呼出・提供の時刻を記録"""
+        self.db_manager.update_ticket_status(self.ticket_id, 'providing')
+        self.db_manager.update_ticket_status(self.ticket_id, 'served')
+        cursor = self.db_manager.conn.execute("SELECT called_at, served_at FROM tickets WHERE id = ?", (self.ticket_id,))
+        called_at, served_at = cursor.fetchone()
+        self.assertIsNotNone(called_at)
+        self.assertIsNotNone(served_at)
+
     def test_delete_number(self):
         """番号をデータベースから削除"""
-        self.db_manager.delete_number(1)
+        self.db_manager.delete_ticket(self.ticket_id)
         result = self.db_manager.get_numbers_by_status('cooking')
         self.assertNotIn(1, result)
 
     def test_get_numbers_by_status(self):
         """ステータスによる番号の取得"""
-        self.db_manager.add_number(2, 'providing')
+        self.db_manager.add_ticket(2, [('プレーン', 1)], 'providing')
         cooking_numbers = self.db_manager.get_numbers_by_status('cooking')
         providing_numbers = self.db_manager.get_numbers_by_status('providing')
         self.assertIn(1, cooking_numbers)
         self.assertIn(2, providing_numbers)
 
 
+class FailingCommit:
+    """最初のcount回のコミットがSQLITE_BUSYで失敗する接続"""
+
+    def __init__(self, conn, count=1):
+        self.conn = conn
+        self.count = count
+
+    def commit(self):
+        if self.count:
+            self.count -= 1
+            raise sqlite3.OperationalError('database is locked')
+        self.conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class TestTransaction(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'orders.db')
+        self.db_manager = DatabaseManager(self.path)
+        self.addCleanup(self.db_manager.conn.close)
+
+    def committed_numbers(self):
+        """別の接続から見えるコミット済みの番号"""
+        conn = sqlite3.connect(self.path)
+        try:
+            return [row[0] for row in conn.execute("SELECT number FROM tickets ORDER BY id")]
+        finally:
+            conn.close()
+
+    def test_wal_mode(self):
+        """WALモードで開く"""
+        mode = self.db_manager.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_commit_once_at_end(self):
+        """トランザクション中はコミットせず、抜けたときにまとめてコミット"""
+        with self.db_manager.transaction():
+            ticket_id = self.db_manager.add_ticket(1, [('はちみつ', 1), ('プレーン', 2)], 'cooking')
+            with self.db_manager.transaction():
+                self.db_manager.update_ticket_status(ticket_id, 'providing')
+            self.assertEqual(self.committed_numbers(), [])
+        self.assertEqual(self.committed_numbers(), [1])
+
+    def test_rollback(self):
+        """例外が起きたら全て取り消す"""
+        with self.assertRaises(RuntimeError):
+            with self.db_manager.transaction():
+                self.db_manager.add_ticket(1, [('はちみつ', 1)], 'cooking')
+                raise RuntimeError
+        self.assertEqual(self.committed_numbers(), [])
+        self.assertEqual(self.db_manager.get_numbers_by_status('cooking'), [])
+
+    def test_rollback_failed_commit(self):
+        """コミットに失敗したら取り消し、次の書き込みはそれだけでコミットする"""
+        conn = self.db_manager.conn
+        self.db_manager.conn = FailingCommit(conn)
+        with self.assertRaises(sqlite3.OperationalError):
+            with self.db_manager.transaction():
+                self.db_manager.add_ticket(1, [('はちみつ', 1)], 'cooking')
+        self.assertFalse(conn.in_transaction)
+        self.db_manager.add_ticket(2, [('プレーン', 1)], 'cooking')
+        self.assertEqual(self.committed_numbers(), [2])
+
+    def test_allocation_is_atomic(self):
+        """注文と番号の使用履歴は同じトランザクションでコミットされる"""
+        store = OrderStore(self.db_manager, HistoryManager(self.db_manager))
+        with self.assertRaises(RuntimeError):
+            with store.transaction():
+                store.add_order(1, [('はちみつ', 1)])
+                store.commit_allocation(1)
+                raise RuntimeError
+        self.assertEqual(store.history_manager.get_used_numbers(), [])
+        self.assertEqual(self.db_manager.get_allocator_cursor(), 1)
+        self.assertEqual(store.next_number(), 1)
+
+    def test_import_legacy_history(self):
+        """旧history.dbの履歴を取り込む"""
+        history_path = os.path.join(self.tmpdir.name, 'history.db')
+        legacy = sqlite3.connect(history_path)
+        legacy.execute("CREATE TABLE history (id INTEGER PRIMARY KEY, number INTEGER NOT NULL, used_at TIMESTAMP)")
+        legacy.executemany("INSERT INTO history (number, used_at) VALUES (?, ?)",
+                           [(1, '2024-11-23 11:00:00'), (2, '2024-11-23 11:01:00')])
+        legacy.commit()
+        legacy.close()
+
+        self.assertEqual(import_legacy_history(self.db_manager, history_path), 2)
+        self.assertEqual(HistoryManager(self.db_manager).get_used_numbers(), [1, 2])
+        self.assertFalse(os.path.exists(history_path))
+        self.assertTrue(os.path.exists(history_path + '.imported'))
+
+    def test_upgrade_legacy_pair(self):
+        """旧orders.dbとhistory.dbから移行したら、払い出しは履歴の続きの番号から"""
+        orders_path = os.path.join(self.tmpdir.name, 'legacy_orders.db')
+        legacy = sqlite3.connect(orders_path)
+        legacy.execute('''CREATE TABLE orders (id INTEGER PRIMARY KEY, number INTEGER NOT NULL,
+                          topping TEXT NOT NULL, order_count INTEGER NOT NULL, status TEXT NOT NULL,
+                          accepted_at TIMESTAMP, updated_at TIMESTAMP)''')
+        legacy.commit()
+        legacy.close()
+        history_path = os.path.join(self.tmpdir.name, 'history.db')
+        legacy = sqlite3.connect(history_path)
+        legacy.execute("CREATE TABLE history (id INTEGER PRIMARY KEY, number INTEGER NOT NULL, used_at TIMESTAMP)")
+        legacy.executemany("INSERT INTO history (number, used_at) VALUES (?, '2024-11-23 11:00:00')",
+                           [(1,), (2,), (3,)])
+        legacy.commit()
+        legacy.close()
+
+        core = OrderCore(orders_path, legacy_history=history_path)
+        self.addCleanup(core.close)
+        self.assertEqual(core.next_auto_number(), 4)
+
+    def test_store_reloads_after_rollback(self):
+        """失敗した操作はメモリ上の状態にも残らない"""
+        store = OrderStore(self.db_manager)
+        with self.assertRaises(RuntimeError):
+            with store.transaction():
+                store.add_order(1, [('はちみつ', 1)])
+                raise RuntimeError
+        self.assertEqual(store.numbers_by_status('cooking'), [])
+
+
+class TestMigration(unittest.TestCase):
+
+    def test_upgrade_legacy_orders(self):
+        """旧ordersテーブルをtickets/order_itemsへ移行"""
+        conn = sqlite3.connect(':memory:')
+        conn.execute('''CREATE TABLE orders (
+                            id INTEGER PRIMARY KEY,
+                            number INTEGER NOT NULL,
+                            topping TEXT NOT NULL,
+                            order_count INTEGER NOT NULL,
+                            status TEXT NOT NULL,
+                            accepted_at TIMESTAMP,
+                            updated_at TIMESTAMP
+                        )''')
+        conn.executemany("INSERT INTO orders (number, topping, order_count, status, accepted_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)", [
+            (1, 'はちみつ', 2, 'served', '2024-11-23 11:00:00', '2024-11-23 11:10:00'),
+            (1, 'プレーン', 1, 'served', '2024-11-23 11:00:00', '2024-11-23 11:10:00'),
+            (2, 'チョコソース', 1, 'cooking', '2024-11-23 11:05:00', '2024-11-23 11:05:00'),
+        ])
+        conn.commit()
+
+        self.assertEqual(migrate(conn), MIGRATIONS[-1][0])
+        tickets = conn.execute("SELECT number, status, accepted_at, served_at FROM tickets ORDER BY id").fetchall()
+        self.assertEqual(tickets, [(1, 'served', 1732327200, 1732327800), (2, 'cooking', 1732327500, None)])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM order_items").fetchone()[0], 3)
+
+        # 2回目以降は何もしない
+        self.assertEqual(migrate(conn), MIGRATIONS[-1][0])
+
+    def test_status_update_uses_index(self):
+        """ステータス・番号の検索がインデックスを使う"""
+        db_manager = DatabaseManager(':memory:')
+        plan = db_manager.conn.execute("EXPLAIN QUERY PLAN SELECT number FROM tickets WHERE status = ? ORDER BY id", ('cooking',)).fetchall()
+        self.assertIn('idx_tickets_status', str(plan))
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.db_manager = DatabaseManager(':memory:')
+        self.store = OrderStore(self.db_manager)
+
+    def count(self, table):
+        return self.db_manager.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_archive_served(self):
+        """提供済みの注文だけをアーカイブへ移し、集計用のビューからは見える"""
+        served_id = self.store.add_order(1, [('はちみつ', 1), ('プレーン', 1)])
+        self.store.add_order(2, [('プレーン', 1)])
+        self.store.update_status(1, 'served')
+
+        self.assertEqual(self.store.archive_served(-1).result(), 1)
+        self.assertEqual((self.count('tickets'), self.count('order_items')), (1, 1))
+        self.assertEqual((self.count('tickets_archive'), self.count('order_items_archive')), (1, 2))
+        self.assertEqual(len(self.db_manager.get_all_orders()), 3)
+
+        # アーカイブ済みのIDは再利用しない
+        self.assertGreater(self.store.add_order(3, [('プレーン', 1)]), served_id + 1)
+
+    def test_recent_served_are_kept(self):
+        """猶予時間内の提供済みは残す"""
+        self.store.add_order(1, [('はちみつ', 1)])
+        self.store.update_status(1, 'served')
+        self.assertEqual(self.store.archive_served(600).result(), 0)
+
+    def test_undo_archived(self):
+        """アーカイブ済みの注文もやり直しで戻せる"""
+        ticket_id = self.store.add_order(1, [('はちみつ', 1)])
+        self.store.update_status(1, 'providing')
+        self.store.update_status(1, 'served')
+        self.store.archive_served(-1)
+        self.store.revert(1, ticket_id, 'providing')
+        self.assertEqual(self.store.numbers_by_status('providing'), [1])
+        self.assertEqual(self.db_manager.get_numbers_by_status('providing'), [1])
+        self.assertEqual(self.count('tickets_archive'), 0)
+
+
+class TestReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'orders.db')
+        db_manager = DatabaseManager(self.path)
+        conn = db_manager.conn
+        start = 1_700_000_400  # 10分の区切りちょうど
+        for i in range(1, 11):
+            ticket_id = db_manager.add_ticket(i, [('はちみつ', 1), ('プレーン', i % 2)], 'cooking')
+            conn.execute("UPDATE tickets SET status = 'served', accepted_at = ?, called_at = ?, served_at = ? WHERE id = ?",
+                         (start + i * 60, start + i * 60 + i * 10, start + i * 60 + i * 10 + 5, ticket_id))
+        db_manager.add_ticket(11, [('はちみつ', 2)], 'cooking')
+        conn.execute("UPDATE tickets SET accepted_at = ? WHERE number = 11", (start + 700,))
+        conn.commit()
+        db_manager.archive_served(start + 400)
+        conn.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_report(self):
+        """アーカイブ済みも含めて待ち時間・受付数・トッピングを集計する"""
+        result = report.Report()
+        result.add_database(self.path, chunk_size=3)
+        result = result.to_dict()
+        self.assertEqual(result['tickets'], 11)
+        self.assertEqual(result['cook_to_call_seconds']['count'], 10)
+        self.assertEqual(result['cook_to_call_seconds']['p50'], 50)
+        self.assertEqual(result['cook_to_call_seconds']['p99'], 100)
+        self.assertEqual(result['call_to_serve_seconds']['mean'], 5)
+        self.assertEqual(list(result['orders_per_10min'].values()), [9, 2])
+        self.assertEqual(result['toppings'], {'はちみつ': 12, 'プレーン': 5})
+
+    def test_pure_python_matches(self):
+        """numpyの有無で結果が変わらない"""
+        with_numpy = report.Report()
+        with_numpy.add_database(self.path)
+        with patch.object(report, 'np', None):
+            without = report.Report()
+            without.add_database(self.path)
+            self.assertEqual(without.to_dict(), with_numpy.to_dict())
+
+    def test_legacy_database(self):
+        """移行前のデータベースは集計せず、移行を促すメッセージで終わる"""
+        path = os.path.join(self.tmp.name, 'legacy.db')
+        legacy = sqlite3.connect(path)
+        legacy.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, number INTEGER NOT NULL)")
+        legacy.commit()
+        legacy.close()
+        with self.assertRaisesRegex(ValueError, '移行'):
+            report.Report().add_database(path)
+        result = subprocess.run([sys.executable, 'report.py', path], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('main.py', result.stderr)
+        self.assertNotIn('Traceback', result.stderr)
+
+    def test_histogram_clips(self):
+        """上限を超える待ち時間は最後のビンに入る"""
+        with patch.object(report, 'np', None):
+            histogram = report.LatencyHistogram(max_seconds=10)
+            histogram.add_many([3, 30, -1])
+            self.assertEqual((histogram.percentile(50), histogram.percentile(100)), (3, 10))
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'config.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load(self):
+        """config.jsonの値で既定値を上書きする"""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'toppings': ['はちみつ', 'きなこ']}, f, ensure_ascii=False)
+        self.assertEqual(config.load_config(self.path)['toppings'], ['はちみつ', 'きなこ'])
+
+    def test_missing_or_broken(self):
+        """ファイルがない・壊れているときは既定値を使う"""
+        self.assertEqual(config.load_config(self.path), config.DEFAULTS)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{')
+        with patch('builtins.print'):
+            self.assertEqual(config.load_config(self.path), config.DEFAULTS)
+
+    def test_shipped_config(self):
+        """同梱のconfig.jsonが読める"""
+        self.assertEqual(config.load_config()['toppings'], config.DEFAULTS['toppings'])
+
+
+class TestBench(unittest.TestCase):
+
+    def test_smoke_profile(self):
+        """画面なしで負荷をかけ、操作ごとの計測結果をJSONで出力する"""
+        result = subprocess.run([sys.executable, 'bench.py', '--profile', 'smoke', '--seed', '1'],
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        actions = json.loads(result.stdout)['actions']
+        self.assertGreater(actions['cooking_number']['count'], 0)
+        self.assertEqual(actions['undo_action']['count'], actions['redo_action']['count'])
+        self.assertLessEqual(actions['provide_number']['p50_ms'], actions['provide_number']['p99_ms'])
+        self.assertGreater(actions['complete_provide']['db_ops_per_action'], 0)
+
+
+class FakeOperator:
+    """main.NumberDisplayAppと同じ順にcoreを呼ぶ操作パネルの代わり"""
+
+    def __init__(self, core):
+        self.core = core
+        self.selected_number = None
+
+    def select_number(self, num):
+        self.selected_number = num
+
+    def open_order_dialog(self):
+        return [('はちみつ', 2)]
+
+    def cooking_number(self):
+        order = self.open_order_dialog() if self.core.needs_order(self.selected_number) else None
+        self.core.start_cooking(self.selected_number, order)
+        self.select_number(None)
+
+    def provide_number(self):
+        self.core.call_many([self.selected_number])
+        self.select_number(None)
+
+    def undo_action(self):
+        self.core.undo()
+
+
+class TestSessionRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'session.jsonl')
+        self.core = OrderCore(os.path.join(self.tmp.name, 'orders.db'), legacy_history=None)
+        self.core.start_cooking(5, [('プレーン', 1)])  # 記録前からある注文
+
+    def tearDown(self):
+        self.core.close()
+        self.tmp.cleanup()
+
+    def record(self):
+        recorder = SessionRecorder(self.path, self.core, dict(config.DEFAULTS))
+        app = FakeOperator(self.core)
+        recorder.instrument(app, names=('select_number', 'cooking_number', 'provide_number', 'undo_action'))
+        for number in (1, 2):
+            app.select_number(number)
+            app.cooking_number()
+        app.select_number(1)
+        app.provide_number()
+        app.undo_action()
+        app.select_number(2)
+        app.provide_number()
+        recorder.close(self.core)
+
+    def test_record(self):
+        """操作の中から呼ばれた操作は記録せず、ダイアログの結果は順に残す"""
+        self.record()
+        header, actions, dialogs, final = read_session(self.path)
+        self.assertEqual(header['snapshot'], 'session.start.db')
+        self.assertEqual([entry['action'] for entry in actions],
+                         ['select_number', 'cooking_number'] * 2
+                         + ['select_number', 'provide_number', 'undo_action', 'select_number', 'provide_number'])
+        self.assertEqual(actions[0]['args'], [1])
+        self.assertEqual(dialogs, [[['はちみつ', 2]]] * 2)
+        self.assertEqual([(order[0], order[2]) for order in final['orders']],
+                         [(5, 'cooking'), (1, 'cooking'), (2, 'providing')])
+
+        # 開始時のDBには記録前の注文だけがある
+        snapshot = DatabaseManager(os.path.join(self.tmp.name, header['snapshot']))
+        self.assertEqual([order[0] for order in snapshot.get_all_orders()], [5])
+        snapshot.conn.close()
+
+    def test_replay(self):
+        """記録を画面なしで再生すると、終了時のDBの内容が一致する"""
+        self.record()
+        result = subprocess.run([sys.executable, 'replay.py', self.path], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        replayed = json.loads(result.stdout)
+        self.assertTrue(replayed['state_matches'])
+        self.assertEqual(replayed['actions']['cooking_number']['count'], 2)
+
+        # 結果が変わったら終了コード1で知らせる
+        with open(self.path, encoding='utf-8') as f:
+            lines = f.readlines()
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.writelines(line for line in lines if '"undo_action"' not in line)
+        result = subprocess.run([sys.executable, 'replay.py', self.path], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 1)
+        self.assertFalse(json.loads(result.stdout)['state_matches'])
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_histogram_quantile(self):
+        """分位点は値が入ったバケットの上限で見積もる"""
+        histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+        for seconds in (0.0005,) * 90 + (0.05,) * 9 + (3.0,):
+            histogram.observe(seconds)
+        self.assertEqual(histogram.quantile(0.5), 0.001)
+        self.assertEqual(histogram.quantile(0.95), 0.1)
+        self.assertEqual(histogram.quantile(1.0), 3.0)
+
+    def test_disabled_does_nothing(self):
+        """有効にするまではメソッドを差し替えず、記録もしない"""
+        db_manager = DatabaseManager(':memory:')
+        self.metrics.instrument(db_manager, 'db')
+        self.metrics.observe('sound.load', 0.1)
+        self.assertNotIn('add_ticket', vars(db_manager))
+        self.assertEqual(self.metrics.to_dict(), {})
+
+    def test_instrument_and_export(self):
+        """DB呼び出しを計測し、JSONとPrometheus形式で書き出す"""
+        self.metrics.enable()
+        db_manager = DatabaseManager(':memory:')
+        self.metrics.instrument(db_manager, 'db')
+        ticket_id = db_manager.add_ticket(1, [('はちみつ', 1)], 'cooking')
+        db_manager.update_ticket_status(ticket_id, 'providing')
+        with db_manager.transaction():
+            db_manager.update_ticket_status(ticket_id, 'served')
+        with self.metrics.timer('update_display'):
+            pass
+
+        stats = self.metrics.to_dict()
+        self.assertEqual(stats['db.update_ticket_status']['count'], 2)
+        self.assertEqual(stats['db.add_ticket']['count'], 1)
+        self.assertNotIn('db.transaction', stats)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.prom')
+            self.metrics.export(path)
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            self.assertIn('app_latency_seconds_bucket{name="db.update_ticket_status",le="+Inf"} 2', text)
+            self.assertIn('app_latency_seconds_count{name="update_display"} 1', text)
+            self.metrics.export(os.path.join(tmp, 'metrics.json'))
+            with open(os.path.join(tmp, 'metrics.json'), encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['db.add_ticket']['count'], 1)
+            self.assertEqual(sorted(os.listdir(tmp)), ['metrics.json', 'metrics.prom'])
+
+
 class TestHistoryManager(unittest.TestCase):
 
     def setUp(self):
         """テスト用にメモリ内データベースを使用"""
-        self.history_manager = HistoryManager(':memory:')  # メモリ内データベースを使用
+        self.history_manager = HistoryManager(DatabaseManager(':memory:'))  # メモリ内データベースを使用
         self.history_manager.create_table()
         self.history_manager.add_number_to_history(1)
 
@@ -63,5 +555,930 @@ class TestHistoryManager(unittest.TestCase):
         result = self.history_manager.get_used_numbers()
         self.assertEqual(result, [])
 
+class TestOrderStore(unittest.TestCase):
+
+    def setUp(self):
+        """テスト用にメモリ内データベースを使用"""
+        self.db_manager = DatabaseManager(':memory:')
+        self.history_manager = HistoryManager(self.db_manager)
+        self.store = OrderStore(self.db_manager, self.history_manager)
+
+    def test_add_order(self):
+        """注文を追加するとメモリとDBの両方に反映される"""
+        self.store.add_order(1, [('はちみつ', 2), ('プレーン', 1)])
+        self.assertEqual(self.store.numbers_by_status('cooking'), [1])
+        self.assertEqual(self.store.tickets[1].items, [('はちみつ', 2), ('プレーン', 1)])
+        self.assertEqual(self.db_manager.get_numbers_by_status('cooking'), [1])
+
+    def test_update_status(self):
+        """ステータスの移動と提供済みの除外"""
+        self.store.add_order(1, [('はちみつ', 1)])
+        self.store.add_order(2, [('プレーン', 1)])
+        self.store.update_status(1, 'providing')
+        self.assertEqual(self.store.numbers_by_status('cooking'), [2])
+        self.assertEqual(self.store.first_number('providing'), 1)
+        self.store.update_status(1, 'served')
+        self.assertIsNone(self.store.status_of(1))
+        self.assertEqual(self.db_manager.get_numbers_by_status('served'), [1])
+
+    def test_revert(self):
+        """やり直しで提供済みの注文が受付順の位置に戻る"""
+        first_id = self.store.add_order(1, [('はちみつ', 1)])
+        self.store.add_order(2, [('プレーン', 1)])
+        self.store.update_status(1, 'served')
+        self.store.revert(1, first_id, 'cooking')
+        self.assertEqual(self.store.numbers_by_status('cooking'), [1, 2])
+        self.assertEqual(self.store.tickets[1].items, [('はちみつ', 1)])
+        self.store.revert(1, first_id, 'none')
+        self.assertEqual(self.store.numbers_by_status('cooking'), [2])
+        self.assertEqual(self.db_manager.get_numbers_by_status('cooking'), [2])
+
+    def test_load(self):
+        """起動時にDBから状態を復元"""
+        self.store.add_order(1, [('はちみつ', 1)])
+        self.store.add_order(2, [('プレーン', 1)])
+        self.store.update_status(2, 'providing')
+        self.store.commit_allocation(2)
+        reloaded = OrderStore(self.db_manager, self.history_manager)
+        self.assertEqual(reloaded.numbers_by_status('cooking'), [1])
+        self.assertEqual(reloaded.numbers_by_status('providing'), [2])
+        self.assertEqual(reloaded.next_number(), 3)
+
+    def test_undo_redo(self):
+        """ログに記録したチケットIDで取り消し・やり直しができる"""
+        first_id = self.store.add_order(1, [('はちみつ', 2)])
+        self.store.add_order(2, [('プレーン', 1)])
+        self.store.update_status(1, 'providing')
+
+        transition, = self.store.undo()
+        self.assertEqual((transition.ticket_id, transition.old_status, transition.new_status),
+                         (first_id, 'cooking', 'providing'))
+        self.assertEqual(self.store.numbers_by_status('cooking'), [1, 2])
+        self.store.undo()
+        self.store.undo()
+        self.assertEqual(self.store.numbers_by_status('cooking'), [])
+        self.assertIsNone(self.store.undo())
+
+        self.store.redo()
+        self.store.redo()
+        self.assertEqual(self.store.tickets[1].id, first_id)
+        self.assertEqual(self.store.tickets[1].items, [('はちみつ', 2)])
+        self.assertEqual(self.db_manager.get_numbers_by_status('cooking'), [1, 2])
+
+        # 新しい操作をしたら、取り消した操作はやり直せない
+        self.store.update_status(2, 'providing')
+        self.assertIsNone(self.store.redo())
+        self.assertEqual(self.store.numbers_by_status('cooking'), [1])
+
+    def test_undo_after_restart(self):
+        """再起動しても、ログの続きから取り消せる"""
+        self.store.add_order(1, [('はちみつ', 1)])
+        self.store.update_status(1, 'providing')
+        self.store.update_status(1, 'served')
+        self.store.undo()
+
+        reloaded = OrderStore(self.db_manager, self.history_manager)
+        self.assertEqual(reloaded.numbers_by_status('providing'), [1])
+        self.assertEqual(reloaded.redo()[0].new_status, 'served')
+        reloaded.undo()
+        reloaded.undo()
+        reloaded.undo()
+        self.assertIsNone(reloaded.status_of(1))
+        self.assertEqual(self.db_manager.get_all_orders(), [])
+
+    def test_batch_undo(self):
+        """まとめて変えた番号は1回のコミットで書き込み、1回の操作として取り消す（再起動後も）"""
+        for number in (1, 2, 3):
+            self.store.add_order(number, [('はちみつ', 1)])
+        commits = []
+        self.db_manager.conn.set_trace_callback(lambda sql: sql.startswith('COMMIT') and commits.append(sql))
+        self.assertEqual(len(self.store.update_statuses([3, 1, 3], 'providing')), 2)
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(self.store.numbers_by_status('providing'), [1, 3])
+
+        action = self.store.undo()
+        self.assertEqual([(t.number, t.new_status) for t in action], [(3, 'providing'), (1, 'providing')])
+        self.assertEqual(self.store.numbers_by_status('providing'), [])
+        self.assertEqual([t.number for t in self.store.redo()], [3, 1])
+
+        reloaded = OrderStore(self.db_manager, self.history_manager)
+        self.assertEqual(len(reloaded.undo()), 2)
+        self.assertEqual(reloaded.numbers_by_status('cooking'), [1, 2, 3])
+        self.assertEqual(len(reloaded.undo()), 1)
+
+    def test_undo_ring_refills(self):
+        """リングより古い操作はログから読み足し、ログは指定件数に切り詰められる"""
+        with patch('order_store.UNDO_LIMIT', 2):
+            store = OrderStore(self.db_manager)
+            for number in range(1, 6):
+                store.add_order(number, [('プレーン', 1)])
+            self.assertEqual(len(store.undo_ring), 2)
+            for _ in range(5):
+                store.undo()
+        self.assertEqual(store.numbers_by_status('cooking'), [])
+        self.assertEqual(self.store.prune_log(keep=3).result(), 2)
+
+    def test_redo_missing_ticket(self):
+        """メモリ上に注文がなければやり直さず、そのログを捨てる"""
+        ticket_id = self.store.add_order(1, [('プレーン', 1)])
+        self.store.update_status(1, 'providing')
+        self.store.undo()
+        self.db_manager.delete_ticket(ticket_id)  # 注文の書き込みに失敗して読み直した状態
+        self.store.load()
+        with self.assertRaisesRegex(OrderError, '見つかりません'):
+            self.store.redo()
+        self.assertIsNone(self.store.redo())
+
+    def test_prune_keeps_whole_action(self):
+        """まとめて行った操作の途中でログを切り詰めても、その操作は丸ごと残して戻せる"""
+        for number in (1, 2, 3):
+            self.store.add_order(number, [('プレーン', 1)])
+        self.store.update_statuses([1, 2, 3], 'providing')
+        self.assertEqual(self.store.prune_log(keep=2).result(), 3)
+
+        reloaded = OrderStore(self.db_manager, self.history_manager)
+        self.assertEqual(len(reloaded.undo()), 3)
+        self.assertEqual(reloaded.numbers_by_status('cooking'), [1, 2, 3])
+        self.assertIsNone(reloaded.undo())
+
+
+class TestOrderCore(unittest.TestCase):
+
+    def setUp(self):
+        self.core = OrderCore(':memory:', max_number=3, legacy_history=None)
+
+    def test_auto_flow(self):
+        """オートモードで受付・呼び出し・提供を進め、番号は1番に戻る"""
+        for number in (1, 2, 3):
+            self.assertEqual(self.core.next_auto_number(), number)
+            self.core.add_auto(number, [('はちみつ', 1)])
+        with self.assertRaises(OrderError):
+            self.core.next_auto_number()
+
+        self.assertEqual(self.core.transfer_first('cooking', 'providing'), 1)
+        self.assertEqual(self.core.transfer_first('providing', 'served'), 1)
+        self.assertEqual(self.core.next_auto_number(), 1)
+        self.assertTrue(self.core.add_auto(1, [('プレーン', 1)]))
+
+    def test_manual_errors(self):
+        """操作できないときはOrderErrorで理由を返す"""
+        with self.assertRaisesRegex(OrderError, 'トッピング'):
+            self.core.start_cooking(2, [])
+        self.assertTrue(self.core.needs_order(2))
+        self.core.start_cooking(2, [('はちみつ', 1)])
+        self.assertFalse(self.core.needs_order(2))
+        with self.assertRaisesRegex(OrderError, '既に調理中'):
+            self.core.start_cooking(2)
+        with self.assertRaises(OrderError):
+            self.core.complete(2)
+        self.core.call(2)
+        self.core.start_cooking(2)  # 呼出中から調理中へ戻す
+        self.assertEqual(self.core.store.numbers_by_status('cooking'), [2])
+        self.assertEqual(self.core.undo()[0].old_status, 'providing')
+        self.assertEqual(self.core.redo()[0].new_status, 'cooking')
+
+    def test_batch_call(self):
+        """複数の番号をまとめて呼び出し、まとめて取り消す"""
+        for number in (1, 2, 3):
+            self.core.start_cooking(number, [('プレーン', 1)])
+        self.core.call(1)
+        with self.assertRaisesRegex(OrderError, '（1）'):
+            self.core.call_many([2, 1, 3])  # 1つでも調理中でなければ何もしない
+        self.assertEqual(self.core.store.numbers_by_status('providing'), [1])
+        self.core.call_many([3, 2])
+        self.core.complete_many([1, 2, 3])
+        self.assertEqual(len(self.core.undo()), 3)
+        self.assertEqual(len(self.core.undo()), 2)
+        self.assertEqual(self.core.store.numbers_by_status('cooking'), [2, 3])
+
+    def test_imports_without_gui(self):
+        """coreとplay_soundのimportでは画面・音声のモジュールを読み込まない"""
+        code = "import sys, core, play_sound; print(sorted({'tkinter', 'customtkinter', 'pygame'} & set(sys.modules)))"
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), '[]')
+
+
+class TestDatabaseWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'orders.db')
+
+    def test_background_core(self):
+        """裏のスレッドで書き込んでも、閉じた後のDBはメモリ上の状態と同じ"""
+        core = OrderCore(self.path, max_number=3, legacy_history=None, background_writes=True)
+        for number in (1, 2):
+            core.add_auto(number, [('はちみつ', number)])
+        core.call(1)
+        core.complete(1)
+        self.assertEqual(core.undo()[0].new_status, 'served')  # 提供済みの注文はコミットを待ってDBから戻す
+        core.call(2)
+        self.assertIsNone(core.check_writes())
+        core.close()
+
+        reloaded = OrderCore(self.path, max_number=3, legacy_history=None)
+        self.addCleanup(reloaded.close)
+        self.assertEqual(reloaded.store.numbers_by_status('providing'), [1, 2])
+        self.assertEqual(reloaded.next_auto_number(), 3)
+        self.assertEqual(reloaded.undo()[0].new_status, 'providing')
+        self.assertEqual(reloaded.store.add_order(3, [('プレーン', 1)]), 3)
+
+    def test_group_commit(self):
+        """コミット中に渡された書き込みは、次の1回のコミットにまとめる"""
+        db_manager = DatabaseManager(self.path, check_same_thread=False)
+        commits = []
+        db_manager.conn.set_trace_callback(lambda sql: sql.startswith('COMMIT') and commits.append(sql))
+        writer = DatabaseWriter(db_manager).start()
+        self.addCleanup(db_manager.conn.close)
+        started, release = threading.Event(), threading.Event()
+
+        first = writer.submit([lambda: db_manager.add_ticket(1, [('はちみつ', 1)], 'cooking'),
+                               started.set, release.wait])
+        started.wait()
+        futures = [writer.submit([lambda n=n: db_manager.add_ticket(n, [('はちみつ', 1)], 'cooking')])
+                   for n in (2, 3, 4)]
+        release.set()
+        writer.close()
+        self.assertTrue(first.result())
+        self.assertEqual([future.result() for future in futures], [2, 3, 4])
+        self.assertEqual(len(commits), 2)
+
+    def test_failed_write(self):
+        """失敗した書き込みだけが例外になり、同じコミットの他の書き込みは残る"""
+        db_manager = DatabaseManager(self.path, check_same_thread=False)
+        writer = DatabaseWriter(db_manager, batch_size=8)
+        self.addCleanup(db_manager.conn.close)
+        started, release = threading.Event(), threading.Event()
+        writer.start().submit([started.set, release.wait])
+        started.wait()
+        good = writer.submit([lambda: db_manager.add_ticket(1, [('はちみつ', 1)], 'cooking')])
+        bad = writer.submit([lambda: db_manager.add_ticket(2, [], 'cooking', ticket_id=1)])
+        release.set()
+        writer.close()
+        self.assertEqual(good.result(), 1)
+        self.assertIsInstance(bad.exception(), sqlite3.IntegrityError)
+        self.assertIs(writer.pop_error(), bad.exception())
+        self.assertIsNone(writer.pop_error())
+        self.assertEqual(db_manager.get_ticket(1)[0], 1)
+
+    def test_failed_commit(self):
+        """コミットに失敗した書き込みは完了扱いにせず、書き込みスレッドは動き続ける"""
+        db_manager = DatabaseManager(self.path, check_same_thread=False)
+        self.addCleanup(db_manager.conn.close)
+        db_manager.conn = FailingCommit(db_manager.conn, count=2)  # まとめたコミットと1件ずつのやり直しが失敗
+        writer = DatabaseWriter(db_manager).start()
+        future = writer.submit([lambda: db_manager.add_ticket(1, [('はちみつ', 1)], 'cooking')])
+        self.assertIsInstance(future.exception(timeout=5), sqlite3.OperationalError)
+        writer.reset()
+        self.assertEqual(writer.submit([lambda: db_manager.add_ticket(2, [('プレーン', 1)], 'cooking')])
+                         .result(timeout=5), 1)
+        writer.close()
+        self.assertEqual(db_manager.get_numbers_by_status('cooking'), [2])
+
+    def test_abort_after_failure(self):
+        """失敗した書き込みの後に渡された分は、読み直すまで実行しない"""
+        core = OrderCore(self.path, max_number=3, legacy_history=None, background_writes=True)
+        self.addCleanup(core.close)
+        started, release = threading.Event(), threading.Event()
+        core.writer.submit([started.set, release.wait])
+        started.wait()
+        core.store.add_order(1, [('はちみつ', 1)])
+        core.writer.submit([lambda: core.db_manager.add_ticket(9, [], 'cooking', ticket_id=1)])  # 失敗する
+        core.store.add_order(2, [('プレーン', 1)])
+        core.call(2)  # 失敗した書き込みの後なので実行しない
+        release.set()
+        core.writer.submit([]).result()
+
+        self.assertIsInstance(core.check_writes(), sqlite3.IntegrityError)
+        self.assertEqual(core.store.numbers_by_status('cooking'), [1])
+        self.assertEqual(core.store.numbers_by_status('providing'), [])
+        core.call(1)  # 読み直した後は書き込める
+        self.assertEqual(core.undo()[0].number, 1)
+        self.assertEqual(core.undo()[0].number, 1)
+        with self.assertRaises(OrderError):
+            core.undo()
+        self.assertIsNone(core.check_writes())
+
+    def test_undo_missing_ticket(self):
+        """注文がDBにないログは取り消せず、ログから捨てる"""
+        core = OrderCore(self.path, max_number=3, legacy_history=None)
+        self.addCleanup(core.close)
+        ticket_id = core.store.add_order(1, [('はちみつ', 1)])
+        core.call(1)
+        core.complete(1)
+        core.db_manager.delete_ticket(ticket_id)
+        for _ in range(2):  # 提供完了・呼び出しのログ
+            with self.assertRaisesRegex(OrderError, '見つかりません'):
+                core.undo()
+        self.assertEqual(core.undo()[0].old_status, 'none')
+        with self.assertRaises(OrderError):
+            core.undo()
+
+
+class TestWaitEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.db_manager = DatabaseManager(':memory:')
+        self.store = OrderStore(self.db_manager)
+        self.now = 0
+        self.estimator = WaitEstimator(self.store, alpha=0.5, clock=lambda: self.now)
+
+    def call_after(self, number, seconds):
+        self.store.add_order(number, [('はちみつ', 1)])
+        self.now = self.store.tickets[number].accepted_at + seconds
+        self.store.update_status(number, 'providing')
+
+    def test_moving_average(self):
+        """呼び出すたびに調理時間の移動平均を更新し、取り消したら元に戻す"""
+        self.assertIsNone(self.estimator.estimate_minutes())
+        self.call_after(1, 240)
+        self.assertEqual(self.estimator.estimate_minutes(), 4)
+        self.call_after(2, 480)
+        self.assertEqual((self.estimator.mean, self.estimator.estimate_minutes()), (360, 6))
+        self.assertEqual(self.estimator.ready_at(), self.now + 360)
+
+        self.store.undo()  # 2番の呼び出しを取り消す
+        self.assertEqual((self.estimator.mean, self.estimator.count), (240, 1))
+        self.store.update_status(1, 'served')
+        self.assertEqual(self.estimator.count, 1)
+
+    def test_seed_from_database(self):
+        """起動時は直近の呼び出し済みの注文から初期化する"""
+        for number, seconds in ((1, 120), (2, 300)):
+            ticket_id = self.db_manager.add_ticket(number, [('プレーン', 1)], 'cooking', accepted_at=1000)
+            self.db_manager.conn.execute("UPDATE tickets SET called_at = ? WHERE id = ?", (1000 + seconds, ticket_id))
+        self.db_manager.add_ticket(3, [('プレーン', 1)], 'cooking', accepted_at=1000)
+        self.assertEqual(self.db_manager.get_recent_cook_times(5), [120, 300])
+        self.assertEqual(self.db_manager.get_recent_cook_times(1), [300])
+
+        core = OrderCore(':memory:', legacy_history=None)
+        self.addCleanup(core.close)
+        self.assertIsNone(core.wait_estimator.mean)
+        core.wait_estimator.seed([120, 300])
+        self.assertEqual(core.wait_estimator.estimate_minutes(), 3)  # 120 + 0.2 * (300 - 120) = 156秒
+
+
+class TestPrepCounts(unittest.TestCase):
+
+    def setUp(self):
+        self.db_manager = DatabaseManager(':memory:')
+        self.store = OrderStore(self.db_manager)
+        self.prep_counts = PrepCounts(self.store)
+
+    def recount(self):
+        """調理中の注文を全部数え直した結果（比較用）"""
+        counts = {}
+        for ticket in self.store.active_tickets():
+            if ticket.status == 'cooking':
+                for topping, order_count in ticket.items:
+                    counts[topping] = counts.get(topping, 0) + order_count
+        return counts
+
+    def test_counts_follow_events(self):
+        """追加・ステータス変更・取り消し・読み直しのたびに、数え直した結果と一致する"""
+        self.store.add_order(1, [('はちみつ', 2), ('プレーン', 1)])
+        self.store.add_order(2, [('はちみつ', 1)])
+        self.store.add_order(3, [('チョコソース', 3)])
+        self.assertEqual(dict(self.prep_counts.counts), {'はちみつ': 3, 'プレーン': 1, 'チョコソース': 3})
+
+        steps = [
+            lambda: self.store.update_statuses([1, 3], 'providing'),
+            self.store.undo,
+            self.store.redo,
+            lambda: self.store.update_status(3, 'cooking'),
+            lambda: self.store.update_status(1, 'served'),
+            self.store.undo,
+            self.store.undo,
+            self.store.load,
+        ]
+        for step in steps:
+            step()
+            self.assertEqual(dict(self.prep_counts.counts), self.recount())
+        self.assertEqual(self.prep_counts.ticket_count(), 1)
+
+    def test_pending_order(self):
+        """設定のトッピングの順に並べ、設定にないものは後ろに回す"""
+        self.store.add_order(1, [('プレーン', 1), ('特製', 1), ('はちみつ', 2)])
+        self.assertEqual(self.prep_counts.pending(['はちみつ', 'プレーン']),
+                         [('はちみつ', 2), ('プレーン', 1), ('特製', 1)])
+        self.store.update_status(1, 'providing')
+        self.assertEqual(self.prep_counts.pending(), [])
+
+
+class FakeTree:
+    """Treeviewの呼び出しを記録するテスト用の代替"""
+
+    def __init__(self):
+        self.children = []
+        self.items = {}
+        self.calls = []
+        self.next_iid = 0
+
+    def insert(self, parent, index, values=(), tags=()):
+        self.next_iid += 1
+        iid = f"I{self.next_iid}"
+        self.items[iid] = (values, tags)
+        self.children.insert(len(self.children) if index == 'end' else index, iid)
+        self.calls.append('insert')
+        return iid
+
+    def delete(self, *iids):
+        for iid in iids:
+            self.children.remove(iid)
+            del self.items[iid]
+        self.calls.append('delete')
+
+    def move(self, iid, parent, index):
+        self.children.remove(iid)
+        self.children.insert(index, iid)
+        self.calls.append('move')
+
+    def item(self, iid, values=(), tags=()):
+        self.items[iid] = (values, tags)
+        self.calls.append('item')
+
+    def rows(self):
+        return [self.items[iid][0] for iid in self.children]
+
+
+class TestEvents(unittest.TestCase):
+
+    def test_store_publishes_events(self):
+        """注文の追加・ステータス変更・取り消しでイベントが流れる"""
+        db_manager = DatabaseManager(':memory:')
+        store = OrderStore(db_manager)
+        events = []
+        store.bus.subscribe(None, events.append)
+
+        ticket_id = store.add_order(1, [('はちみつ', 1)])
+        store.update_status(1, 'providing')
+        store.revert(1, ticket_id, 'cooking')
+        store.revert(1, ticket_id, 'none')
+        self.assertEqual(events, [
+            TicketAdded(1, ticket_id, 'cooking', [('はちみつ', 1)]),
+            StatusChanged(1, ticket_id, 'cooking', 'providing'),
+            StatusChanged(1, ticket_id, 'providing', 'cooking'),
+            TicketRemoved(1, ticket_id, 'cooking'),
+        ])
+
+    def test_subscribe_by_type(self):
+        """型を指定した購読はその型のイベントだけを受け取る"""
+        bus = EventBus()
+        received = []
+        bus.subscribe(TicketRemoved, received.append)
+        bus.publish(StatusChanged(1, 1, 'cooking', 'providing'))
+        bus.publish(TicketRemoved(1, 1, 'cooking'))
+        self.assertEqual(received, [TicketRemoved(1, 1, 'cooking')])
+
+
+class FakeWidget:
+    """after/after_idleの予約を記録するテスト用の代替"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after_idle(self, callback):
+        self.scheduled.append((0, callback))
+        return len(self.scheduled)
+
+    def after(self, ms, callback):
+        self.scheduled.append((ms, callback))
+        return len(self.scheduled)
+
+    def after_cancel(self, after_id):
+        self.scheduled[after_id - 1] = (None, None)
+
+    def run_pending(self):
+        pending, self.scheduled = self.scheduled, []
+        for ms, callback in pending:
+            if callback is not None:
+                callback()
+
+
+class TestRefreshScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.widget = FakeWidget()
+        self.redraws = []
+        self.scheduler = RefreshScheduler(self.widget, lambda: self.redraws.append(self.now),
+                                          max_rate=10, clock=lambda: self.now)
+
+    def test_burst_is_coalesced(self):
+        """続けて要求しても1回だけ描き直す"""
+        for _ in range(5):
+            self.scheduler.request()
+        self.widget.run_pending()
+        self.assertEqual(len(self.redraws), 1)
+        self.assertEqual((self.scheduler.requests, self.scheduler.runs), (5, 1))
+
+    def test_rate_is_capped(self):
+        """前回から間隔が空いていなければ遅らせる"""
+        self.scheduler.request()
+        self.widget.run_pending()
+        self.now += 0.03
+        self.scheduler.request()
+        self.assertEqual(self.widget.scheduled[0][0], 70)
+
+    def test_flush_cancels_pending(self):
+        """flushしたら予約済みの描画は取り消す"""
+        self.scheduler.request()
+        self.scheduler.flush()
+        self.widget.run_pending()
+        self.assertEqual(len(self.redraws), 1)
+
+
+class TestPager(unittest.TestCase):
+
+    def test_pages(self):
+        """1ページ分だけを切り出し、ページ送りは端で止まる"""
+        pager = Pager(30, 300)
+        self.assertEqual((pager.page_count, pager.bounds()), (10, (0, 30)))
+        self.assertFalse(pager.prev())
+        pager.show(299)
+        self.assertEqual(pager.bounds(), (270, 300))
+        self.assertFalse(pager.next())
+        self.assertTrue(pager.next(wrap=True))
+        self.assertEqual(pager.page, 0)
+
+    def test_shrink(self):
+        """件数が減ったら表示できる最後のページへ戻る"""
+        pager = Pager(5)
+        numbers = list(range(1, 13))
+        pager.set_total(len(numbers))
+        pager.show(11)
+        self.assertEqual(pager.slice(numbers), [11, 12])
+        pager.set_total(4)
+        self.assertEqual((pager.page, pager.page_count), (0, 1))
+        self.assertFalse(pager.next(wrap=True))
+
+
+class TestDisplayServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = DisplayServer(host='127.0.0.1', port=0).start()
+        self.addCleanup(self.server.stop)
+
+    def open_events(self):
+        sock = socket.create_connection(('127.0.0.1', self.server.port), timeout=2)
+        self.addCleanup(sock.close)
+        sock.sendall(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        return sock.makefile('rb')
+
+    def read_event(self, stream):
+        event = {}
+        for line in stream:
+            line = line.decode('utf-8').rstrip('\n')
+            if not line:
+                if event:
+                    return event
+                continue
+            key, _, value = line.partition(': ')
+            event[key] = value
+
+    def test_snapshot_then_delta(self):
+        """接続時にスナップショット、その後は差分だけが届く"""
+        self.server.publish([1, 2], [])
+        stream = self.open_events()
+        while stream.readline() not in (b"\r\n", b""):
+            pass
+        snapshot = self.read_event(stream)
+        self.assertEqual(snapshot['event'], 'snapshot')
+        self.assertEqual(json.loads(snapshot['data'])['cooking'], [1, 2])
+
+        self.server.publish([2], [1])
+        delta = self.read_event(stream)
+        self.assertEqual(delta['event'], 'delta')
+        data = json.loads(delta['data'])
+        self.assertEqual(data['add'], {'cooking': [], 'providing': [1]})
+        self.assertEqual(data['remove'], {'cooking': [1], 'providing': []})
+
+    def test_page(self):
+        """表示用ページを返す"""
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.server.port}/", timeout=2) as response:
+            self.assertIn('EventSource', response.read().decode('utf-8'))
+
+
+class TestNumberAllocator(unittest.TestCase):
+
+    def test_next_free_after_cursor(self):
+        """カーソル以降の空き番号を順に払い出す"""
+        allocator = NumberAllocator(5)
+        allocator.mark_in_use(2)
+        self.assertEqual(allocator.peek(), 1)
+        allocator.allocate(1)
+        self.assertEqual(allocator.peek(), 3)
+
+    def test_wrap_around(self):
+        """最後まで使ったら1番から空きを探す"""
+        allocator = NumberAllocator(3, cursor=3)
+        allocator.mark_in_use(1)
+        self.assertFalse(allocator.allocate(allocator.peek()))
+        self.assertEqual(allocator.peek(), 2)
+        self.assertTrue(allocator.allocate(2))
+        self.assertIsNone(allocator.peek())
+        allocator.release(1)
+        self.assertEqual(allocator.peek(), 1)
+
+    def test_unallocate(self):
+        """取り消した番号は次にまた使う"""
+        allocator = NumberAllocator(5)
+        allocator.allocate(allocator.peek())
+        allocator.unallocate(1, 1)
+        self.assertEqual(allocator.peek(), 1)
+
+    def test_store_releases_on_undo_and_serve(self):
+        """提供完了・取り消しで番号が空く"""
+        db_manager = DatabaseManager(':memory:')
+        store = OrderStore(db_manager, HistoryManager(db_manager), max_number=2)
+        for _ in range(2):
+            number = store.next_number()
+            with store.transaction():
+                store.add_order(number, [('プレーン', 1)])
+                store.commit_allocation(number)
+        self.assertIsNone(store.next_number())
+        store.update_status(1, 'served')
+        self.assertEqual(store.next_number(), 1)
+        ticket_id = store.add_order(1, [('プレーン', 1)])
+        store.commit_allocation(1)
+        store.revert(1, ticket_id, 'none')
+        self.assertEqual(store.next_number(), 1)
+
+    def test_undo_auto_allocation(self):
+        """取り消した自動の払い出しは再起動後も戻り、手動の注文の取り消しでは戻らない"""
+        db_manager = DatabaseManager(':memory:')
+        history = HistoryManager(db_manager)
+        store = OrderStore(db_manager, history, max_number=5)
+        for _ in range(2):
+            number = store.next_number()
+            with store.transaction():
+                store.add_order(number, [('プレーン', 1)])
+                store.commit_allocation(number)
+        store.update_status(2, 'served')
+        store.add_order(2, [('プレーン', 1)])  # 最後に自動で払い出した番号を手動で使う
+        store.undo()
+        self.assertEqual(store.next_number(), 3)
+
+        store.undo()  # 提供完了の取り消し
+        restarted = OrderStore(db_manager, history, max_number=5)
+        restarted.undo()
+        self.assertEqual(restarted.next_number(), 2)
+        self.assertEqual(history.get_used_numbers(), [1])
+        restarted.redo()
+        self.assertEqual(restarted.next_number(), 3)
+        self.assertEqual(history.get_used_numbers(), [1, 2])
+
+
+class TestTreeRenderer(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = FakeTree()
+        self.renderer = TreeRenderer(self.tree)
+        self.renderer.render([(1, (1, '調理中'), ()), (2, (2, '調理中'), ())])
+        self.tree.calls.clear()
+
+    def test_unchanged_rows_are_not_touched(self):
+        """変化がなければTkを呼ばない"""
+        self.renderer.render([(1, (1, '調理中'), ()), (2, (2, '調理中'), ())])
+        self.assertEqual(self.tree.calls, [])
+
+    def test_only_changes_are_applied(self):
+        """追加・削除・タグ変更だけを反映"""
+        self.renderer.render([(0, (5, '調理中'), ()), (2, (2, '呼出中'), ('providing',)), (3, (3, '調理中'), ())])
+        self.assertEqual(sorted(self.tree.calls), ['delete', 'insert', 'insert', 'item'])
+        self.assertEqual(self.tree.rows(), [(5, '調理中'), (2, '呼出中'), (3, '調理中')])
+
+    def test_move(self):
+        """並び順の変更は移動で反映"""
+        self.renderer.render([(2, (2, '調理中'), ()), (1, (1, '調理中'), ())])
+        self.assertEqual(self.tree.calls, ['move'])
+        self.assertEqual(self.tree.rows(), [(2, '調理中'), (1, '調理中')])
+
+    def test_label_text(self):
+        """同じ内容ならconfigureしない"""
+        calls = []
+
+        class Label:
+            def configure(self, **options):
+                calls.append(options)
+
+        text = LabelText(Label(), text="")
+        text.set(text="1")
+        text.set(text="1")
+        self.assertEqual(calls, [{'text': "1"}])
+
+
+class TestSoundCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loaded = []
+
+        def loader(path):
+            self.loaded.append(path)
+            return f"sound:{path}"
+
+        self.cache = SoundCache(loader, max_bytes=30, size_of=lambda path, sound: 10)
+
+    def test_hit_and_miss(self):
+        """2回目以降は読み込まずにキャッシュから返す"""
+        self.assertEqual(self.cache.get("a"), "sound:a")
+        self.assertEqual(self.cache.get("a"), "sound:a")
+        self.assertEqual(self.loaded, ["a"])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_lru_eviction_keeps_pinned(self):
+        """上限を超えると固定以外の古いものから捨てる"""
+        self.cache.preload(["b", "c"], pinned=("prefix",))
+        self.cache.get("b")
+        self.cache.get("d")
+        self.assertEqual(list(self.cache.sounds), ["prefix", "b", "d"])
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+
+class TestAnnouncer(unittest.TestCase):
+
+    def setUp(self):
+        self.played = []
+        self.release = threading.Event()
+
+        def play(number, cancelled):
+            self.played.append(number)
+            # 取り消されるか、テスト側が解放するまで再生中のまま
+            while not cancelled.is_set() and not self.release.wait(0.01):
+                pass
+
+        self.announcer = Announcer(play, maxsize=2)
+
+    def tearDown(self):
+        self.release.set()
+        self.announcer.stop(timeout=1)
+
+    def wait_until(self, predicate):
+        for _ in range(200):
+            if predicate():
+                return
+            time.sleep(0.005)
+        self.fail("timeout")
+
+    def test_queue_coalesce_and_bound(self):
+        """重複は追加せず、上限を超えたら断る"""
+        self.announcer.announce(1)
+        self.wait_until(lambda: self.played == [1])
+        self.assertTrue(self.announcer.announce(2))
+        self.assertFalse(self.announcer.announce(2))
+        self.assertTrue(self.announcer.announce(3))
+        self.assertFalse(self.announcer.announce(4))
+        stats = self.announcer.stats()
+        self.assertEqual((stats["queue_depth"], stats["coalesced"], stats["dropped"]), (2, 1, 1))
+        self.release.set()
+        self.wait_until(lambda: self.played == [1, 2, 3])
+
+    def test_combined_announcement(self):
+        """まとめた番号は1回の呼び出しにし、待っている番号と取り消した番号は除く"""
+        self.announcer.announce(9)
+        self.wait_until(lambda: self.played == [9])
+        self.assertTrue(self.announcer.announce(2))
+        self.assertTrue(self.announcer.announce([1, 2, 3, 1]))
+        self.assertFalse(self.announcer.announce([2, 3]))
+        self.announcer.cancel(3)
+        self.release.set()
+        self.wait_until(lambda: self.played == [9, 2, 1])
+
+    def test_cancel_combined(self):
+        """再生中のまとめた呼び出しは、すべての番号が取り消されたら止める"""
+        self.announcer.announce((1, 2))
+        self.wait_until(lambda: self.played == [(1, 2)])
+        self.announcer.cancel(1)
+        self.assertIsNotNone(self.announcer.current)
+        self.announcer.cancel(2)
+        self.wait_until(lambda: self.announcer.current is None)
+
+    def test_cancel(self):
+        """待機中・再生中の番号を取り消せる"""
+        self.announcer.announce(1)
+        self.wait_until(lambda: self.played == [1])
+        self.announcer.announce(2)
+        self.announcer.cancel(2)
+        self.announcer.cancel(1)
+        self.wait_until(lambda: self.announcer.current is None)
+        self.assertEqual(self.played, [1])
+        self.assertEqual(self.announcer.stats()["cancelled"], 2)
+
+
+class FakeChannel:
+    """クリップを順に再生したことにするチャンネル（キューは1つだけで、積み直すと置き換わる）"""
+
+    def __init__(self):
+        self.timeline = []  # (開始時刻, クリップ)
+        self.replaced = []
+
+    def play(self, sound):
+        self.timeline = [(time.perf_counter(), sound)]
+
+    def queue(self, sound):
+        start, last = self.timeline[-1]
+        if start > time.perf_counter():  # 前に積んだクリップがまだ再生に移っていない
+            self.replaced.append(self.timeline.pop()[1])
+            start, last = self.timeline[-1]
+        self.timeline.append((start + last.get_length(), sound))
+
+    def stop(self):
+        pass
+
+
+class TestPlaySound(unittest.TestCase):
+
+    def test_clips_chain_through_queue(self):
+        """クリップは前のクリップの再生中に積み、置き換えずに全部つながる"""
+        import play_sound
+        channel = FakeChannel()
+        sounds = {path: Mock(get_length=lambda: 0.03) for path in
+                  (play_sound.num_wav, play_sound.number_wav(1), play_sound.number_wav(2), play_sound.providing_wav)}
+        with patch.object(play_sound, 'pygame', Mock()) as pygame, \
+                patch.object(play_sound, 'wait_for_mixer', lambda: None), \
+                patch.object(play_sound.sound_cache, 'get', sounds.get):
+            pygame.mixer.Channel.return_value = channel
+            start = time.perf_counter()
+            play_sound.play_sound((1, 2))
+        self.assertEqual([sound for _, sound in channel.timeline], list(sounds.values()))
+        self.assertEqual(channel.replaced, [])
+        self.assertGreaterEqual(time.perf_counter() - start, 0.12)
+
+class TestAudioRender(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def make_wav(self, name, samples, rate=24000, channels=1):
+        path = os.path.join(self.tmpdir.name, name)
+        with wave.open(path, "wb") as wav:
+            wav.setnchannels(channels)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(array("h", samples).tobytes())
+        return path
+
+    def test_convert(self):
+        """モノラル→ステレオと、周波数の変換"""
+        stereo = audio_render.convert(array("h", [0, 100]), 24000, 1, 24000, 2)
+        self.assertEqual(list(stereo), [0, 0, 100, 100])
+        with patch.object(audio_render, 'audioop', None):
+            doubled = audio_render.convert(array("h", [0, 100]), 24000, 1, 48000, 1)
+        self.assertEqual(list(doubled), [0, 50, 100, 100])
+
+    @unittest.skipIf(audio_render.audioop is None, "audioopがない")
+    def test_audioop_matches(self):
+        """audioopでのリサンプリングは線形補間とほぼ同じ結果になる"""
+        track = array("h", (int(10000 * math.sin(i / 7)) for i in range(2400)))
+        fast = audio_render._resample(track, 24000, 44100)
+        with patch.object(audio_render, 'audioop', None):
+            slow = audio_render._resample(track, 24000, 44100)
+        self.assertLessEqual(abs(len(fast) - len(slow)), 1)
+        self.assertLessEqual(max(abs(a - b) for a, b in zip(fast, slow)), 2)
+
+    def test_render_announcement(self):
+        """3つのクリップを1つのバイト列に連結"""
+        paths = [self.make_wav("a.wav", [1, 2]), self.make_wav("b.wav", [3]), self.make_wav("c.wav", [4, 5])]
+        frames = audio_render.render_announcement(paths, 24000, 2)
+        self.assertEqual(list(array("h", frames)), [1, 1, 2, 2, 3, 3, 4, 4, 5, 5])
+
+        out = audio_render.announcement_path(self.tmpdir.name, 24000, 2, 7)
+        audio_render.write_wav(out, 24000, 2, frames)
+        with wave.open(out, "rb") as wav:
+            self.assertEqual((wav.getnchannels(), wav.getframerate(), wav.getnframes()), (2, 24000, 5))
+
+    def test_voice_bundle(self):
+        """クリップと連結済み音声を1つのファイルにまとめ、mmapのスライスで取り出す"""
+        prefix = self.make_wav("metan_num.wav", [1, 2])
+        suffix = self.make_wav("metan_providing.wav", [9])
+        clip = self.make_wav("metan_3.wav", [3, 4, 5], rate=48000)
+        path = voice_bundle.build_bundle(self.tmpdir.name, 24000, 2)
+        self.assertEqual(path, voice_bundle.bundle_path(self.tmpdir.name, 24000, 2))
+
+        bundle = voice_bundle.VoiceBundle(path)
+        self.addCleanup(bundle.close)
+        self.assertTrue(bundle.matches(24000, 2))
+        self.assertEqual(sorted(bundle.entries), ['3', 'call_3', 'num', 'providing'])
+        self.assertIn(voice_bundle.clip_name(clip), bundle)
+
+        call = bundle.get('call_3')
+        self.assertIs(call.obj, bundle.map)
+        self.assertEqual(call.tobytes(), audio_render.render_announcement([prefix, clip, suffix], 24000, 2))
+        self.assertEqual(list(array("h", bundle.get('num').tobytes())), [1, 1, 2, 2])
+        self.assertTrue(all(start % voice_bundle.ALIGN == 0 for start, _ in bundle.entries.values()))
+
+    def test_voice_bundle_broken(self):
+        """形式が違うファイルは開かない"""
+        path = os.path.join(self.tmpdir.name, "broken.bundle")
+        with open(path, "wb") as f:
+            f.write(b"RIFF" + bytes(64))
+        with self.assertRaises(ValueError):
+            voice_bundle.VoiceBundle(path)
+
+
 if __name__ == '__main__':
     unittest.main()
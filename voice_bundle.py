@@ -0,0 +1,143 @@
+"""呼び出し音声をまとめた1つのファイル（バンドル）の作成と読み込み
+
+sound/ のクリップ（metan_*.wav）と、番号ごとの連結済み音声を
+ミキサーの形式（16bit符号付き・リトルエンディアン）に揃えて1つのファイルへ詰める。
+実行時はファイルを1回mmapするだけで、各音声はそのスライス（memoryview）として取り出す。
+
+ファイルの形式:
+    ヘッダー   : マジック "VOXB", バージョン, サンプリング周波数, チャンネル数, サンプル幅, 件数
+    目次       : 件数 × (名前 32バイト, 開始位置, バイト数)
+    データ     : 各音声のPCM（ALIGNバイト境界に揃える）
+
+作成:
+    python voice_bundle.py --rate 44100 --channels 2
+"""
+import argparse
+import mmap
+import os
+import re
+import struct
+import sys
+
+import audio_render
+
+MAGIC = b"VOXB"
+VERSION = 1
+HEADER = struct.Struct("<4sHIHHI")
+ENTRY = struct.Struct("<32sQQ")
+ALIGN = 16
+
+
+def bundle_path(sound_dir, rate, channels):
+    """ミキサーの形式ごとのバンドルのパス"""
+    return os.path.join(sound_dir, f"voices_{rate}hz_{channels}ch.bundle")
+
+
+def clip_name(path):
+    """クリップのファイル名からバンドル内の名前を求める（metan_12.wav -> "12"）"""
+    match = re.fullmatch(r"metan_(.+)\.wav", os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def call_name(number):
+    """番号ごとの連結済み音声の名前"""
+    return f"call_{number}"
+
+
+def write_bundle(path, rate, channels, clips):
+    """(名前, PCMのバイト列) の並びをバンドルとして保存"""
+    clips = list(clips)
+    offset = HEADER.size + ENTRY.size * len(clips)
+    entries = []
+    for name, frames in clips:
+        offset = -(-offset // ALIGN) * ALIGN
+        entries.append((name, offset, len(frames)))
+        offset += len(frames)
+
+    with audio_render.atomic_write(path) as f:
+        f.write(HEADER.pack(MAGIC, VERSION, rate, channels, audio_render.SAMPLE_WIDTH, len(clips)))
+        for name, start, length in entries:
+            encoded = name.encode("utf-8")
+            if len(encoded) > ENTRY.size - 16:
+                raise ValueError(f"名前が長すぎます: {name}")
+            f.write(ENTRY.pack(encoded, start, length))
+        for (name, start, length), (_, frames) in zip(entries, clips):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(frames)
+
+
+def build_bundle(sound_dir, rate, channels, path=None):
+    """sound_dirのクリップと番号ごとの連結済み音声を1つのバンドルにまとめ、パスを返す"""
+    numbers = audio_render.clip_numbers(sound_dir)
+    prefix = os.path.join(sound_dir, "metan_num.wav")
+    suffix = os.path.join(sound_dir, "metan_providing.wav")
+    number_clips = [os.path.join(sound_dir, f"metan_{number}.wav") for number in numbers]
+
+    converted = {}  # 変換済みのクリップを連結済み音声にも使い回す
+    clips = [(clip_name(clip), audio_render.render_announcement([clip], rate, channels, converted))
+             for clip in [prefix, suffix, *number_clips]]
+    for number, clip in zip(numbers, number_clips):
+        clips.append((call_name(number),
+                      audio_render.render_announcement([prefix, clip, suffix], rate, channels, converted)))
+
+    path = path or bundle_path(sound_dir, rate, channels)
+    write_bundle(path, rate, channels, clips)
+    return path
+
+
+class VoiceBundle:
+    """バンドルをmmapして、名前で音声のPCMを取り出す"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.view = memoryview(self.map)
+            if len(self.map) < HEADER.size:
+                raise ValueError(f"バンドルが壊れています: {path}")
+            magic, version, self.rate, self.channels, self.sample_width, count = HEADER.unpack_from(self.map)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"バンドルの形式が違います: {path}")
+            self.entries = {}  # 名前 -> (開始位置, バイト数)
+            for index in range(count):
+                name, start, length = ENTRY.unpack_from(self.map, HEADER.size + ENTRY.size * index)
+                if start + length > len(self.map):
+                    raise ValueError(f"バンドルが壊れています: {path}")
+                self.entries[name.rstrip(b"\0").decode("utf-8")] = (start, length)
+        except Exception:
+            self.close()
+            raise
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get(self, name):
+        """音声のPCMをコピーせずに返す（memoryview）"""
+        start, length = self.entries[name]
+        return self.view[start:start + length]
+
+    def matches(self, rate, channels):
+        """ミキサーの形式と同じか"""
+        return (self.rate, self.channels, self.sample_width) == (rate, channels, audio_render.SAMPLE_WIDTH)
+
+    def close(self):
+        view = getattr(self, "view", None)
+        if view is not None:
+            view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # 取り出したスライスがまだ使われている
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="呼び出し音声を1つのバンドルファイルにまとめる")
+    parser.add_argument("--sound-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sound"))
+    parser.add_argument("--rate", type=int, default=44100, help="ミキサーのサンプリング周波数")
+    parser.add_argument("--channels", type=int, default=2, help="ミキサーのチャンネル数")
+    parser.add_argument("--output", help="出力先（省略時は sound/voices_{rate}hz_{channels}ch.bundle）")
+    args = parser.parse_args()
+
+    path = build_bundle(args.sound_dir, args.rate, args.channels, args.output)
+    print(f"{path} ({os.path.getsize(path)} bytes)", file=sys.stderr)
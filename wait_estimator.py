@@ -0,0 +1,58 @@
+"""待ち時間の見積もり
+
+注文の受付から呼び出し（調理中→呼出中）までの時間の指数移動平均を、イベントごとにO(1)で更新する。
+起動時に直近の分をDBから一度だけ読み、以降は表示のたびに表を読むことはない。
+"""
+import math
+import time
+from collections import deque
+from events import StatusChanged
+
+ALPHA = 0.2  # 新しく呼び出した注文の重み
+SEED_SAMPLES = 50  # 起動時にDBから読む直近の件数
+
+
+class WaitEstimator:
+    """調理時間（秒）の指数移動平均"""
+
+    def __init__(self, store, alpha=ALPHA, clock=time.time):
+        self.store = store
+        self.alpha = alpha
+        self.clock = clock
+        self.mean = None  # まだ記録がなければNone
+        self.count = 0
+        # (チケットID, 更新前の平均, 更新前の件数) 直近の呼び出しが新しい順に取り消されたら戻す
+        self.history = deque(maxlen=64)
+        store.bus.subscribe(StatusChanged, self.on_status_changed)
+
+    def observe(self, seconds):
+        self.mean = seconds if self.mean is None else self.mean + self.alpha * (seconds - self.mean)
+        self.count += 1
+
+    def seed(self, samples):
+        """古い順の調理時間で初期化する"""
+        for seconds in samples:
+            self.observe(seconds)
+
+    def on_status_changed(self, event):
+        if event.old_status == 'cooking' and event.new_status == 'providing':
+            ticket = self.store.tickets.get(event.number)
+            if ticket is None or ticket.accepted_at is None:
+                return
+            self.history.append((event.ticket_id, self.mean, self.count))
+            self.observe(max(0, self.clock() - ticket.accepted_at))
+        elif event.old_status == 'providing' and event.new_status == 'cooking':
+            if self.history and self.history[-1][0] == event.ticket_id:
+                _, self.mean, self.count = self.history.pop()
+
+    def estimate_minutes(self):
+        """今注文したときの待ち時間の目安（分、切り上げ）。記録がなければNone"""
+        if self.mean is None:
+            return None
+        return max(1, math.ceil(self.mean / 60))
+
+    def ready_at(self):
+        """今注文したときにできあがる時刻の目安（UNIX時間）。記録がなければNone"""
+        if self.mean is None:
+            return None
+        return self.clock() + self.mean